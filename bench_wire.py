@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark del formato degli eventi Socket.IO: JSON contro MessagePack
+Gioca un round completo con 8 client di test, registra gli eventi inviati
+dal server e confronta, per tipo di evento, byte e tempo di codifica.
+
+Uso:
+    python bench_wire.py [ripetizioni]
+"""
+
+import os
+import sys
+import json
+import time
+
+# Niente istantanee su disco durante il benchmark
+os.environ.setdefault('SNAPSHOT_DIR', '')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import msgpack
+import web_app
+
+EVENTS = ('round_start', 'voting_start', 'round_results')
+PLAYERS = 8
+
+
+def record_round():
+    """Gioca un round e restituisce {evento: [payload]}"""
+    recorded = {}
+    emit_encoded = web_app.emit_encoded
+
+    def recording(event, data, room, skip_sid=None):
+        recorded.setdefault(event, []).append(data)
+        emit_encoded(event, data, room, skip_sid)
+
+    web_app.emit_encoded = recording
+    try:
+        clients = [web_app.socketio.test_client(web_app.app) for _ in range(PLAYERS)]
+        host = clients[0]
+        host.emit('create_game', {'player_name': 'Giocatore 1', 'num_rounds': 3})
+        room_code = host.get_received()[-1]['args'][0]['room_code']
+        for i, client in enumerate(clients[1:], start=2):
+            client.emit('join_game', {'room_code': room_code, 'player_name': f'Giocatore {i}'})
+        host.emit('start_game', {'room_code': room_code})
+        for i, client in enumerate(clients, start=1):
+            client.emit('submit_meme', {
+                'room_code': room_code,
+                'text1': f'Quando il giocatore {i} scopre che il lunedì arriva ogni settimana',
+                'text2': 'e nessuno lo aveva avvisato'
+            })
+        for _ in range(PLAYERS):
+            for client in clients:
+                client.emit('submit_vote', {'room_code': room_code, 'vote_value': 1})
+        for client in clients:
+            client.disconnect()
+    finally:
+        web_app.emit_encoded = emit_encoded
+    return recorded
+
+
+def measure(encode, payloads, repeat):
+    """Byte medi per evento e microsecondi medi per codifica"""
+    size = sum(len(encode(p)) for p in payloads) / len(payloads)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for payload in payloads:
+            encode(payload)
+    elapsed = (time.perf_counter() - started) / (repeat * len(payloads))
+    return size, elapsed * 1e6
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    repeat = int(argv[0]) if argv else 2000
+    recorded = record_round()
+
+    # Come python-socketio serializza i pacchetti JSON
+    encoders = {
+        'json': lambda data: json.dumps(data, separators=(',', ':')).encode('utf-8'),
+        'msgpack': lambda data: msgpack.packb(data, use_bin_type=True)
+    }
+
+    print(f"\n{'evento':<16}{'formato':<10}{'byte':>10}{'µs/codifica':>14}{'byte vs JSON':>15}")
+    print('-' * 65)
+    for event in EVENTS:
+        payloads = recorded.get(event)
+        if not payloads:
+            print(f"{event:<16}(nessun evento registrato)")
+            continue
+        json_size = None
+        for name, encode in encoders.items():
+            size, micros = measure(encode, payloads, repeat)
+            json_size = json_size or size
+            print(f"{event:<16}{name:<10}{size:>10.0f}{micros:>14.2f}{size / json_size:>14.0%}")
+
+
+if __name__ == '__main__':
+    main()
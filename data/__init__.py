@@ -3,5 +3,16 @@ Data package for Make it Meme
 """
 
 from .templates_db import TemplatesDB
+from .image_catalog import ImageCatalog
+from .image_manifest import ImageManifest
+from .template_dealer import TemplateDealer
+from .image_variants import VariantPipeline
+from .image_store import ImageStore
+from .image_similarity import SimilarityIndex
+from .templates_store import SQLiteTemplateStore
+from .suggestions_store import SuggestionsStore
+from .text_index import InvertedIndex
+from .game_store import MemoryGameStore, RedisGameStore
+from .game_snapshots import SnapshotStore
 
-__all__ = ['TemplatesDB']
+__all__ = ['TemplatesDB', 'ImageCatalog', 'ImageManifest', 'TemplateDealer', 'VariantPipeline', 'ImageStore', 'SimilarityIndex', 'SQLiteTemplateStore', 'SuggestionsStore', 'InvertedIndex', 'MemoryGameStore', 'RedisGameStore', 'SnapshotStore']
@@ -0,0 +1,117 @@
+"""
+Istantanee delle partite su disco
+Un file per stanza con lo stato compresso (MessagePack o JSON + zlib),
+scritto in modo atomico: un file temporaneo viene sostituito a quello
+vecchio solo a scrittura completata, quindi un crash lascia sempre
+l'istantanea precedente intatta. Al riavvio il server ricarica le stanze.
+"""
+
+import os
+import struct
+import zlib
+
+from data.game_store import pack_state, unpack_state
+
+
+class SnapshotStore:
+    """Cartella di istantanee, una per stanza"""
+
+    MAGIC = b'MIS1'
+    SUFFIX = '.snap'
+
+    def __init__(self, directory, level=1):
+        self.directory = directory
+        self.level = level  # Compressione veloce: conta più il tempo dello spazio
+        self._crcs = {}  # {codice: crc dell'ultimo stato scritto}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, room_code):
+        return os.path.join(self.directory, room_code + self.SUFFIX)
+
+    def encode(self, room_code, state):
+        """
+        Istantanea pronta da scrivere: (codice, bytes, crc dello stato)
+        None se lo stato è identico all'ultimo salvato
+        """
+        packed = pack_state(state)
+        crc = zlib.crc32(packed)
+        if self._crcs.get(room_code) == crc:
+            return None
+        payload = zlib.compress(packed, self.level)
+        return room_code, self.MAGIC + struct.pack('>I', zlib.crc32(payload)) + payload, crc
+
+    def write_many(self, encoded):
+        """
+        Scrive un gruppo di istantanee preparate con encode() (solo I/O, adatto a un thread)
+        Ogni file è scritto e sincronizzato prima della rinomina; la cartella una volta sola
+        Restituisce i byte scritti
+        """
+        written = 0
+        for room_code, blob, crc in encoded:
+            path = self._path(room_code)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(blob)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self._crcs[room_code] = crc
+            written += len(blob)
+        if encoded:
+            self.sync_directory()
+        return written
+
+    def save(self, room_code, state):
+        """
+        Scrive lo stato di una stanza se è cambiato
+        Restituisce i byte scritti (0 se lo stato era identico all'ultimo salvato)
+        """
+        encoded = self.encode(room_code, state)
+        return self.write_many([encoded]) if encoded is not None else 0
+
+    def delete(self, room_code):
+        """Elimina l'istantanea di una stanza chiusa"""
+        self._crcs.pop(room_code, None)
+        try:
+            os.remove(self._path(room_code))
+        except FileNotFoundError:
+            pass
+
+    def load_all(self):
+        """Legge tutte le istantanee valide: {codice: stato}"""
+        states = {}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)  # Scrittura interrotta: vale l'istantanea precedente
+                continue
+            if not name.endswith(self.SUFFIX):
+                continue
+            room_code = name[:-len(self.SUFFIX)]
+            try:
+                with open(path, 'rb') as f:
+                    blob = f.read()
+                if blob[:4] != self.MAGIC:
+                    raise ValueError('intestazione non valida')
+                payload = blob[8:]
+                if struct.unpack('>I', blob[4:8])[0] != zlib.crc32(payload):
+                    raise ValueError('checksum errato')
+                packed = zlib.decompress(payload)
+                states[room_code] = unpack_state(packed)
+                self._crcs[room_code] = zlib.crc32(packed)
+            except (OSError, ValueError, zlib.error) as e:
+                print(f"Istantanea {name} ignorata: {e}")
+        return states
+
+    def sync_directory(self):
+        """Rende permanenti le rinomine dei file (sui filesystem che lo richiedono)"""
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
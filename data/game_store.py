@@ -0,0 +1,291 @@
+"""
+Archivio delle partite in corso
+MemoryGameStore è il dizionario di sempre, per un solo processo.
+RedisGameStore salva ogni partita in Redis (o in un server compatibile),
+così più worker gunicorn possono servire le stesse stanze: ogni partita ha
+un numero di versione e viene salvata solo se nessun altro processo l'ha
+modificata nel frattempo (concorrenza ottimistica).
+"""
+
+import json
+import os
+import threading
+
+try:
+    import msgpack
+except ImportError:  # msgpack è opzionale: senza si usa JSON
+    msgpack = None
+
+from utils.resp import RespClient
+
+
+class StaleGameError(Exception):
+    """La partita è stata modificata da un altro processo: l'operazione va ripetuta"""
+
+
+def pack_state(state):
+    """Stato di una partita -> bytes (MessagePack se disponibile, altrimenti JSON)"""
+    if msgpack is not None:
+        return b'm' + msgpack.packb(state, use_bin_type=True)
+    return b'j' + json.dumps(state, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def unpack_state(blob):
+    """bytes -> stato di una partita"""
+    if blob[:1] == b'm':
+        return msgpack.unpackb(blob[1:], raw=False, strict_map_key=False)
+    return json.loads(blob[1:].decode('utf-8'))
+
+
+class MemoryGameStore(dict):
+    """
+    Partite nella memoria del processo: salvare non serve
+    Tiene traccia delle stanze lette o modificate (dirty), per le istantanee su disco
+    """
+
+    shared = False  # Visibile solo a questo processo
+
+    def __init__(self, *args, expires_at=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dirty = set()
+        self.expires_at = expires_at  # Funzione partita -> istante di scadenza
+
+    def __getitem__(self, room_code):
+        game = super().__getitem__(room_code)
+        self.dirty.add(room_code)
+        return game
+
+    def get(self, room_code, default=None):
+        game = super().get(room_code)
+        if game is None:
+            return default
+        self.dirty.add(room_code)
+        return game
+
+    def peek(self, room_code):
+        """Legge una partita senza segnarla come modificata"""
+        return super().get(room_code)
+
+    def __setitem__(self, room_code, game):
+        super().__setitem__(room_code, game)
+        self.dirty.add(room_code)
+
+    def pop(self, room_code, *default):
+        self.dirty.add(room_code)
+        return super().pop(room_code, *default)
+
+    def __delitem__(self, room_code):
+        super().__delitem__(room_code)
+        self.dirty.add(room_code)
+
+    def expiring(self, now, limit=None):
+        """Codici delle stanze scadute entro now, dalla più vecchia"""
+        if self.expires_at is None:
+            return []
+        ranked = sorted((self.expires_at(game), code) for code, game in dict.items(self))
+        return [code for expires, code in ranked if expires <= now][:limit]
+
+    def soonest(self, count=1):
+        """Codici delle count stanze più vicine alla scadenza"""
+        if self.expires_at is None:
+            return []
+        ranked = sorted((self.expires_at(game), code) for code, game in dict.items(self))
+        return [code for _, code in ranked[:count]]
+
+    def try_lock(self, name, ttl):
+        """Un solo processo: il lock è sempre libero"""
+        return True
+
+    def commit(self):
+        """Nulla da salvare: gli oggetti sono già quelli in memoria"""
+
+    def rollback(self):
+        """Nulla da annullare"""
+
+
+class RedisGameStore:
+    """
+    Partite salvate in Redis, con la stessa interfaccia di un dizionario
+    Le partite lette durante un'operazione restano in una sessione locale
+    (per thread o per richiesta) e commit() salva quelle modificate.
+    """
+
+    shared = True
+
+    def __init__(self, client, from_state, prefix='mim:', ttl=6 * 3600, local=None,
+                 expires_at=None):
+        self.client = client
+        self.from_state = from_state  # Funzione stato -> Game
+        self.prefix = prefix
+        self.ttl = ttl  # Le stanze dimenticate spariscono da sole
+        self.rooms_key = f'{prefix}rooms'
+        # Scadenze delle stanze in un sorted set: la pulizia legge solo quelle scadute
+        self.expires_at = expires_at
+        self.expiry_key = f'{prefix}expiry'
+        self.local = local if local is not None else threading.local()
+
+    def _key(self, room_code):
+        return f'{self.prefix}game:{room_code}'
+
+    def _session(self):
+        session = getattr(self.local, 'game_session', None)
+        if session is None:
+            # {codice: [partita, versione letta, bytes letti]} e {codice eliminato: versione letta}
+            session = {'loaded': {}, 'deleted': {}}
+            self.local.game_session = session
+        return session
+
+    def _load(self, room_code):
+        session = self._session()
+        entry = session['loaded'].get(room_code)
+        if entry is not None:
+            return entry[0]
+        if room_code in session['deleted']:
+            return None
+        version, blob = self.client.execute('HMGET', self._key(room_code), 'v', 's')
+        if blob is None:
+            return None
+        game = self.from_state(unpack_state(blob))
+        session['loaded'][room_code] = [game, int(version), blob]
+        return game
+
+    # ---- Interfaccia da dizionario ----
+
+    def get(self, room_code, default=None):
+        game = self._load(room_code)
+        return default if game is None else game
+
+    def __getitem__(self, room_code):
+        game = self._load(room_code)
+        if game is None:
+            raise KeyError(room_code)
+        return game
+
+    def __contains__(self, room_code):
+        session = self._session()
+        if room_code in session['loaded']:
+            return True
+        if room_code in session['deleted']:
+            return False
+        return bool(self.client.execute('EXISTS', self._key(room_code)))
+
+    def __setitem__(self, room_code, game):
+        session = self._session()
+        session['deleted'].pop(room_code, None)
+        # Versione 0: il salvataggio fallisce se un altro processo ha creato la stessa stanza
+        session['loaded'][room_code] = [game, 0, None]
+
+    def pop(self, room_code, default=None):
+        game = self._load(room_code)
+        session = self._session()
+        entry = session['loaded'].pop(room_code, None)
+        if room_code not in session['deleted']:
+            # Versione letta: l'eliminazione fallisce se un altro processo ha salvato dopo
+            session['deleted'][room_code] = entry[1] if entry is not None else None
+        return default if game is None else game
+
+    def __delitem__(self, room_code):
+        if self.pop(room_code) is None:
+            raise KeyError(room_code)
+
+    def keys(self):
+        codes = {code.decode() for code in self.client.execute('SMEMBERS', self.rooms_key)}
+        session = self._session()
+        return sorted((codes | set(session['loaded'])) - set(session['deleted']))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        pairs = []
+        for code in self.keys():
+            game = self._load(code)
+            if game is None:
+                # Stanza scaduta in Redis: si toglie dall'elenco
+                self.client.execute('SREM', self.rooms_key, code)
+            else:
+                pairs.append((code, game))
+        return pairs
+
+    def values(self):
+        return [game for _, game in self.items()]
+
+    def __len__(self):
+        return self.client.execute('SCARD', self.rooms_key)
+
+    # ---- Pulizia ----
+
+    def expiring(self, now, limit=None):
+        """Codici delle stanze scadute entro now, dalla più vecchia"""
+        command = ['ZRANGEBYSCORE', self.expiry_key, '-inf', now]
+        if limit is not None:
+            command += ['LIMIT', 0, limit]
+        return [code.decode() for code in self.client.execute(*command)]
+
+    def soonest(self, count=1):
+        """Codici delle count stanze più vicine alla scadenza"""
+        codes = self.client.execute('ZRANGE', self.expiry_key, 0, count - 1)
+        return [code.decode() for code in codes]
+
+    def try_lock(self, name, ttl):
+        """True se questo processo prende il lock per ttl secondi (uno solo tra i worker)"""
+        return self.client.execute('SET', f'{self.prefix}lock:{name}', os.getpid(),
+                                   'NX', 'EX', ttl) is not None
+
+    # ---- Salvataggio ----
+
+    def commit(self):
+        """
+        Salva le partite modificate ed eliminate in questa sessione, tutte insieme
+        Solleva StaleGameError (senza salvare nulla) se un altro processo ne ha
+        cambiata anche una sola dopo la lettura
+        """
+        session = self._session()
+        self.local.game_session = None
+        writes = []
+        for room_code, (game, version, blob) in session['loaded'].items():
+            new_blob = pack_state(game.to_state())
+            if new_blob != blob:
+                writes.append((room_code, game, version, new_blob))
+        deletes = list(session['deleted'].items())
+        if not writes and not deletes:
+            return
+        # Versioni da verificare; le stanze mai esistite si tolgono solo dall'elenco
+        checked = ([(code, version) for code, _, version, _ in writes]
+                   + [(code, version) for code, version in deletes if version is not None])
+        commands = [('MULTI',)]
+        for room_code, game, version, new_blob in writes:
+            key = self._key(room_code)
+            commands += [('HSET', key, 'v', version + 1, 's', new_blob),
+                         ('EXPIRE', key, self.ttl),
+                         ('SADD', self.rooms_key, room_code)]
+            if self.expires_at is not None:
+                commands.append(('ZADD', self.expiry_key, self.expires_at(game), room_code))
+        for room_code, version in deletes:
+            commands += [('DEL', self._key(room_code)),
+                         ('SREM', self.rooms_key, room_code),
+                         ('ZREM', self.expiry_key, room_code)]
+        commands.append(('EXEC',))
+        with self.client.connection() as conn:
+            if checked:
+                conn.execute('WATCH', *[self._key(code) for code, _ in checked])
+                current = conn.pipeline([('HGET', self._key(code), 'v') for code, _ in checked])
+                if any(int(found or 0) != version
+                       for found, (_, version) in zip(current, checked)):
+                    conn.execute('UNWATCH')
+                    raise StaleGameError(', '.join(code for code, _ in checked))
+            replies = conn.pipeline(commands)
+        if replies[-1] is None:
+            raise StaleGameError(', '.join(code for code, _ in checked))
+
+    def rollback(self):
+        """Dimentica le modifiche non salvate"""
+        self.local.game_session = None
+
+
+def open_game_store(url, from_state, local=None, expires_at=None):
+    """Archivio delle partite: in memoria se url è vuoto, altrimenti redis://..."""
+    if not url:
+        return MemoryGameStore(expires_at=expires_at)
+    return RedisGameStore(RespClient.from_url(url), from_state, local=local,
+                          expires_at=expires_at)
@@ -0,0 +1,126 @@
+"""
+Catalogo in memoria delle immagini dei meme
+Elenca una cartella una sola volta e la rilegge solo quando cambia.
+Se è collegato a un ImageManifest, all'avvio usa l'elenco salvato senza
+rileggere la cartella.
+"""
+
+import os
+import random
+import threading
+import time
+
+from .image_variants import ensure_placeholders
+
+
+class ImageCatalog:
+    """Elenco in memoria delle immagini di una cartella"""
+
+    EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+    def __init__(self, folder, poll_interval=5.0, manifest=None, key=None, similarity=None):
+        self.folder = folder
+        self.manifest = manifest
+        self.similarity = similarity
+        self.key = key or os.path.basename(folder)
+        self.poll_interval = poll_interval  # Secondi tra due controlli del mtime
+        self.images = []  # Un'immagine rappresentativa per ogni gruppo di foto simili
+        self.groups = {}  # {rappresentante: [immagini quasi identiche]}
+        self.version = 0  # Incrementato a ogni ricostruzione dell'elenco
+        self._dir_mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _scan(self):
+        """Legge la cartella con un solo scandir"""
+        images = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(self.EXTENSIONS) and entry.is_file():
+                    images.append(entry.name)
+        images.sort()
+        return images
+
+    def refresh(self, force=False):
+        """
+        Ricostruisce l'elenco se la cartella è cambiata
+        force: ricostruisce sempre (usato dopo un upload)
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                mtime = os.stat(self.folder).st_mtime_ns
+            except OSError:
+                # Cartella assente: catalogo vuoto
+                if self.images or self._dir_mtime is not None:
+                    self.images = []
+                    self.groups = {}
+                    self._dir_mtime = None
+                    self.version += 1
+                return False
+
+            if not force and mtime == self._dir_mtime:
+                return False
+
+            cached = None
+            if self.manifest is not None and not force:
+                cached = self.manifest.cached_listing(self.key, mtime)
+
+            if cached is not None:
+                self.images = cached
+            else:
+                self.images = self._scan()
+                if self.manifest is not None:
+                    self.manifest.sync_folder(self.key, self.folder, mtime, self.images)
+                    self.manifest.save()
+
+            if self.manifest is not None:
+                # Le copie identiche non devono pesare di più nella scelta casuale
+                self.images = self.manifest.unique_names(self.key, self.images)
+                # Segnaposto per i client, calcolato una volta sola per immagine
+                ensure_placeholders(self.manifest, self.key, self.folder, self.images)
+
+            if self.similarity is not None:
+                # Nemmeno le foto quasi identiche: si sceglie prima il gruppo. Gli hash
+                # mancanti (immagini già presenti, non caricate) si calcolano una volta sola
+                self.similarity.ensure_hashes(self.key, self.folder, self.images)
+                self.groups = self.similarity.clusters(self.key, self.images)
+                self.images = list(self.groups)
+            else:
+                self.groups = {}
+
+            self._dir_mtime = mtime
+            self.version += 1
+            return True
+
+    def maybe_refresh(self):
+        """Controlla il mtime della cartella al massimo ogni poll_interval secondi"""
+        if time.monotonic() - self._last_check >= self.poll_interval:
+            self.refresh()
+
+    def list_images(self):
+        """Restituisce una copia dei nomi file"""
+        self.maybe_refresh()
+        return list(self.images)
+
+    def pick_member(self, representative):
+        """Sceglie a caso una delle foto del gruppo di un rappresentante"""
+        members = self.groups.get(representative)
+        return random.choice(members) if members else representative
+
+    def random_image(self):
+        """Sceglie un'immagine casuale in O(1), None se il catalogo è vuoto"""
+        self.maybe_refresh()
+        images = self.images
+        return self.pick_member(random.choice(images)) if images else None
+
+    def info(self, name):
+        """Metadati dal manifest (formato, dimensioni, peso), o None"""
+        if self.manifest is None:
+            return None
+        return self.manifest.get(self.key, name)
+
+    def __len__(self):
+        self.maybe_refresh()
+        return len(self.images)
@@ -0,0 +1,206 @@
+"""
+Manifest persistente delle immagini dei meme
+Conserva su disco i metadati di ogni immagine (dimensioni, peso, formato,
+hash del contenuto) così all'avvio non serve rileggere né decodificare i file
+"""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+
+
+# Byte letti dall'intestazione per ricavare formato e dimensioni
+HEADER_BYTES = 64 * 1024
+
+
+def probe_image(path):
+    """
+    Ricava (formato, larghezza, altezza) leggendo solo l'intestazione del file
+    Restituisce (None, None, None) se il formato non è riconosciuto
+    """
+    with open(path, 'rb') as f:
+        head = f.read(HEADER_BYTES)
+    return probe_header(head)
+
+
+def probe_header(head):
+    """Come probe_image, ma su un buffer già letto"""
+    # PNG: firma + chunk IHDR
+    if head[:8] == b'\x89PNG\r\n\x1a\n' and len(head) >= 24:
+        width, height = struct.unpack('>II', head[16:24])
+        return 'png', width, height
+
+    # GIF: dimensioni logiche dello schermo
+    if head[:6] in (b'GIF87a', b'GIF89a') and len(head) >= 10:
+        width, height = struct.unpack('<HH', head[6:10])
+        return 'gif', width, height
+
+    # WebP: contenitore RIFF con chunk VP8 / VP8L / VP8X
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP' and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', head[26:30])
+            return 'webp', width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':
+            bits = struct.unpack('<I', head[21:25])[0]
+            return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            width = int.from_bytes(head[24:27], 'little') + 1
+            height = int.from_bytes(head[27:30], 'little') + 1
+            return 'webp', width, height
+        return 'webp', None, None
+
+    # JPEG: scorre i marker fino al primo SOFn
+    if head[:2] == b'\xff\xd8':
+        i = 2
+        while i + 9 < len(head):
+            if head[i] != 0xFF:
+                i += 1
+                continue
+            marker = head[i + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+                i += 1 if marker == 0xFF else 2
+                continue
+            length = struct.unpack('>H', head[i + 2:i + 4])[0]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', head[i + 5:i + 9])
+                return 'jpeg', width, height
+            i += 2 + length
+        return 'jpeg', None, None
+
+    return None, None, None
+
+
+class ImageManifest:
+    """
+    Metadati delle immagini salvati in un unico file JSON
+    Ogni voce è valida finché mtime e dimensione del file non cambiano
+    """
+
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.folders = {}  # {chiave_cartella: {'mtime_ns': int, 'files': {nome: info}}}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Carica il manifest con una sola lettura"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if data.get('version') == self.VERSION:
+            self.folders = data.get('folders', {})
+
+    def save(self):
+        """Salva il manifest in modo atomico, solo se è cambiato"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': self.VERSION, 'folders': self.folders}
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def cached_listing(self, key, dir_mtime):
+        """Elenco dei file salvato, se la cartella non è cambiata da allora"""
+        record = self.folders.get(key)
+        if record and record.get('mtime_ns') == dir_mtime:
+            return sorted(record['files'])
+        return None
+
+    def get(self, key, name):
+        """Metadati di un'immagine, o None se sconosciuta"""
+        record = self.folders.get(key)
+        return record['files'].get(name) if record else None
+
+    def set_extra(self, key, name, field, value):
+        """
+        Aggiunge un dato derivato a un'immagine (es. varianti)
+        Il dato viene scartato automaticamente se il file cambia
+        """
+        with self._lock:
+            info = self.get(key, name)
+            if info is not None:
+                info[field] = value
+                self._dirty = True
+
+    def add_file(self, key, folder, name, sha256=None):
+        """Registra subito un file appena salvato (es. da un upload)"""
+        path = os.path.join(folder, name)
+        st = os.stat(path)
+        with self._lock:
+            record = self.folders.setdefault(key, {'mtime_ns': None, 'files': {}})
+            record['files'][name] = self._describe(path, st, sha256)
+            self._dirty = True
+
+    def unique_names(self, key, names):
+        """Scarta i file con contenuto identico a uno già elencato"""
+        seen = set()
+        unique = []
+        for name in names:
+            info = self.get(key, name)
+            digest = info.get('sha256') if info else None
+            if digest is not None:
+                if digest in seen:
+                    continue
+                seen.add(digest)
+            unique.append(name)
+        return unique
+
+    def sync_folder(self, key, folder, dir_mtime, names):
+        """
+        Allinea il manifest al contenuto reale della cartella
+        Rilegge l'intestazione solo dei file nuovi o modificati
+        """
+        with self._lock:
+            record = self.folders.get(key) or {'mtime_ns': None, 'files': {}}
+            old_files = record['files']
+            files = {}
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                info = old_files.get(name)
+                if info and info['mtime_ns'] == st.st_mtime_ns and info['size'] == st.st_size:
+                    files[name] = info
+                    continue
+                files[name] = self._describe(path, st)
+                self._dirty = True
+
+            if files.keys() != old_files.keys() or record['mtime_ns'] != dir_mtime:
+                self._dirty = True
+            self.folders[key] = {'mtime_ns': dir_mtime, 'files': files}
+
+    def _describe(self, path, st, sha256=None):
+        """Calcola i metadati di un singolo file, con una sola lettura"""
+        fmt, width, height = None, None, None
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(HEADER_BYTES)
+                fmt, width, height = probe_header(head)
+                if sha256 is None:
+                    sha = hashlib.sha256(head)
+                    for chunk in iter(lambda: f.read(HEADER_BYTES), b''):
+                        sha.update(chunk)
+                    sha256 = sha.hexdigest()
+        except OSError:
+            pass
+        return {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'format': fmt,
+            'width': width,
+            'height': height,
+            'sha256': sha256
+        }
@@ -0,0 +1,209 @@
+"""
+Indice delle immagini quasi identiche
+Calcola un hash percettivo (dHash a 64 bit) di ogni immagine e lo
+conserva in un BK-tree: trovare le immagini simili a una nuova richiede
+pochi confronti invece di scorrere tutta la libreria.
+
+Richiede Pillow e NumPy: se mancano l'indice resta vuoto e nessuna
+immagine viene raggruppata.
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # Pillow e NumPy sono opzionali
+    np = None
+    Image = None
+
+
+# Distanza di Hamming massima tra due hash per considerarli la stessa foto
+NEAR_DUPLICATE_DISTANCE = 6
+
+
+def dhash(path, hash_size=8):
+    """Difference hash: confronta i pixel adiacenti di una miniatura in scala di grigi"""
+    with Image.open(path) as img:
+        # Per i JPEG decodifica direttamente a risoluzione ridotta
+        img.draft('L', (hash_size * 8, hash_size * 8))
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+
+def hamming(a, b):
+    """Numero di bit diversi tra due hash"""
+    return bin(a ^ b).count('1')
+
+
+def _hash_file(path):
+    """dHash di un file, None se non leggibile (eseguita nei processi del pool)"""
+    try:
+        return dhash(path)
+    except Exception:
+        return None
+
+
+class BKTree:
+    """Albero Burkhard-Keller sulla distanza di Hamming"""
+
+    def __init__(self):
+        self.root = None  # Nodo: [hash, elemento, {distanza: figlio}]
+        self.size = 0
+
+    def add(self, value, item):
+        """Inserisce un hash con l'elemento associato"""
+        self.size += 1
+        if self.root is None:
+            self.root = [value, item, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Elementi entro max_distance: lista di (distanza, elemento)"""
+        results = []
+        if self.root is None:
+            return results
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.append((distance, node[1]))
+            # Per la disuguaglianza triangolare basta visitare questi figli
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda r: r[0])
+        return results
+
+
+class SimilarityIndex:
+    """Hash percettivi delle immagini, salvati nel manifest e indicizzati per cartella"""
+
+    def __init__(self, manifest, max_distance=NEAR_DUPLICATE_DISTANCE):
+        self.manifest = manifest
+        self.max_distance = max_distance
+        self.trees = {}  # {chiave_cartella: BKTree}
+
+    @property
+    def enabled(self):
+        """True se Pillow e NumPy sono disponibili"""
+        return Image is not None and np is not None
+
+    def get_hash(self, key, name):
+        """Hash salvato nel manifest, o None"""
+        info = self.manifest.get(key, name)
+        value = info.get('phash') if info else None
+        return int(value, 16) if value else None
+
+    def ensure_hashes(self, key, folder, names, workers=None):
+        """
+        Calcola gli hash mancanti, in parallelo se sono molti
+        Restituisce il numero di hash calcolati
+        """
+        if not self.enabled:
+            return 0
+        missing = [name for name in names
+                   if (self.manifest.get(key, name) or {}).get('phash') is None]
+        if not missing:
+            return 0
+
+        paths = [os.path.join(folder, name) for name in missing]
+        if len(paths) > 8:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                hashes = list(executor.map(_hash_file, paths, chunksize=4))
+        else:
+            hashes = [_hash_file(path) for path in paths]
+
+        for name, value in zip(missing, hashes):
+            # Stringa vuota per i file illeggibili: non si riprova a ogni aggiornamento
+            self.manifest.set_extra(key, name, 'phash', '' if value is None else f'{value:016x}')
+        self.manifest.save()
+        return len(missing)
+
+    def rebuild(self, key, names):
+        """Ricostruisce l'albero di una cartella"""
+        tree = BKTree()
+        for name in names:
+            value = self.get_hash(key, name)
+            if value is not None:
+                tree.add(value, name)
+        self.trees[key] = tree
+        return tree
+
+    def add(self, key, folder, name):
+        """
+        Indicizza una nuova immagine e restituisce quelle quasi identiche già presenti
+        """
+        if not self.enabled:
+            return []
+        self.ensure_hashes(key, folder, [name])
+        value = self.get_hash(key, name)
+        if value is None:
+            return []
+        tree = self.trees.setdefault(key, BKTree())
+        matches = [item for _, item in tree.search(value, self.max_distance) if item != name]
+        tree.add(value, name)
+        return matches
+
+    def find_similar(self, key, name):
+        """Immagini quasi identiche a una già indicizzata"""
+        value = self.get_hash(key, name)
+        tree = self.trees.get(key)
+        if value is None or tree is None:
+            return []
+        return [item for _, item in tree.search(value, self.max_distance) if item != name]
+
+    def clusters(self, key, names):
+        """
+        Raggruppa le immagini quasi identiche
+        Restituisce {rappresentante: [membri]}, un gruppo per ogni foto distinta
+        """
+        tree = self.rebuild(key, names)
+        groups = {}
+        assigned = {}
+        for name in names:
+            if name in assigned:
+                continue
+            value = self.get_hash(key, name)
+            members = [name]
+            if value is not None:
+                members += [item for _, item in tree.search(value, self.max_distance)
+                            if item != name and item not in assigned]
+            for member in members:
+                assigned[member] = name
+            groups[name] = members
+        return groups
+
+
+if __name__ == '__main__':
+    # Indicizza in parallelo le immagini già presenti e mostra i gruppi trovati
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from data.templates_db import TemplatesDB
+
+    db = TemplatesDB()
+    if not db.similarity.enabled:
+        print("Pillow/NumPy non installati: impossibile calcolare gli hash")
+        sys.exit(1)
+    for image_type, catalog in db.catalogs.items():
+        names = catalog.list_images()
+        computed = db.similarity.ensure_hashes(image_type, catalog.folder, names,
+                                               workers=os.cpu_count())
+        groups = db.similarity.clusters(image_type, names)
+        print(f"{image_type}: {computed} hash calcolati, "
+              f"{len(names)} immagini in {len(groups)} gruppi")
+        for representative, members in groups.items():
+            if len(members) > 1:
+                print(f"  ≈ {', '.join(members)}")
@@ -0,0 +1,166 @@
+"""
+Archivio delle immagini caricate, indirizzato per contenuto
+Ogni file viene salvato con il nome derivato dal suo hash SHA-256:
+caricare di nuovo la stessa immagine non occupa altro spazio.
+Una tabella di alias ricorda il nome originale di ogni upload.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageStore:
+    """Salvataggio deduplicato delle immagini nelle cartelle classic/custom"""
+
+    # Caratteri dell'hash usati nel nome file (128 bit)
+    NAME_HASH_LENGTH = 32
+
+    def __init__(self, base_path, manifest, aliases_file):
+        self.base_path = base_path
+        self.manifest = manifest
+        self.aliases_file = aliases_file
+        self.aliases = {}  # {image_type: {nome_originale: nome_salvato}}
+        self.display_names = {}  # {image_type: {nome_salvato: nome_originale}}
+        self._by_hash = {}  # {image_type: {sha256: nome_salvato}}, costruito dal manifest
+        self._lock = threading.Lock()
+        self.load_aliases()
+
+    def load_aliases(self):
+        """Carica la tabella degli alias"""
+        try:
+            with open(self.aliases_file, 'r', encoding='utf-8') as f:
+                self.aliases = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.aliases = {}
+        self.display_names = {}
+        for image_type, names in self.aliases.items():
+            for original, stored in names.items():
+                # Solo i file salvati con nome hash: gli altri hanno già un nome leggibile
+                if self._is_hash_name(stored):
+                    self.display_names.setdefault(image_type, {}).setdefault(stored, original)
+
+    def _is_hash_name(self, name):
+        """True se il nome file è stato generato dall'hash del contenuto"""
+        stem = os.path.splitext(name)[0]
+        return len(stem) == self.NAME_HASH_LENGTH and all(c in '0123456789abcdef' for c in stem)
+
+    def save_aliases(self):
+        """Salva la tabella degli alias in modo atomico"""
+        tmp_path = f'{self.aliases_file}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.aliases, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.aliases_file)
+
+    def _hash_index(self, image_type):
+        """Indice hash -> nome file, costruito una volta dal manifest"""
+        index = self._by_hash.get(image_type)
+        if index is None:
+            index = {}
+            record = self.manifest.folders.get(image_type, {})
+            for name, info in sorted(record.get('files', {}).items()):
+                if info.get('sha256'):
+                    index.setdefault(info['sha256'], name)
+            self._by_hash[image_type] = index
+        return index
+
+    def find_by_hash(self, image_type, digest):
+        """Nome del file con questo contenuto, o None"""
+        name = self._hash_index(image_type).get(digest)
+        if name and not os.path.exists(os.path.join(self.base_path, image_type, name)):
+            # File rimosso a mano: dimentica la voce
+            del self._by_hash[image_type][digest]
+            return None
+        return name
+
+    def original_name(self, image_type, stored_name):
+        """Nome con cui l'immagine è stata caricata, se noto"""
+        return self.display_names.get(image_type, {}).get(stored_name)
+
+    def new_upload(self):
+        """Apre un file temporaneo per un upload in arrivo"""
+        os.makedirs(self.base_path, exist_ok=True)
+        return UploadWriter(self.base_path)
+
+    def save_upload(self, image_type, stream, original_name):
+        """
+        Salva un upload calcolando l'hash durante la copia
+        Restituisce (nome_salvato, duplicato)
+        """
+        writer = self.new_upload()
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return self.commit(image_type, writer, original_name)
+
+    def commit(self, image_type, writer, original_name, ext=None):
+        """
+        Sposta il file temporaneo al suo nome definitivo, o lo scarta se è un doppione
+        Restituisce (nome_salvato, duplicato)
+        """
+        writer.close()
+        digest = writer.digest
+        if ext is None:
+            ext = os.path.splitext(original_name)[1].lower()
+        folder = os.path.join(self.base_path, image_type)
+        os.makedirs(folder, exist_ok=True)
+
+        with self._lock:
+            stored_name = self.find_by_hash(image_type, digest)
+            duplicate = stored_name is not None
+            if duplicate:
+                writer.abort()
+            else:
+                stored_name = f'{digest[:self.NAME_HASH_LENGTH]}{ext}'
+                os.replace(writer.path, os.path.join(folder, stored_name))
+                self._hash_index(image_type)[digest] = stored_name
+                self.manifest.add_file(image_type, folder, stored_name, sha256=digest)
+
+            self.aliases.setdefault(image_type, {})[original_name] = stored_name
+            if self._is_hash_name(stored_name):
+                self.display_names.setdefault(image_type, {}).setdefault(stored_name, original_name)
+            self.save_aliases()
+            return stored_name, duplicate
+
+
+class UploadWriter:
+    """File temporaneo che calcola hash e dimensione mentre viene scritto"""
+
+    def __init__(self, folder):
+        fd, self.path = tempfile.mkstemp(dir=folder, suffix='.upload')
+        self._file = os.fdopen(fd, 'wb')
+        self._sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        """Scrive un blocco aggiornando hash e dimensione"""
+        self._sha.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    @property
+    def digest(self):
+        """SHA-256 esadecimale del contenuto scritto finora"""
+        return self._sha.hexdigest()
+
+    def close(self):
+        """Chiude il file senza eliminarlo"""
+        if not self._file.closed:
+            self._file.close()
+
+    def abort(self):
+        """Chiude ed elimina il file temporaneo"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
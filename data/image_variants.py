@@ -0,0 +1,218 @@
+"""
+Varianti ridimensionate delle immagini dei meme
+Al momento dell'upload genera una miniatura e una versione per il gioco
+in formati moderni (WebP e, se disponibile, AVIF), senza dati EXIF
+e con l'orientamento già applicato. Nello stesso passaggio calcola il
+segnaposto (colore dominante e dimensioni orientate) mostrato dai client
+mentre l'immagine si carica; per le immagini già presenti il catalogo lo
+calcola da solo alla prima lettura della cartella.
+
+Richiede Pillow: se non è installato le varianti non vengono generate
+e i client ricevono l'immagine originale.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow è opzionale
+    Image = None
+
+
+# Lato maggiore in pixel di ogni variante
+VARIANT_SIZES = {
+    'thumb': 320,
+    'game': 960
+}
+
+# Tag EXIF dell'orientamento e valori che scambiano larghezza e altezza
+EXIF_ORIENTATION = 0x0112
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+# Qualità di compressione per formato
+FORMAT_QUALITY = {
+    'webp': 80,
+    'avif': 55
+}
+
+
+def available_formats():
+    """Formati moderni supportati dall'installazione di Pillow"""
+    if Image is None:
+        return []
+    formats = ['webp'] if features.check('webp') else []
+    if features.check('avif'):
+        formats.append('avif')
+    return formats
+
+
+def variant_relpath(image_type, filename, size, fmt):
+    """Percorso della variante relativo alla cartella memes"""
+    return f"variants/{image_type}/{filename}.{size}.{fmt}"
+
+
+def dominant_color(img):
+    """Colore più frequente di un'immagine, come stringa #rrggbb"""
+    small = img.convert('RGB')
+    small.thumbnail((64, 64))
+    palette_img = small.quantize(colors=5)
+    palette = palette_img.getpalette()
+    count, index = max(palette_img.getcolors())
+    r, g, b = palette[index * 3:index * 3 + 3]
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def placeholder_fields(path):
+    """
+    Segnaposto di un'immagine senza generare le varianti: colore dominante e
+    dimensioni con l'orientamento EXIF applicato. None se il file non è leggibile
+    """
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            if img.getexif().get(EXIF_ORIENTATION) in ROTATED_ORIENTATIONS:
+                width, height = height, width
+            # Per i JPEG decodifica direttamente a risoluzione ridotta
+            img.draft('RGB', (64, 64))
+            return {'color': dominant_color(img), 'display_size': [width, height]}
+    except Exception:
+        return None
+
+
+def ensure_placeholders(manifest, key, folder, names, workers=None):
+    """
+    Calcola il segnaposto delle immagini che non lo hanno ancora (es. già presenti
+    prima dell'avvio), in parallelo se sono molte. Restituisce quante ne ha calcolate
+    """
+    if Image is None:
+        return 0
+    missing = [name for name in names if 'color' not in (manifest.get(key, name) or {})]
+    if not missing:
+        return 0
+
+    paths = [os.path.join(folder, name) for name in missing]
+    if len(paths) > 8:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(placeholder_fields, paths, chunksize=4))
+    else:
+        results = [placeholder_fields(path) for path in paths]
+
+    for name, fields in zip(missing, results):
+        # Colore None per i file illeggibili: non si riprova a ogni aggiornamento
+        for field, value in (fields or {'color': None}).items():
+            manifest.set_extra(key, name, field, value)
+    manifest.save()
+    return len(missing)
+
+
+def build_variants(source_path, base_path, image_type, filename):
+    """
+    Genera tutte le varianti di un'immagine (eseguita in un processo separato)
+    Restituisce {'variants': {dimensione: {formato: percorso}}, 'color': ..., 'display_size': [w, h]}
+    """
+    formats = available_formats()
+
+    with Image.open(source_path) as img:
+        # Le GIF animate restano originali (gli MPO dei telefoni invece
+        # risultano "animati" ma si usa solo il primo fotogramma). Va letto
+        # prima di exif_transpose, che restituisce una copia senza formato
+        animated_gif = img.format == 'GIF' and getattr(img, 'is_animated', False)
+        img = ImageOps.exif_transpose(img)
+        result = {
+            'color': dominant_color(img),
+            'display_size': list(img.size),
+            'variants': {}
+        }
+        if not formats or animated_gif:
+            return result
+        img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+        variants = result['variants']
+        for size, max_side in VARIANT_SIZES.items():
+            resized = img.copy()
+            resized.thumbnail((max_side, max_side), Image.LANCZOS)
+            variants[size] = {}
+            for fmt in formats:
+                relpath = variant_relpath(image_type, filename, size, fmt)
+                out_path = os.path.join(base_path, relpath)
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                tmp_path = f'{out_path}.tmp'
+                # Senza exif=... Pillow non copia i metadati EXIF
+                resized.save(tmp_path, format=fmt.upper(), quality=FORMAT_QUALITY[fmt])
+                os.replace(tmp_path, out_path)
+                variants[size][fmt] = relpath
+        return result
+
+
+class VariantPipeline:
+    """Genera le varianti in un pool di processi e le registra nel manifest"""
+
+    def __init__(self, base_path, manifest, max_workers=2):
+        self.base_path = base_path
+        self.manifest = manifest
+        self.max_workers = max_workers
+        self._executor = None
+
+    @property
+    def enabled(self):
+        """True se Pillow è disponibile"""
+        return Image is not None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, image_type, filename):
+        """Accoda la generazione delle varianti di un'immagine"""
+        if not self.enabled:
+            return None
+        source_path = os.path.join(self.base_path, image_type, filename)
+        future = self._get_executor().submit(build_variants, source_path, self.base_path,
+                                             image_type, filename)
+        future.add_done_callback(lambda f: self._store(image_type, filename, f))
+        return future
+
+    def _store(self, image_type, filename, future):
+        """Salva nel manifest varianti e segnaposto generati"""
+        if future.exception() is not None:
+            print(f"Varianti non generate per {image_type}/{filename}: {future.exception()}")
+            return
+        for field, value in future.result().items():
+            self.manifest.set_extra(image_type, filename, field, value)
+        self.manifest.save()
+
+    def submit_missing(self, image_type, filenames):
+        """Accoda tutte le immagini che non hanno ancora varianti o segnaposto"""
+        futures = []
+        for filename in filenames:
+            info = self.manifest.get(image_type, filename)
+            if info is not None and ('variants' not in info or 'color' not in info):
+                futures.append(self.submit(image_type, filename))
+        return [f for f in futures if f is not None]
+
+    def shutdown(self):
+        """Attende la fine dei lavori in corso e chiude il pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+if __name__ == '__main__':
+    # Genera le varianti mancanti per tutta la libreria esistente
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from data.templates_db import TemplatesDB
+
+    db = TemplatesDB()
+    pipeline = VariantPipeline(db.IMAGES_BASE_PATH, db.manifest, max_workers=os.cpu_count())
+    if not pipeline.enabled:
+        print("Pillow non installato: impossibile generare le varianti")
+        sys.exit(1)
+    pending = []
+    for image_type, catalog in db.catalogs.items():
+        pending += pipeline.submit_missing(image_type, catalog.list_images())
+    print(f"Generazione varianti per {len(pending)} immagini...")
+    pipeline.shutdown()
+    print("✅ Varianti generate")
@@ -0,0 +1,299 @@
+"""
+Archivio dei suggerimenti
+Tiene i suggerimenti in memoria, indicizzati per id. Ogni modifica viene
+aggiunta in fondo a un log (una riga JSON per evento) invece di riscrivere
+tutto il file; i voti vengono accumulati e scritti a blocchi. Periodicamente
+il log viene compattato in uno snapshot. Più processi possono condividere
+log e snapshot: la compattazione prende un lock sul file e riparte da
+quello che c'è su disco, non dallo stato in memoria di un solo processo.
+
+La classifica per voti positivi, il totale dei voti e l'indice di ricerca
+sono mantenuti a ogni modifica, così una pagina della classifica o una
+ricerca costano solo quanto i loro risultati.
+"""
+
+import bisect
+import contextlib
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: senza lock tra processi, va usato un solo worker
+    fcntl = None
+
+from .text_index import InvertedIndex
+
+
+class SuggestionsStore:
+    """Suggerimenti in memoria con log append-only su disco"""
+
+    def __init__(self, snapshot_file, log_file, compact_every=500, seed_file=None):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file
+        self.lock_file = f'{log_file}.lock'
+        self.seed_file = seed_file  # Suggerimenti iniziali, letti solo se manca lo snapshot
+        self.compact_every = compact_every  # Eventi nel log prima di compattare
+        self.suggestions = {}  # {id: suggerimento}
+        self._seq = {}  # {id: ordine di inserimento}, per mostrare i più recenti prima
+        self._next_seq = 0
+        self._ranking = []  # Chiavi (-voti_su, -ordine, id) ordinate: i più votati prima
+        self._rank_key = {}  # {id: chiave corrente in _ranking}
+        self.total_votes = 0  # Somma di voti su e giù di tutti i suggerimenti
+        self.search_index = InvertedIndex()  # Testo, autore e categoria
+        self.content_index = InvertedIndex()  # Solo il testo, per trovare i doppioni
+        self._pending_votes = {}  # {id: [su, giù]} non ancora scritti nel log
+        self._log_events = 0
+        self._lock = threading.RLock()
+        self.load()
+
+    # ---- Caricamento ----
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive=False):
+        """Lock tra processi: letture e append condivisi, compattazione esclusiva"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_snapshot(self):
+        """Ultimo snapshot, o i suggerimenti iniziali se non è mai stato scritto"""
+        for path in (self.snapshot_file, self.seed_file):
+            if path is None:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                continue
+            except json.JSONDecodeError:
+                return []
+        return []
+
+    def load(self):
+        """Carica l'ultimo snapshot e riapplica gli eventi del log"""
+        with self._lock, self._file_lock():
+            self._reload()
+
+    def _reload(self):
+        """Ricostruisce lo stato in memoria dal disco (con il lock già preso)"""
+        with self._lock:
+            self.suggestions = {}
+            self._seq = {}
+            self._ranking = []
+            self._rank_key = {}
+            self.total_votes = 0
+            self.search_index = InvertedIndex()
+            self.content_index = InvertedIndex()
+            snapshot = self._read_snapshot()
+            # Lo snapshot è ordinato dal più recente: si inserisce dal più vecchio
+            for suggestion in reversed(snapshot):
+                self._insert(suggestion)
+
+            self._log_events = 0
+            try:
+                with open(self.log_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            event = json.loads(line)
+                        except json.JSONDecodeError:
+                            # Riga troncata da un crash durante la scrittura
+                            continue
+                        self._apply(event)
+                        self._log_events += 1
+            except FileNotFoundError:
+                pass
+
+    def _insert(self, suggestion):
+        """Aggiunge un suggerimento all'indice in memoria"""
+        sid = suggestion['id']
+        self.suggestions[sid] = suggestion
+        self._seq[sid] = self._next_seq
+        self._next_seq += 1
+        self.total_votes += suggestion.get('votes_up', suggestion.get('votes', 0)) + suggestion.get('votes_down', 0)
+        self._rank(suggestion)
+        self.search_index.add(sid, suggestion.get('content', ''), suggestion.get('author', ''),
+                              suggestion.get('category', ''))
+        self.content_index.add(sid, suggestion.get('content', ''))
+
+    def _rank(self, suggestion):
+        """Inserisce o sposta un suggerimento nella classifica (ricerca binaria)"""
+        sid = suggestion['id']
+        old_key = self._rank_key.get(sid)
+        if old_key is not None:
+            del self._ranking[bisect.bisect_left(self._ranking, old_key)]
+        # A parità di voti il più recente viene prima, come nell'ordinamento originale
+        key = (-suggestion.get('votes_up', suggestion.get('votes', 0)), -self._seq[sid], sid)
+        bisect.insort(self._ranking, key)
+        self._rank_key[sid] = key
+
+    def _apply(self, event):
+        """Riapplica un evento del log"""
+        if event['op'] == 'add':
+            self._insert(event['suggestion'])
+        elif event['op'] == 'votes':
+            suggestion = self.suggestions.get(event['id'])
+            if suggestion is not None:
+                self._add_votes(suggestion, event.get('up', 0), event.get('down', 0))
+
+    def _add_votes(self, suggestion, up, down):
+        """Aggiorna i contatori di un suggerimento, la classifica e il totale"""
+        # Inizializza i contatori se non esistono
+        if 'votes_up' not in suggestion:
+            suggestion['votes_up'] = suggestion.get('votes', 0)
+        if 'votes_down' not in suggestion:
+            suggestion['votes_down'] = 0
+        suggestion['votes_up'] += up
+        suggestion['votes_down'] += down
+        # Aggiorna anche il campo votes totale per retrocompatibilità
+        suggestion['votes'] = suggestion['votes_up']
+        self.total_votes += up + down
+        if up:
+            self._rank(suggestion)
+
+    # ---- Scrittura ----
+
+    def _append_log(self, events):
+        """Aggiunge eventi in fondo al log"""
+        if not events:
+            return
+        with self._file_lock():
+            self._write_log(events)
+
+    def _write_log(self, events):
+        """Scrive eventi nel log (con il lock già preso)"""
+        if not events:
+            return
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(e, ensure_ascii=False, separators=(',', ':')) + '\n'
+                            for e in events))
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_events += len(events)
+
+    def add(self, author, category, content):
+        """Crea un suggerimento e lo scrive subito nel log"""
+        suggestion = {
+            'id': str(uuid.uuid4())[:8],
+            'author': author[:30] if author else 'Anonimo',
+            'category': category,
+            'content': content[:500],
+            'votes': 0,
+            'date': datetime.now().strftime('%d/%m/%Y %H:%M')
+        }
+        with self._lock:
+            self._insert(suggestion)
+            self._append_log([{'op': 'add', 'suggestion': suggestion}])
+        return suggestion
+
+    def vote(self, suggestion_id, vote_type='up'):
+        """
+        Registra un voto in memoria (O(1)); verrà scritto al prossimo flush
+        Restituisce il suggerimento aggiornato, o None se non esiste
+        """
+        with self._lock:
+            suggestion = self.suggestions.get(suggestion_id)
+            if suggestion is None:
+                return None
+            up, down = (1, 0) if vote_type == 'up' else (0, 1)
+            self._add_votes(suggestion, up, down)
+            pending = self._pending_votes.setdefault(suggestion_id, [0, 0])
+            pending[0] += up
+            pending[1] += down
+            return suggestion
+
+    def _take_pending_votes(self):
+        """Voti accumulati come eventi del log"""
+        events = [{'op': 'votes', 'id': sid, 'up': up, 'down': down}
+                  for sid, (up, down) in self._pending_votes.items()]
+        self._pending_votes = {}
+        return events
+
+    def flush(self):
+        """Scrive nel log i voti accumulati e compatta se il log è troppo lungo"""
+        with self._lock:
+            self._append_log(self._take_pending_votes())
+            if self._log_events >= self.compact_every:
+                self.compact()
+
+    def compact(self):
+        """Riscrive lo snapshot con lo stato su disco e svuota il log"""
+        with self._lock, self._file_lock(exclusive=True):
+            # Il log contiene anche le modifiche degli altri processi: si riparte
+            # dal disco, dopo avervi aggiunto i voti ancora in memoria
+            self._write_log(self._take_pending_votes())
+            self._reload()
+            snapshot = sorted(self.suggestions.values(), key=lambda s: self._seq[s['id']], reverse=True)
+            tmp_path = f'{self.snapshot_file}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_file)
+            # Solo dopo lo snapshot il log può essere svuotato
+            open(self.log_file, 'w').close()
+            self._log_events = 0
+
+    # ---- Lettura ----
+
+    def get(self, suggestion_id):
+        """Suggerimento per id, o None"""
+        return self.suggestions.get(suggestion_id)
+
+    def all(self):
+        """Tutti i suggerimenti, dal più recente"""
+        with self._lock:
+            return sorted(self.suggestions.values(), key=lambda s: self._seq[s['id']], reverse=True)
+
+    @staticmethod
+    def encode_cursor(key):
+        """Cursore opaco che indica la posizione dopo una chiave di classifica"""
+        return f'{-key[0]}.{-key[1]}.{key[2]}'
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Cursore -> chiave di classifica, None se non valido"""
+        try:
+            votes, seq, sid = cursor.split('.', 2)
+            return (-int(votes), -int(seq), sid)
+        except (AttributeError, ValueError):
+            return None
+
+    def top(self, limit=20, cursor=None):
+        """
+        Pagina della classifica per voti positivi
+        Restituisce (suggerimenti, cursore_successivo o None)
+        """
+        with self._lock:
+            start = 0
+            key = self.decode_cursor(cursor) if cursor else None
+            if key is not None:
+                start = bisect.bisect_right(self._ranking, key)
+            keys = self._ranking[start:start + limit]
+            items = [self.suggestions[k[2]] for k in keys]
+            has_more = start + limit < len(self._ranking)
+            next_cursor = self.encode_cursor(keys[-1]) if keys and has_more else None
+            return items, next_cursor
+
+    def search(self, query, limit=20):
+        """Suggerimenti che contengono le parole cercate, i più pertinenti prima"""
+        with self._lock:
+            return [self.suggestions[sid] for _, sid in self.search_index.search(query, limit)]
+
+    def similar(self, content, threshold=0.5, limit=5):
+        """Suggerimenti con un testo simile, per segnalare i doppioni prima di pubblicare"""
+        with self._lock:
+            return [self.suggestions[sid]
+                    for _, sid in self.content_index.similar(content, threshold, limit)]
+
+    def __len__(self):
+        return len(self.suggestions)
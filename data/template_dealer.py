@@ -0,0 +1,70 @@
+"""
+Mazziere dei template per una singola partita
+Mescola le immagini una volta e le distribuisce senza ripetizioni
+finché il mazzo non è esaurito
+"""
+
+import random
+
+
+class TemplateDealer:
+    """Mazzo mescolato (shuffle bag) di immagini per una partita"""
+
+    def __init__(self, templates_db, image_type='custom'):
+        self.templates_db = templates_db
+        self.image_type = image_type if image_type in templates_db.catalogs else 'classic'
+        self.catalog = templates_db.catalogs[self.image_type]
+        self._bag = []  # Immagini ancora da distribuire, si pesca dalla fine
+        self._dealt = set()  # Immagini già uscite nel giro corrente
+        self._catalog_version = None
+        self._last = None
+
+    def get_state(self):
+        """Immagini già uscite, per ricostruire il mazzo in un altro processo"""
+        return {'dealt': sorted(self._dealt), 'last': self._last}
+
+    def set_state(self, state):
+        """Ripristina il mazzo: verrà rimescolato senza le immagini già uscite"""
+        self._dealt = set(state.get('dealt', ()))
+        self._last = state.get('last')
+        self._catalog_version = None
+
+    def _sync(self):
+        """Allinea il mazzo al catalogo se sono state aggiunte o rimosse immagini"""
+        self.catalog.maybe_refresh()
+        if self.catalog.version != self._catalog_version:
+            self._catalog_version = self.catalog.version
+            self._bag = [img for img in self.catalog.images if img not in self._dealt]
+            random.shuffle(self._bag)
+
+    def _refill(self):
+        """Nuovo giro: rimescola tutte le immagini"""
+        self._dealt.clear()
+        self._bag = list(self.catalog.images)
+        random.shuffle(self._bag)
+        # Evita che l'ultima immagine del giro precedente esca subito di nuovo
+        if len(self._bag) > 1 and self._bag[-1] == self._last:
+            self._bag[0], self._bag[-1] = self._bag[-1], self._bag[0]
+
+    def deal_one(self):
+        """Distribuisce un template in O(1)"""
+        self._sync()
+        if not self._bag:
+            self._refill()
+        if not self._bag:
+            # Catalogo vuoto: usa i fallback del database
+            return self.templates_db.get_random_template(self.image_type)
+
+        image = self._bag.pop()
+        self._dealt.add(image)
+        self._last = image
+        # Il mazzo contiene un rappresentante per gruppo di foto quasi identiche
+        return self.templates_db.make_template(self.image_type, self.catalog.pick_member(image))
+
+    def deal(self, count):
+        """Distribuisce count template in una sola chiamata"""
+        return [self.deal_one() for _ in range(count)]
+
+    def remaining(self):
+        """Immagini rimaste prima di rimescolare"""
+        return len(self._bag)
@@ -4,9 +4,14 @@ Supporta due tipi di immagini: Classiche e Personalizzate
 """
 
 import random
-import json
 import os
-import glob
+import time
+
+from .image_catalog import ImageCatalog
+from .image_manifest import ImageManifest
+from .image_store import ImageStore
+from .image_similarity import SimilarityIndex
+from .templates_store import SQLiteTemplateStore
 
 
 class TemplatesDB:
@@ -17,61 +22,119 @@ class TemplatesDB:
                                      'web', 'static', 'images', 'memes')
     CLASSIC_PATH = os.path.join(IMAGES_BASE_PATH, 'classic')
     CUSTOM_PATH = os.path.join(IMAGES_BASE_PATH, 'custom')
+    MANIFEST_FILE = os.path.join(os.path.dirname(__file__), 'images_manifest.json')
+    ALIASES_FILE = os.path.join(os.path.dirname(__file__), 'image_aliases.json')
+    SQLITE_FILE = os.path.join(os.path.dirname(__file__), 'templates.db')
+    JSON_FILE = os.path.join(os.path.dirname(__file__), 'templates.json')
+    
+    # Secondi tra due controlli delle modifiche fatte da altri processi
+    SYNC_INTERVAL = 5.0
     
     def __init__(self):
-        self.db_file = os.path.join(os.path.dirname(__file__), 'templates.json')
+        # templates.json viene importato una sola volta nel database SQLite
+        self.db_file = self.JSON_FILE
+        self.backend = SQLiteTemplateStore(self.SQLITE_FILE, json_file=self.db_file)
         self.templates = self.load_templates()
+        self._build_indexes()
+        self._data_version = self.backend.data_version()
+        self._last_sync = time.monotonic()
         
-        # Se il database è vuoto, carica i template predefiniti
+        # Se il database è vuoto, carica i template predefiniti. Se templates.json
+        # c'è ma è illeggibile restano solo in memoria: salvarli renderebbe il
+        # database non vuoto e il file non verrebbe più importato
         if not self.templates:
-            self.initialize_default_templates()
+            self.initialize_default_templates(persist=not self.backend.migration_failed)
+        
+        # Cataloghi in memoria delle cartelle immagini, inizializzati dal manifest
+        self.manifest = ImageManifest(self.MANIFEST_FILE)
+        self.similarity = SimilarityIndex(self.manifest)
+        self.catalogs = {
+            'classic': ImageCatalog(self.CLASSIC_PATH, manifest=self.manifest, key='classic',
+                                    similarity=self.similarity),
+            'custom': ImageCatalog(self.CUSTOM_PATH, manifest=self.manifest, key='custom',
+                                   similarity=self.similarity)
+        }
+        
+        # Archivio degli upload deduplicato per contenuto
+        self.store = ImageStore(self.IMAGES_BASE_PATH, self.manifest, self.ALIASES_FILE)
     
     def load_templates(self):
-        """Carica i template dal file JSON"""
-        if os.path.exists(self.db_file):
-            try:
-                with open(self.db_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return []
-        return []
+        """Carica i template dal database"""
+        return self.backend.load_all()
+    
+    def _sync_templates(self):
+        """Ricarica i template se un altro processo ha modificato il database"""
+        if time.monotonic() - self._last_sync < self.SYNC_INTERVAL:
+            return
+        self._last_sync = time.monotonic()
+        version = self.backend.data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self.templates = self.load_templates()
+            self._build_indexes()
+    
+    def _build_indexes(self):
+        """Ricostruisce gli indici per nome immagine e per categoria"""
+        self._by_image_file = {}  # {image_file normalizzato: template}
+        self._by_category = {}  # {categoria: [template]}
+        for template in self.templates:
+            self._index_template(template)
+    
+    def _index_template(self, template):
+        """Aggiunge un template agli indici"""
+        image_file = template.get('image_file', '').lower()
+        if image_file:
+            # Come nella vecchia ricerca lineare, vince il primo template
+            self._by_image_file.setdefault(image_file, template)
+        self._by_category.setdefault(template.get('category', 'Generale'), []).append(template)
     
     def save_templates(self):
-        """Salva i template nel file JSON"""
-        with open(self.db_file, 'w', encoding='utf-8') as f:
-            json.dump(self.templates, f, indent=2, ensure_ascii=False)
+        """Salva tutti i template nel database"""
+        self.backend.replace_all(self.templates)
     
     def get_custom_images(self):
         """Ottiene la lista delle immagini personalizzate dalla cartella custom"""
-        if not os.path.exists(self.CUSTOM_PATH):
-            return []
-        
-        images = []
-        extensions = ['*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp']
-        
-        for ext in extensions:
-            pattern = os.path.join(self.CUSTOM_PATH, ext)
-            images.extend(glob.glob(pattern))
-            # Anche maiuscole
-            images.extend(glob.glob(pattern.upper()))
-        
-        # Restituisci solo i nomi dei file
-        return [os.path.basename(img) for img in images]
+        return self.catalogs['custom'].list_images()
     
     def get_classic_images(self):
         """Ottiene la lista delle immagini classiche dalla cartella classic"""
-        if not os.path.exists(self.CLASSIC_PATH):
-            return []
-        
-        images = []
-        extensions = ['*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp']
-        
-        for ext in extensions:
-            pattern = os.path.join(self.CLASSIC_PATH, ext)
-            images.extend(glob.glob(pattern))
-            images.extend(glob.glob(pattern.upper()))
-        
-        return [os.path.basename(img) for img in images]
+        return self.catalogs['classic'].list_images()
+    
+    def refresh_images(self, image_type=None):
+        """
+        Forza la rilettura delle cartelle immagini (da chiamare dopo un upload)
+        image_type: 'classic', 'custom' o None per entrambe
+        """
+        types = [image_type] if image_type in self.catalogs else list(self.catalogs)
+        for t in types:
+            self.catalogs[t].refresh(force=True)
+    
+    def get_image_info(self, image_type, filename):
+        """Metadati di un'immagine (formato, larghezza, altezza, peso) dal manifest"""
+        catalog = self.catalogs.get(image_type)
+        return catalog.info(filename) if catalog else None
+    
+    def _image_fields(self, image_type, filename):
+        """Campi immagine comuni a tutti i template"""
+        fields = {
+            "image": f"{image_type}/{filename}",
+            "image_type": image_type
+        }
+        info = self.get_image_info(image_type, filename)
+        if info and info.get('width') and info.get('height'):
+            # Dimensioni con l'orientamento EXIF applicato, se già calcolate
+            width, height = info.get('display_size') or (info['width'], info['height'])
+            fields["width"] = width
+            fields["height"] = height
+            # Segnaposto per impaginare e colorare il riquadro prima del download
+            fields["placeholder"] = {
+                "color": info.get('color'),
+                "aspect_ratio": round(width / height, 4)
+            }
+        if info and info.get('variants'):
+            # Varianti ridimensionate: {dimensione: {formato: percorso}}
+            fields["variants"] = info['variants']
+        return fields
     
     def get_random_template(self, image_type='classic'):
         """
@@ -83,21 +146,45 @@ class TemplatesDB:
         else:
             return self.get_random_classic_template()
     
-    def get_random_custom_template(self):
-        """Ottiene un template con immagine personalizzata casuale"""
-        custom_images = self.get_custom_images()
-        
-        if custom_images:
-            image = random.choice(custom_images)
-            # Per le immagini custom, usa il nome file come nome template
-            name = os.path.splitext(image)[0].replace('-', ' ').replace('_', ' ').title()
+    def make_template(self, image_type, image):
+        """Costruisce il template per un'immagine del catalogo"""
+        if image_type == 'custom':
+            # Per le immagini custom, usa il nome file (originale, se caricata) come nome template
+            source_name = self.store.original_name('custom', image) or image
+            name = os.path.splitext(source_name)[0].replace('-', ' ').replace('_', ' ').title()
             return {
                 "name": name,
                 "description": "Crea una didascalia divertente per questa immagine!",
                 "category": "Personalizzate",
-                "image": f"custom/{image}",
-                "image_type": "custom"
+                **self._image_fields('custom', image)
+            }
+        
+        # Cerca il template corrispondente
+        self._sync_templates()
+        image_base = os.path.splitext(self.store.original_name('classic', image) or image)[0].lower()
+        
+        template = self._by_image_file.get(image_base)
+        if template:
+            return {
+                **template,
+                **self._image_fields('classic', image)
             }
+        
+        # Se non trova corrispondenza, usa il nome file
+        name = image_base.replace('-', ' ').replace('_', ' ').title()
+        return {
+            "name": name,
+            "description": "Crea una didascalia divertente per questo meme classico!",
+            "category": "Classici",
+            **self._image_fields('classic', image)
+        }
+    
+    def get_random_custom_template(self):
+        """Ottiene un template con immagine personalizzata casuale"""
+        image = self.catalogs['custom'].random_image()
+        
+        if image:
+            return self.make_template('custom', image)
         else:
             # Fallback: template senza immagine
             return {
@@ -111,33 +198,14 @@ class TemplatesDB:
     def get_random_classic_template(self):
         """Ottiene un template classico casuale"""
         # Prima controlla se ci sono immagini nella cartella classic
-        classic_images = self.get_classic_images()
+        image = self.catalogs['classic'].random_image()
         
-        if classic_images:
+        if image:
             # Usa le immagini dalla cartella
-            image = random.choice(classic_images)
-            # Cerca il template corrispondente
-            image_base = os.path.splitext(image)[0].lower()
-            
-            for template in self.templates:
-                if template.get('image_file', '').lower() == image_base:
-                    return {
-                        **template,
-                        "image": f"classic/{image}",
-                        "image_type": "classic"
-                    }
-            
-            # Se non trova corrispondenza, usa il nome file
-            name = image_base.replace('-', ' ').replace('_', ' ').title()
-            return {
-                "name": name,
-                "description": "Crea una didascalia divertente per questo meme classico!",
-                "category": "Classici",
-                "image": f"classic/{image}",
-                "image_type": "classic"
-            }
+            return self.make_template('classic', image)
         
         # Fallback: usa i template dal database senza immagine
+        self._sync_templates()
         if self.templates:
             template = random.choice(self.templates)
             return {
@@ -155,7 +223,7 @@ class TemplatesDB:
             "image_type": "classic"
         }
     
-    def initialize_default_templates(self):
+    def initialize_default_templates(self, persist=True):
         """Inizializza il database con template classici predefiniti"""
         # Template classici con riferimento al nome file immagine
         default_templates = [
@@ -291,12 +359,30 @@ class TemplatesDB:
         ]
         
         self.templates = default_templates
-        self.save_templates()
+        self._build_indexes()
+        if persist:
+            self.save_templates()
     
     def get_all_templates(self):
         """Ottiene tutti i template"""
+        self._sync_templates()
         return self.templates
     
+    def get_template_by_image(self, image_file):
+        """Trova il template associato a un nome immagine (senza estensione)"""
+        self._sync_templates()
+        return self._by_image_file.get(image_file.lower())
+    
+    def get_categories(self):
+        """Elenco delle categorie presenti"""
+        self._sync_templates()
+        return list(self._by_category)
+    
+    def get_templates_by_category(self, category):
+        """Template di una categoria, senza scorrere tutto il database"""
+        self._sync_templates()
+        return list(self._by_category.get(category, []))
+    
     def add_template(self, name, description, category="Generale", image_file=None):
         """Aggiunge un nuovo template"""
         template = {
@@ -308,13 +394,16 @@ class TemplatesDB:
             template["image_file"] = image_file
         
         self.templates.append(template)
-        self.save_templates()
+        self._index_template(template)
+        self.backend.insert(template)
     
     def get_image_stats(self):
         """Restituisce statistiche sulle immagini disponibili"""
+        classic_list = self.get_classic_images()
+        custom_list = self.get_custom_images()
         return {
-            "classic": len(self.get_classic_images()),
-            "custom": len(self.get_custom_images()),
-            "classic_list": self.get_classic_images(),
-            "custom_list": self.get_custom_images()
+            "classic": len(classic_list),
+            "custom": len(custom_list),
+            "classic_list": classic_list,
+            "custom_list": custom_list
         }
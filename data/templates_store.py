@@ -0,0 +1,151 @@
+"""
+Archivio SQLite dei template
+Sostituisce la riscrittura completa di templates.json: ogni inserimento
+è una singola riga e più processi (worker gunicorn) possono leggere e
+scrivere insieme grazie alla modalità WAL.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    category TEXT NOT NULL DEFAULT 'Generale',
+    image_file TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_templates_category ON templates (category);
+CREATE INDEX IF NOT EXISTS idx_templates_image_file ON templates (image_file COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SQLiteTemplateStore:
+    """Template salvati in un database SQLite in modalità WAL"""
+
+    def __init__(self, db_path, json_file=None):
+        self.db_path = db_path
+        self.migration_failed = False  # templates.json esiste ma non si è potuto leggere
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        if json_file:
+            self.migrate_from_json(json_file)
+
+    def migrate_from_json(self, json_file):
+        """
+        Importa una sola volta i template dal vecchio templates.json
+        Restituisce il numero di template importati
+        """
+        with self._lock:
+            done = self.conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+            if done or not os.path.exists(json_file):
+                return 0
+            try:
+                with open(json_file, 'r', encoding='utf-8') as f:
+                    templates = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                # Non segna la migrazione come fatta: si riprova al prossimo avvio,
+                # purché nel frattempo il database resti vuoto
+                print(f"⚠️  Impossibile importare {json_file}: {e}")
+                self.migration_failed = True
+                return 0
+
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Un altro worker potrebbe aver completato la migrazione nel frattempo
+                done = self.conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+                count = 0
+                if not done:
+                    existing = self.conn.execute('SELECT COUNT(*) FROM templates').fetchone()[0]
+                    if existing == 0:
+                        self._insert_many(templates)
+                        count = len(templates)
+                    self.conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            return count
+
+    def _insert_many(self, templates):
+        """Inserisce più template (da chiamare con il lock acquisito)"""
+        self.conn.executemany(
+            'INSERT INTO templates (name, description, category, image_file) VALUES (?, ?, ?, ?)',
+            [(t['name'], t.get('description', ''), t.get('category', 'Generale'), t.get('image_file'))
+             for t in templates]
+        )
+
+    @staticmethod
+    def _to_dict(row):
+        """Riga del database -> dict template (stesso formato del vecchio JSON)"""
+        template = {
+            'name': row['name'],
+            'description': row['description'],
+            'category': row['category']
+        }
+        if row['image_file']:
+            template['image_file'] = row['image_file']
+        return template
+
+    def load_all(self):
+        """Tutti i template, in ordine di inserimento"""
+        with self._lock:
+            rows = self.conn.execute('SELECT * FROM templates ORDER BY id').fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def insert(self, template):
+        """Aggiunge un template (una sola riga, O(1))"""
+        with self._lock:
+            self._insert_many([template])
+
+    def replace_all(self, templates):
+        """Sostituisce tutti i template in un'unica transazione"""
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute('DELETE FROM templates')
+                self._insert_many(templates)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def find_by_image_file(self, image_file):
+        """Template associato a un nome immagine (ricerca indicizzata)"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT * FROM templates WHERE image_file = ? COLLATE NOCASE ORDER BY id LIMIT 1',
+                (image_file,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def find_by_category(self, category):
+        """Template di una categoria (ricerca indicizzata)"""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT * FROM templates WHERE category = ? ORDER BY id', (category,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def data_version(self):
+        """Cambia quando un altro processo modifica il database"""
+        with self._lock:
+            return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        """Chiude la connessione"""
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,123 @@
+"""
+Indice invertito per la ricerca testuale
+Ogni parola (in minuscolo e senza accenti) punta all'insieme dei documenti
+che la contengono: una ricerca legge solo le liste delle parole cercate
+invece di scorrere tutti i testi.
+"""
+
+import bisect
+import re
+import unicodedata
+
+
+# Parole troppo comuni per distinguere un testo dall'altro
+STOPWORDS = frozenset("""
+a ad al alla alle allo ai agli che chi ci con da dal dalla dalle dei del della delle
+di e ed gli ha hanno ho i il in io la le lo ma mi ne nel nella non o per piu poi
+se si sia sono su sul sulla te ti tra tu un una uno vi
+and are for is of or the to
+""".split())
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def fold(text):
+    """Minuscolo e senza accenti ("Perché" -> "perche")"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Parole significative di un testo, normalizzate"""
+    return [word for word in _WORD_RE.findall(fold(text or ''))
+            if word not in STOPWORDS and (len(word) > 1 or word.isdigit())]
+
+
+class InvertedIndex:
+    """Indice parola -> documenti, aggiornato a ogni inserimento"""
+
+    def __init__(self):
+        self.postings = {}  # {parola: set(id documento)}
+        self.doc_terms = {}  # {id documento: set(parole)}
+        self._vocabulary = []  # Parole ordinate, per la ricerca per prefisso
+
+    def add(self, doc_id, *texts):
+        """Indicizza (o reindicizza) un documento composto da uno o più testi"""
+        self.remove(doc_id)
+        terms = set()
+        for text in texts:
+            terms.update(tokenize(text))
+        self.doc_terms[doc_id] = terms
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = set()
+                bisect.insort(self._vocabulary, term)
+            docs.add(doc_id)
+
+    def remove(self, doc_id):
+        """Toglie un documento dall'indice"""
+        for term in self.doc_terms.pop(doc_id, ()):
+            docs = self.postings[term]
+            docs.discard(doc_id)
+            if not docs:
+                del self.postings[term]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, term)]
+
+    def _expand(self, term, prefix):
+        """Parole dell'indice uguali al termine o, se prefix, che iniziano con esso"""
+        if not prefix:
+            return [term] if term in self.postings else []
+        start = bisect.bisect_left(self._vocabulary, term)
+        end = bisect.bisect_left(self._vocabulary, term + '\uffff')
+        return self._vocabulary[start:end]
+
+    def search(self, query, limit=20):
+        """
+        Documenti che contengono tutte le parole cercate
+        L'ultima parola vale anche come prefisso (ricerca mentre si scrive).
+        Restituisce una lista di (punteggio, id), i più pertinenti prima
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        # Si parte dalla parola più rara: le intersezioni restano piccole
+        matches = []
+        for i, term in enumerate(terms):
+            docs = set()
+            for word in self._expand(term, prefix=(i == len(terms) - 1)):
+                docs |= self.postings[word]
+            matches.append(docs)
+        matches.sort(key=len)
+        result = set(matches[0])
+        for docs in matches[1:]:
+            result &= docs
+            if not result:
+                return []
+        # Punteggio: quota del documento coperta dalla ricerca (i testi brevi e mirati prima)
+        scored = [(len(terms) / max(len(self.doc_terms[doc_id]), 1), doc_id) for doc_id in result]
+        scored.sort(key=lambda r: -r[0])
+        return scored[:limit]
+
+    def similar(self, text, threshold=0.5, limit=5):
+        """
+        Documenti con parole in comune con un testo (indice di Jaccard >= threshold)
+        Restituisce una lista di (somiglianza, id), i più simili prima
+        """
+        terms = set(tokenize(text))
+        if not terms:
+            return []
+        shared = {}
+        for term in terms:
+            for doc_id in self.postings.get(term, ()):
+                shared[doc_id] = shared.get(doc_id, 0) + 1
+        scored = []
+        for doc_id, common in shared.items():
+            score = common / len(terms | self.doc_terms[doc_id])
+            if score >= threshold:
+                scored.append((score, doc_id))
+        scored.sort(key=lambda r: -r[0])
+        return scored[:limit]
+
+    def __len__(self):
+        return len(self.doc_terms)
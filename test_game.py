@@ -4,15 +4,35 @@ Test rapido per Make it Meme
 Questo script testa le funzionalità principali senza interazione utente
 """
 
+import io
 import sys
 import os
+import json
+import random
+import tempfile
 
 # Aggiungi la directory corrente al path
 sys.path.insert(0, os.path.dirname(__file__))
 
 from utils.display import Display
 from data.templates_db import TemplatesDB
+from data.templates_store import SQLiteTemplateStore
 from utils.game_logic import GameLogic
+from data.image_catalog import ImageCatalog
+from data.template_dealer import TemplateDealer
+from data.image_similarity import BKTree, SimilarityIndex, hamming
+from data.image_manifest import ImageManifest
+from data.suggestions_store import SuggestionsStore
+from data.text_index import InvertedIndex
+from utils.rate_limit import RotatingBloomFilter, RateLimiter
+from utils.upload_stream import read_image_upload, UploadRejected
+from utils.timer_wheel import TimerWheel
+from utils.resp import LocalRespServer, RespClient
+from data.game_store import RedisGameStore, StaleGameError
+from utils.shard_router import ShardRouter
+from data.game_snapshots import SnapshotStore
+from utils.coalescer import EventCoalescer
+from utils.room_codes import RoomCodeAllocator, FeistelPermutation, ALPHABET
 
 def test_display():
     """Test del modulo Display"""
@@ -61,10 +81,850 @@ def test_templates():
     random_template = db.get_random_template()
     print(f"\n🎲 Template casuale: {random_template['name']}")
     
+    # Test indici per immagine e categoria
+    for template in templates:
+        if template.get('image_file'):
+            assert db.get_template_by_image(template['image_file'].upper()) is not None
+    for category in db.get_categories():
+        expected = [t for t in templates if t.get('category', 'Generale') == category]
+        assert db.get_templates_by_category(category) == expected
+    print(f"\n🗂️  Categorie indicizzate: {len(db.get_categories())}")
+    
+    # templates.json illeggibile: l'importazione viene ritentata al riavvio successivo
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'templates.db')
+        json_path = os.path.join(tmp, 'templates.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            f.write('[{"name": "Drake"')
+        
+        class BrokenJsonDB(TemplatesDB):
+            SQLITE_FILE = db_path
+            JSON_FILE = json_path
+        
+        broken = BrokenJsonDB()
+        assert broken.get_all_templates()  # Predefiniti solo in memoria
+        assert broken.backend.migration_failed and broken.backend.load_all() == []
+        broken.backend.close()
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump([{'name': 'Drake', 'description': 'Approva', 'category': 'Reazioni',
+                        'image_file': 'drake'}], f)
+        store = SQLiteTemplateStore(db_path, json_file=json_path)
+        assert not store.migration_failed
+        assert [t['name'] for t in store.load_all()] == ['Drake']
+        
+        # Ricerche per immagine (senza distinguere maiuscole) e categoria sugli indici
+        assert store.find_by_image_file('DRAKE')['name'] == 'Drake'
+        assert [t['name'] for t in store.find_by_category('Reazioni')] == ['Drake']
+        assert store.find_by_image_file('altro') is None and store.find_by_category('Altro') == []
+        for query, index in (
+            ("SELECT * FROM templates WHERE image_file = 'x' COLLATE NOCASE", 'idx_templates_image_file'),
+            ("SELECT * FROM templates WHERE category = 'x'", 'idx_templates_category'),
+        ):
+            plan = ' '.join(row[-1] for row in store.conn.execute('EXPLAIN QUERY PLAN ' + query))
+            assert index in plan, plan
+        store.close()
+
+    # Immagine già nella libreria (mai passata dalle varianti): segnaposto subito nel template
+    if SimilarityIndex(None).enabled:
+        from PIL import Image
+        with tempfile.TemporaryDirectory() as tmp:
+            custom = os.path.join(tmp, 'memes', 'custom')
+            os.makedirs(custom)
+            exif = Image.Exif()
+            exif[0x0112] = 6  # Foto del telefono ruotata di 90°
+            Image.new('RGB', (300, 100), (200, 30, 30)).save(
+                os.path.join(custom, 'telefono.jpg'), exif=exif.tobytes())
+
+            class ExistingLibraryDB(TemplatesDB):
+                IMAGES_BASE_PATH = os.path.join(tmp, 'memes')
+                CLASSIC_PATH = os.path.join(tmp, 'memes', 'classic')
+                CUSTOM_PATH = custom
+                MANIFEST_FILE = os.path.join(tmp, 'manifest.json')
+                ALIASES_FILE = os.path.join(tmp, 'aliases.json')
+                SQLITE_FILE = os.path.join(tmp, 'templates.db')
+                JSON_FILE = os.path.join(tmp, 'templates.json')
+
+            library = ExistingLibraryDB()
+            template = library.get_random_template('custom')
+            library.backend.close()
+            assert template['placeholder']['color'] is not None
+            assert template['placeholder']['aspect_ratio'] == round(100 / 300, 4)
+            assert (template['width'], template['height']) == (100, 300)
+        print("\n🎨 Segnaposto pronto per le immagini già presenti")
+
     print("\n✅ Database funzionante")
     
     return True
 
+def test_image_catalog():
+    """Test del catalogo immagini in memoria"""
+    print("\n" + "="*60)
+    print("TEST: Catalogo Immagini")
+    print("="*60)
+    
+    with tempfile.TemporaryDirectory() as folder:
+        for name in ['a.jpg', 'B.PNG', 'note.txt']:
+            open(os.path.join(folder, name), 'wb').close()
+        
+        catalog = ImageCatalog(folder, poll_interval=3600)
+        assert catalog.list_images() == ['B.PNG', 'a.jpg']
+        assert catalog.random_image() in ('B.PNG', 'a.jpg')
+        
+        # Senza refresh il catalogo non tocca il disco
+        open(os.path.join(folder, 'c.gif'), 'wb').close()
+        assert len(catalog) == 2
+        
+        catalog.refresh(force=True)
+        assert len(catalog) == 3
+
+    # Cartella già popolata: gli hash vengono calcolati alla prima lettura e le
+    # due esportazioni della stessa foto finiscono in un solo gruppo
+    if SimilarityIndex(None).enabled:
+        from PIL import Image
+        with tempfile.TemporaryDirectory() as folder:
+            rng = random.Random(5)
+            photo = Image.new('RGB', (240, 160))
+            photo.putdata([(x + rng.randrange(16), y + rng.randrange(16), (x * y) % 256)
+                           for y in range(160) for x in range(240)])
+            photo.save(os.path.join(folder, 'foto_1_105_c.jpeg'), quality=95)
+            photo.resize((180, 120)).save(os.path.join(folder, 'foto_4_5005_c.jpeg'), quality=60)
+            photo.transpose(Image.FLIP_LEFT_RIGHT).save(os.path.join(folder, 'altra.png'))
+
+            manifest = ImageManifest(os.path.join(folder, 'manifest.json'))
+            catalog = ImageCatalog(folder, manifest=manifest, key='custom',
+                                   similarity=SimilarityIndex(manifest))
+            assert len(catalog) == 2
+            assert sorted(map(len, catalog.groups.values())) == [1, 2]
+            assert all(manifest.get('custom', name)['phash']
+                       for name in ('foto_1_105_c.jpeg', 'foto_4_5005_c.jpeg', 'altra.png'))
+        print("\n🧩 Foto quasi identiche raggruppate alla prima scansione")
+
+    print("\n✅ Catalogo funzionante")
+    
+    return True
+
+def test_template_dealer():
+    """Test del mazziere senza ripetizioni"""
+    print("\n" + "="*60)
+    print("TEST: Mazziere Template")
+    print("="*60)
+    
+    db = TemplatesDB()
+    dealer = TemplateDealer(db, 'custom')
+    pool = len(db.get_custom_images())
+    
+    if pool:
+        images = [t['image'] for t in dealer.deal(pool)]
+        assert len(set(images)) == pool, "Immagine ripetuta prima di esaurire il mazzo"
+        assert dealer.remaining() == 0
+        assert dealer.deal_one()['image'] is not None
+        print(f"\n🃏 {pool} immagini distribuite senza ripetizioni")
+    
+    print("\n✅ Mazziere funzionante")
+    
+    return True
+
+def test_bk_tree():
+    """Test del BK-tree per le immagini quasi identiche"""
+    print("\n" + "="*60)
+    print("TEST: BK-tree")
+    print("="*60)
+    
+    rng = random.Random(42)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    # Aggiunge alcune varianti con pochi bit diversi
+    hashes += [h ^ (1 << rng.randrange(64)) for h in hashes[:20]]
+    
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        tree.add(h, i)
+    
+    for query in hashes[:30]:
+        expected = sorted(i for i, h in enumerate(hashes) if hamming(query, h) <= 6)
+        found = sorted(i for _, i in tree.search(query, 6))
+        assert found == expected
+    
+    print("\n✅ BK-tree coerente con la ricerca esaustiva")
+    
+    return True
+
+def test_suggestions_ranking():
+    """Test della classifica dei suggerimenti e della paginazione"""
+    print("\n" + "="*60)
+    print("TEST: Classifica Suggerimenti")
+    print("="*60)
+    
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SuggestionsStore(os.path.join(tmp, 's.json'), os.path.join(tmp, 's.log'))
+        ids = [store.add('Test', 'idea', f'Suggerimento {i}')['id'] for i in range(40)]
+        for _ in range(200):
+            store.vote(rng.choice(ids), rng.choice(['up', 'up', 'down']))
+        
+        expected = sorted(store.all(), key=lambda s: s.get('votes_up', 0), reverse=True)
+        pages, cursor = [], None
+        while True:
+            items, cursor = store.top(7, cursor)
+            pages += items
+            if cursor is None:
+                break
+        assert [s['id'] for s in pages] == [s['id'] for s in expected]
+        assert store.total_votes == 200
+        
+        # Dopo il riavvio classifica e totale vengono ricostruiti dal log
+        store.flush()
+        reloaded = SuggestionsStore(store.snapshot_file, store.log_file)
+        assert reloaded.top(40)[0] == store.top(40)[0]
+        assert reloaded.total_votes == 200
+    
+    print("\n✅ Classifica ordinata e paginata correttamente")
+    
+    return True
+
+def test_suggestions_log():
+    """Test di log, riavvio e compattazione dei suggerimenti con più processi"""
+    print("\n" + "="*60)
+    print("TEST: Log Suggerimenti")
+    print("="*60)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_file = os.path.join(tmp, 'seed.json')
+        with open(seed_file, 'w', encoding='utf-8') as f:
+            json.dump([{'id': 'seed0001', 'author': 'Anna', 'category': 'idea',
+                        'content': 'Suggerimento iniziale', 'votes': 0}], f)
+        paths = (os.path.join(tmp, 's.json'), os.path.join(tmp, 's.log'))
+        
+        # Due worker sugli stessi file: ognuno vede solo le proprie modifiche in memoria
+        worker_a = SuggestionsStore(*paths, seed_file=seed_file)
+        worker_b = SuggestionsStore(*paths, seed_file=seed_file)
+        added_a = worker_a.add('Bruno', 'idea', 'Dal primo worker')['id']
+        added_b = worker_b.add('Carla', 'idea', 'Dal secondo worker')['id']
+        worker_a.vote('seed0001', 'up')
+        worker_b.vote('seed0001', 'up')
+        worker_b.vote(added_b, 'down')
+        worker_b.flush()
+        
+        # La compattazione di un worker non perde le scritture dell'altro
+        worker_a.compact()
+        assert os.path.getsize(paths[1]) == 0
+        assert set(worker_a.suggestions) == {'seed0001', added_a, added_b}
+        assert worker_a.get('seed0001')['votes_up'] == 2
+        assert worker_a.total_votes == 3
+        with open(seed_file, encoding='utf-8') as f:
+            assert json.load(f)[0]['votes'] == 0  # Il file iniziale non viene riscritto
+        
+        # Riga troncata da un crash: viene ignorata al riavvio
+        worker_a.vote(added_a, 'up')
+        worker_a.flush()
+        with open(paths[1], 'a', encoding='utf-8') as f:
+            f.write('{"op":"add","suggestion":{"id"')
+        restarted = SuggestionsStore(*paths, seed_file=seed_file)
+        assert len(restarted) == 3 and restarted.total_votes == 4
+        assert restarted.get(added_a)['votes_up'] == 1
+    
+    print("\n✅ Log e compattazione condivisi tra processi")
+    
+    return True
+
+def test_text_index():
+    """Test dell'indice invertito dei suggerimenti"""
+    print("\n" + "="*60)
+    print("TEST: Indice Testuale")
+    print("="*60)
+    
+    index = InvertedIndex()
+    index.add('a', 'Più modalità di gioco', 'Marco')
+    index.add('b', 'Aggiungete il salvataggio dei meme creati', 'Giulia')
+    index.add('c', 'Salvare i meme nella galleria')
+    
+    # Accenti ignorati e ultima parola come prefisso
+    assert [d for _, d in index.search('piu modalita')] == ['a']
+    assert sorted(d for _, d in index.search('meme salva')) == ['b', 'c']
+    assert [d for _, d in index.search('giulia')] == ['b']
+    assert index.search('inesistente') == []
+    
+    assert [d for _, d in index.similar('Aggiungete il salvataggio dei meme')] == ['b']
+    index.remove('b')
+    assert index.similar('Aggiungete il salvataggio dei meme') == []
+    
+    print("\n✅ Ricerca e suggerimenti simili funzionanti")
+    
+    return True
+
+def test_vote_limits():
+    """Test di deduplica e limite di frequenza dei voti"""
+    print("\n" + "="*60)
+    print("TEST: Limiti Voti")
+    print("="*60)
+    
+    now = [0.0]
+    clock = lambda: now[0]
+    
+    seen = RotatingBloomFilter(capacity=1000, period=100, clock=clock)
+    assert seen.add('1.2.3.4|abc')
+    assert not seen.add('1.2.3.4|abc')
+    assert seen.add('1.2.3.4|def')
+    now[0] = 150  # Ancora nella generazione precedente
+    assert '1.2.3.4|abc' in seen
+    now[0] = 250  # Entrambe le generazioni scadute
+    assert seen.add('1.2.3.4|abc')
+    
+    limiter = RateLimiter(limit=5, window=60, clock=clock)
+    results = [limiter.hit('client')[0] for _ in range(7)]
+    assert results == [True] * 5 + [False] * 2
+    assert limiter.hit('altro')[0]
+    now[0] += 61  # Finestra scaduta
+    assert limiter.hit('client')[0]
+
+    # Un client che non rimanda mai i cookie resta lo stesso client
+    os.environ.setdefault('SNAPSHOT_DIR', '')
+    import web_app
+    saved = (web_app.suggestions_store, web_app.vote_rate_limiter, web_app.voted_filter)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SuggestionsStore(os.path.join(tmp, 's.json'), os.path.join(tmp, 's.log'))
+        suggestion_ids = [store.add('Anna', 'idea', f'Idea {i}')['id'] for i in range(30)]
+        web_app.suggestions_store = store
+        web_app.vote_rate_limiter = RateLimiter(limit=web_app.VOTE_RATE_LIMIT, window=60)
+        web_app.voted_filter = RotatingBloomFilter(capacity=1000, period=3600)
+        try:
+            client = web_app.app.test_client(use_cookies=False)
+            vote = lambda suggestion_id: client.post(f'/suggestions/vote/{suggestion_id}',
+                                                     json={'vote_type': 'up'}).status_code
+            assert vote(suggestion_ids[0]) == 200
+            assert [vote(suggestion_ids[0]) for _ in range(5)] == [409] * 5
+            assert store.get(suggestion_ids[0])['votes_up'] == 1
+            statuses = [vote(suggestion_id) for suggestion_id in suggestion_ids[1:]]
+            assert statuses.count(200) == web_app.VOTE_RATE_LIMIT - 6
+            assert statuses[-1] == 429
+        finally:
+            web_app.suggestions_store, web_app.vote_rate_limiter, web_app.voted_filter = saved
+
+    print("\n✅ Voti doppi e raffiche respinti")
+    
+    return True
+
+def test_timer_wheel():
+    """Test della timer wheel gerarchica"""
+    print("\n" + "="*60)
+    print("TEST: Timer Wheel")
+    print("="*60)
+    
+    now = [0.0]
+    wheel = TimerWheel(tick=0.1, slots=8, levels=3, clock=lambda: now[0])
+    rng = random.Random(3)
+    delays = [rng.uniform(0, 80) for _ in range(500)]  # Anche oltre l'orizzonte della ruota
+    fired = []
+    handles = [wheel.schedule(d, lambda i=i: fired.append((i, now[0]))) for i, d in enumerate(delays)]
+    for handle in handles[::5]:
+        handle.cancel()
+    
+    while now[0] < 90:
+        now[0] += rng.uniform(0.01, 0.5)
+        wheel.advance()
+    
+    assert sorted(i for i, _ in fired) == [i for i in range(500) if i % 5]
+    # Mai in anticipo, in ritardo al massimo di un passo
+    assert all(0 <= t - delays[i] <= 0.7 for i, t in fired)
+    assert len(wheel) == 0
+    
+    print("\n✅ Timer eseguiti una sola volta e in orario")
+    
+    return True
+
+class _MemoryUpload:
+    """File temporaneo finto per i test degli upload"""
+    
+    def __init__(self):
+        self.data = bytearray()
+        self.aborted = False
+    
+    @property
+    def size(self):
+        return len(self.data)
+    
+    def write(self, chunk):
+        self.data += chunk
+    
+    def abort(self):
+        self.aborted = True
+
+
+class _MemoryUploadStore:
+    def __init__(self):
+        self.uploads = []
+    
+    def new_upload(self):
+        self.uploads.append(_MemoryUpload())
+        return self.uploads[-1]
+
+
+def _multipart(parts, boundary='confine', close=True):
+    """Corpo multipart/form-data: parts è una lista di (nome campo, nome file o None, bytes)"""
+    body = b''
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f'--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n'.encode() + data + b'\r\n'
+    if close:
+        body += f'--{boundary}--\r\n'.encode()
+    return io.BytesIO(body), f'multipart/form-data; boundary={boundary}'
+
+def test_upload_stream():
+    """Test della lettura in streaming degli upload: limiti e riconoscimento del formato"""
+    print("\n" + "="*60)
+    print("TEST: Upload in Streaming")
+    print("="*60)
+    
+    png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 100
+    
+    # Formato riconosciuto dai primi byte, non dall'estensione; file troppo grande scartato
+    store = _MemoryUploadStore()
+    stream, content_type = _multipart([
+        ('image_type', None, b'custom'),
+        ('files', 'foto.jpg', png),
+        ('files', 'finta.png', b'<?php echo "ciao"; ?>'),
+        ('files', 'enorme.png', b'\x89PNG\r\n\x1a\n' + b'\x00' * 5000),
+        ('files', 'mini.gif', b'GIF89a\x01'),
+    ])
+    fields, files, errors = read_image_upload(stream, content_type, store, 1000, 100000)
+    assert fields == {'image_type': 'custom'}
+    assert [(name, ext) for name, ext, _ in files] == [('foto.jpg', '.png'), ('mini.gif', '.gif')]
+    assert bytes(files[0][2].data) == png
+    assert errors == ['finta.png: formato non supportato', 'enorme.png: file troppo grande']
+    assert [u.aborted for u in store.uploads] == [False, True, False]
+    
+    # Richiesta oltre il limite: rifiutata durante la lettura, temporanei eliminati
+    store = _MemoryUploadStore()
+    stream, content_type = _multipart([('files', 'a.png', png), ('files', 'b.png', png * 2000)])
+    try:
+        read_image_upload(stream, content_type, store, 10 ** 6, 100000)
+        assert False, "Upload troppo grande accettato"
+    except UploadRejected as e:
+        assert e.status == 413
+    assert store.uploads and all(u.aborted for u in store.uploads)
+    
+    # Corpo troncato (manca la chiusura del multipart)
+    store = _MemoryUploadStore()
+    stream, content_type = _multipart([('files', 'a.png', png)], close=False)
+    try:
+        read_image_upload(stream, content_type, store, 100000, 100000)
+        assert False, "Upload troncato accettato"
+    except UploadRejected as e:
+        assert e.message == 'Upload incompleto'
+    assert all(u.aborted for u in store.uploads)
+    
+    print("\n✅ Limiti e firme dei file rispettati")
+    
+    return True
+
+class _StateGame:
+    """Partita minima per i test dell'archivio"""
+    
+    def __init__(self, room_code, players):
+        self.room_code = room_code
+        self.players = players
+    
+    def to_state(self):
+        return [self.room_code, self.players]
+    
+    @classmethod
+    def from_state(cls, state):
+        return cls(*state)
+
+def test_game_store():
+    """Test dell'archivio condiviso delle partite"""
+    print("\n" + "="*60)
+    print("TEST: Archivio Partite")
+    print("="*60)
+    
+    server = LocalRespServer().start()
+    try:
+        client = RespClient.from_url(server.url)
+        # Scadenza finta: le stanze con meno giocatori scadono prima
+        expires_at = lambda game: len(game.players)
+        worker_a = RedisGameStore(client, _StateGame.from_state, expires_at=expires_at)
+        worker_b = RedisGameStore(client, _StateGame.from_state, expires_at=expires_at)
+        
+        worker_a['ABCD'] = _StateGame('ABCD', {'p1': 'Anna'})
+        worker_a.commit()
+        assert 'ABCD' in worker_b and len(worker_b) == 1
+        
+        # Due worker modificano la stessa stanza: il secondo deve riprovare
+        game_a = worker_a['ABCD']
+        game_b = worker_b['ABCD']
+        game_a.players['p2'] = 'Bruno'
+        game_b.players['p3'] = 'Carla'
+        worker_a.commit()
+        try:
+            worker_b.commit()
+            assert False, "Conflitto non rilevato"
+        except StaleGameError:
+            pass
+        assert worker_b['ABCD'].players == {'p1': 'Anna', 'p2': 'Bruno'}
+        worker_b.rollback()
+        
+        # Eliminare una stanza appena aggiornata da un altro worker è un conflitto
+        stale = worker_a['ABCD']
+        worker_b['ABCD'].players['p4'] = 'Dario'
+        worker_b.commit()
+        worker_a.pop('ABCD')
+        try:
+            worker_a.commit()
+            assert False, "Eliminazione in conflitto non rilevata"
+        except StaleGameError:
+            pass
+        assert 'ABCD' in worker_b
+        worker_b.rollback()
+        
+        # Più stanze in un'operazione: se una è in conflitto non se ne salva nessuna
+        worker_a['EFGH'] = _StateGame('EFGH', {'p5': 'Elena'})
+        worker_a['ABCD'].players['p6'] = 'Fabio'
+        worker_b['ABCD'].players['p7'] = 'Giulia'
+        worker_b.commit()
+        try:
+            worker_a.commit()
+            assert False, "Conflitto non rilevato"
+        except StaleGameError:
+            pass
+        assert 'EFGH' not in worker_b and 'p6' not in worker_b['ABCD'].players
+        worker_b.rollback()
+        
+        # Indice delle scadenze e lock della pulizia condivisi tra i worker
+        worker_a['IJKL'] = _StateGame('IJKL', {})
+        worker_a.commit()
+        assert worker_b.expiring(1) == ['IJKL']
+        assert worker_b.soonest(2) == ['IJKL', 'ABCD']
+        assert worker_a.try_lock('room_gc', 30) and not worker_b.try_lock('room_gc', 30)
+        
+        worker_b.pop('ABCD')
+        worker_b.pop('IJKL')
+        worker_b.commit()
+        assert 'ABCD' not in worker_a and len(worker_a) == 0
+        assert worker_a.soonest(5) == []
+    finally:
+        server.shutdown()
+        server.server_close()
+    
+    print("\n✅ Salvataggio con controllo di versione funzionante")
+    
+    return True
+
+def test_game_snapshots():
+    """Test delle istantanee delle partite su disco"""
+    print("\n" + "="*60)
+    print("TEST: Istantanee Partite")
+    print("="*60)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SnapshotStore(tmp)
+        game = _StateGame('ABCD', {'p1': 'Anna', 'p2': 'Bruno'})
+        assert store.save('ABCD', game.to_state()) > 0
+        assert store.save('ABCD', game.to_state()) == 0  # Nulla di nuovo da scrivere
+        store.save('WXYZ', _StateGame('WXYZ', {'p3': 'Carla'}).to_state())
+        # Gruppo preparato sul loop e scritto tutto insieme (in un thread nel server)
+        batch = [store.encode(code, _StateGame(code, {'p9': 'Ivo'}).to_state())
+                 for code in ('IJKL', 'MNPQ')]
+        assert store.write_many(batch) == sum(len(blob) for _, blob, _ in batch)
+        assert store.encode('IJKL', _StateGame('IJKL', {'p9': 'Ivo'}).to_state()) is None
+        store.delete('IJKL')
+        store.delete('MNPQ')
+        store.delete('WXYZ')
+        
+        # Scrittura interrotta e file danneggiato non devono impedire il ripristino
+        with open(os.path.join(tmp, 'ABCD.snap.tmp'), 'wb') as f:
+            f.write(b'mezzo file')
+        with open(os.path.join(tmp, 'EFGH.snap'), 'wb') as f:
+            f.write(b'MIS1\x00\x00\x00\x00rotto')
+        
+        restored = SnapshotStore(tmp).load_all()
+        assert list(restored) == ['ABCD']
+        assert _StateGame.from_state(restored['ABCD']).players == game.players
+        assert not os.path.exists(os.path.join(tmp, 'ABCD.snap.tmp'))
+    
+    print("\n✅ Istantanee atomiche e ripristinabili")
+    
+    return True
+
+def test_shard_router():
+    """Test della suddivisione delle stanze tra worker"""
+    print("\n" + "="*60)
+    print("TEST: Shard Router")
+    print("="*60)
+    
+    shards = [f'http://worker{i}:5000' for i in range(4)]
+    routers = [ShardRouter(shards, shard) for shard in shards]
+    rng = random.Random(5)
+    codes = {''.join(rng.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ', k=4)) for _ in range(4000)}
+    
+    # Tutti i worker concordano sul proprietario e il carico è bilanciato
+    owners = {code: routers[0].owner(code) for code in codes}
+    assert all(r.owner(code) == owners[code] for r in routers for code in list(codes)[:200])
+    counts = [sum(1 for o in owners.values() if o == shard) for shard in shards]
+    assert max(counts) < 1.2 * len(codes) / len(shards), counts
+    
+    # Aggiungendo un worker si spostano solo i codici che vanno a lui
+    router = routers[0]
+    local = [code for code in codes if owners[code] == router.self_shard]
+    pinned = router.rebalance(shards + ['http://worker4:5000'], local)
+    moved = [code for code in codes if router.owner(code) != owners[code]]
+    assert all(router.owner(code) == 'http://worker4:5000' for code in moved)
+    assert len(moved) < 1.3 * len(codes) / 5
+    assert set(pinned) == set(local) & set(moved)
+    # Le stanze già aperte restano rintracciabili sul vecchio worker
+    if moved:
+        newcomer = ShardRouter(router.shards, 'http://worker4:5000', previous=[shards])
+        assert newcomer.locate(moved[0], exists_locally=False) == owners[moved[0]]
+    
+    # Dopo due ribilanciamenti i rinvii vanno sempre verso layout più vecchi
+    layouts = [shards + [f'http://worker{i}:5000' for i in range(4, n)] for n in (6, 5, 4)]
+    cluster = {shard: ShardRouter(layouts[0], shard, previous=layouts[1:]) for shard in layouts[0]}
+    for code in list(codes)[:500]:
+        shard, hops = cluster[layouts[0][0]].locate(code, False), 0
+        while shard != owners[code]:
+            shard, hops = cluster[shard].locate(code, False), hops + 1
+            assert hops <= 2, code
+    
+    # Un layout si dimentica quando le sue stanze sono chiuse e il periodo minimo è passato
+    assert router.pinned_rooms() == set(pinned)
+    retired_at = router.previous[0]['retired_at']
+    if pinned:
+        assert router.prune(pinned, now=retired_at + router.retention) == 1
+    assert router.prune(set(), now=retired_at + router.retention - 1) == 1
+    assert router.prune(set(), now=retired_at + router.retention) == 0
+    assert router.pinned_rooms() == set()
+    
+    print(f"\n✅ Stanze per worker: {counts}, spostate: {len(moved)}/{len(codes)}")
+    
+    return True
+
+def test_event_coalescer():
+    """Test dell'accorpamento degli eventi di avanzamento"""
+    print("\n" + "="*60)
+    print("TEST: Accorpamento Eventi")
+    print("="*60)
+    
+    sent = []
+    coalescer = EventCoalescer(lambda event, data, room: sent.append((event, room, data)))
+    
+    # 8 consegne nello stesso intervallo: un solo messaggio con l'ultimo conteggio
+    for i in range(8):
+        coalescer.push('ABCD', 'player_ready', {'player_id': f'p{i}', 'ready_count': i + 1})
+    coalescer.push('WXYZ', 'player_voted', {'player_id': 'q1', 'vote_count': 1})
+    assert coalescer.flush_all() == 2
+    assert len(sent) == 2 and coalescer.merged == 7
+    event, room, data = sent[0]
+    assert (event, room, data['ready_count']) == ('player_ready', 'ABCD', 8)
+    assert data['player_ids'] == [f'p{i}' for i in range(8)]
+    
+    # Nulla in attesa: niente da inviare
+    assert coalescer.flush('ABCD') == 0 and coalescer.flush_all() == 0
+    
+    print("\n✅ Eventi a raffica accorpati in un solo messaggio")
+    
+    return True
+
+def test_wire_format():
+    """Test della scelta del formato degli eventi e del benchmark JSON/MessagePack"""
+    print("\n" + "="*60)
+    print("TEST: Formato Eventi")
+    print("="*60)
+
+    os.environ.setdefault('SNAPSHOT_DIR', '')
+    import web_app
+    if web_app.msgpack is None:
+        print("\n⚠️  msgpack non installato: test saltato")
+        return True
+
+    # MessagePack solo se questo processo vede tutti i membri delle stanze
+    negotiation = web_app.WIRE_CODEC_NEGOTIATION
+    try:
+        for enabled in (True, False):
+            web_app.WIRE_CODEC_NEGOTIATION = enabled
+            before = set(web_app.msgpack_sids)
+            client = web_app.socketio.test_client(web_app.app, query_string='codec=msgpack')
+            assert len(web_app.msgpack_sids - before) == (1 if enabled else 0)
+            client.disconnect()
+            assert web_app.msgpack_sids == before
+    finally:
+        web_app.WIRE_CODEC_NEGOTIATION = negotiation
+
+    # Il benchmark gioca un round vero e misura tutti gli eventi
+    import bench_wire
+    output = io.StringIO()
+    saved_stdout, sys.stdout = sys.stdout, output
+    try:
+        bench_wire.main(['2'])
+    finally:
+        sys.stdout = saved_stdout
+    report = output.getvalue()
+    assert 'nessun evento registrato' not in report
+    for event in bench_wire.EVENTS:
+        rows = [line.split() for line in report.splitlines() if line.startswith(event)]
+        assert [row[1] for row in rows] == ['json', 'msgpack'], report
+
+    print("\n✅ Formato negoziato e benchmark funzionante")
+
+    return True
+
+def _brute_readiness(game):
+    """Consegne e voti dei giocatori attivi contati da zero"""
+    active = [pid for pid in game.players if pid not in game.disconnected_players]
+    return (sum(1 for pid in active if pid in game.memes),
+            sum(1 for pid in active if pid in game.votes_for_current),
+            len(active))
+
+def test_readiness_counters():
+    """Test dei contatori di consegne e voti: sempre uguali al conteggio completo"""
+    print("\n" + "="*60)
+    print("TEST: Contatori Partita")
+    print("="*60)
+    
+    os.environ.setdefault('SNAPSHOT_DIR', '')
+    from web_app import Game
+    
+    rng = random.Random(11)
+    for trial in range(25):
+        game = Game(f'T{trial:03d}', 'p0', 'Giocatore 0')
+        next_id = 1
+        for _ in range(300):
+            players = list(game.players)
+            pid = rng.choice(players) if players else None
+            op = rng.randrange(12)
+            if op == 0 and len(players) < 8:
+                game.add_player(f'p{next_id}', f'Giocatore {next_id}')
+                next_id += 1
+            elif op == 1 and pid and len(players) > 1 and game.phase in ('lobby', 'results'):
+                # Come nel ritorno alla lobby: i giocatori si tolgono solo fuori dal round
+                game.phase = 'lobby'
+                game.remove_player(pid)
+            elif op == 2 and pid:
+                game.mark_disconnected(pid)
+            elif op == 3 and pid:
+                game.mark_connected(pid)
+            elif op == 4 and game.disconnected_players:
+                game.reconnect_player(rng.choice(sorted(game.disconnected_players)), f'p{next_id}')
+                next_id += 1
+            elif op == 5 and game.phase in ('lobby', 'results'):
+                game.start_round()
+            elif op == 6 and pid and game.phase == 'creating':
+                game.submit_meme(pid, 'didascalia', 'testo')
+            elif op == 7 and game.phase == 'creating':
+                game.start_voting()
+            elif op == 8 and pid and game.phase == 'voting' and pid in game.round_scores:
+                game.submit_vote_for_meme(pid, rng.choice((-1, 0, 1)))
+            elif op == 9 and game.phase == 'voting':
+                if game.next_meme():
+                    game.show_results()
+            elif op == 10:
+                game.fill_missing_memes() if game.phase == 'creating' else game.mark_all_voted()
+            elif op == 11:
+                game.clear_deadline()
+                game = Game.from_state(game.to_state())
+            
+            submitted, voted, active = _brute_readiness(game)
+            assert (game.active_submitted, game.active_voted) == (submitted, voted)
+            assert game.get_active_player_count() == active
+            assert game.check_all_memes_submitted() == (submitted == active)
+            assert game.check_all_voted_current() == (voted == active)
+        game.clear_deadline()
+    
+    print("\n✅ Contatori allineati al conteggio completo in ogni passo")
+    
+    return True
+
+def _apply_roster_delta(client, delta, resync):
+    """Come applyRosterDelta in game.js: client è [versione, elenco], resync() l'elenco completo"""
+    if delta['version'] == client[0]:
+        return False
+    if delta['base'] != client[0]:
+        # Aggiornamento perso: il client chiede l'elenco completo (roster_resync)
+        client[:] = resync()
+        return True
+    changed = {change['player_id'] for change in delta['changes']}
+    players = [p for p in client[1] if p['player_id'] not in changed]
+    for change in delta['changes']:
+        if not change.get('removed'):
+            entry = {k: v for k, v in change.items() if k != 'position'}
+            players.insert(change['position'], entry)
+    client[:] = [delta['version'], players]
+    return False
+
+def test_roster_delta():
+    """Test degli aggiornamenti incrementali dell'elenco giocatori"""
+    print("\n" + "="*60)
+    print("TEST: Elenco Giocatori")
+    print("="*60)
+    
+    os.environ.setdefault('SNAPSHOT_DIR', '')
+    from web_app import Game, get_players_info
+    
+    rng = random.Random(3)
+    resyncs = 0
+    for trial in range(20):
+        game = Game(f'R{trial:03d}', 'p0', 'Giocatore 0')
+        full_roster = lambda: [game.roster_version, get_players_info(game)]
+        client = full_roster()
+        next_id = 1
+        for step in range(200):
+            players = list(game.players)
+            pid = rng.choice(players)
+            op = rng.randrange(5)
+            if op == 0 and len(players) < 8:
+                game.add_player(f'p{next_id}', f'Giocatore {next_id}')
+                next_id += 1
+            elif op == 1 and len(players) > 1 and pid != game.host_id:
+                game.remove_player(pid)
+            elif op == 2:
+                game.mark_disconnected(pid)
+            elif op == 3 and pid in game.disconnected_players:
+                game.reconnect_player(pid, f'p{next_id}')
+                next_id += 1
+            elif op == 4:
+                game.set_host(pid)
+            delta = game.roster_delta()
+            if rng.random() < 0.1:
+                continue  # Aggiornamento perso per strada
+            resyncs += _apply_roster_delta(client, delta, full_roster)
+            assert client == full_roster(), (trial, step)
+    assert resyncs > 0
+    
+    print(f"\n✅ Elenco sempre allineato ({resyncs} riallineamenti completi)")
+    
+    return True
+
+def test_room_codes():
+    """Test dell'allocazione dei codici stanza"""
+    print("\n" + "="*60)
+    print("TEST: Codici Stanza")
+    print("="*60)
+    
+    # La permutazione tocca ogni valore una sola volta
+    permutation = FeistelPermutation(len(ALPHABET) ** 2, b'chiave')
+    assert sorted(permutation(i) for i in range(permutation.size)) == list(range(permutation.size))
+    
+    # Due worker con chiavi diverse: ognuno tiene solo i codici di sua proprietà
+    shards = ['http://worker0:5000', 'http://worker1:5000']
+    live = set()
+    allocators = []
+    for shard in shards:
+        router = ShardRouter(shards, shard)
+        allocator = RoomCodeAllocator(min_length=2, max_length=4, shards=2)
+        allocators.append((allocator, lambda code, r=router: r.is_local(code) and code not in live))
+    lengths = set()
+    for i in range(600):
+        allocator, is_free = allocators[i % 2]
+        code = allocator.allocate(len(live) // 2, is_free)
+        assert code not in live and set(code) <= set(ALPHABET)
+        live.add(code)
+        lengths.add(len(code))
+    # 22^2 = 484 codici da 2 lettere: oltre metà occupati si passa a 3
+    assert lengths == {2, 3}, lengths
+    
+    print(f"\n✅ {len(live)} codici unici tra due worker, lunghezze {sorted(lengths)}")
+    
+    return True
+
 def test_game_structure():
     """Test della struttura del gioco"""
     print("\n" + "="*60)
@@ -108,6 +968,23 @@ def run_all_tests():
     tests = [
         ("Display", test_display),
         ("Database Template", test_templates),
+        ("Catalogo Immagini", test_image_catalog),
+        ("Mazziere Template", test_template_dealer),
+        ("BK-tree", test_bk_tree),
+        ("Classifica Suggerimenti", test_suggestions_ranking),
+        ("Log Suggerimenti", test_suggestions_log),
+        ("Indice Testuale", test_text_index),
+        ("Limiti Voti", test_vote_limits),
+        ("Upload in Streaming", test_upload_stream),
+        ("Timer Wheel", test_timer_wheel),
+        ("Archivio Partite", test_game_store),
+        ("Istantanee Partite", test_game_snapshots),
+        ("Shard Router", test_shard_router),
+        ("Accorpamento Eventi", test_event_coalescer),
+        ("Formato Eventi", test_wire_format),
+        ("Contatori Partita", test_readiness_counters),
+        ("Elenco Giocatori", test_roster_delta),
+        ("Codici Stanza", test_room_codes),
         ("Struttura Progetto", test_game_structure)
     ]
     
@@ -0,0 +1,44 @@
+"""
+Accorpamento degli eventi di avanzamento
+Quando più giocatori consegnano o votano nello stesso istante, invece di
+un messaggio a tutta la stanza per ognuno se ne invia uno solo, con i
+conteggi più recenti, ogni intervallo (es. 50 ms). Prima di qualunque
+altro evento alla stanza (es. voting_start) quelli in attesa partono
+subito, così l'ordine resta quello originale.
+"""
+
+
+class EventCoalescer:
+    """Eventi in attesa per stanza: per ogni tipo conta solo l'ultimo"""
+
+    def __init__(self, emit, interval=0.05):
+        self.emit = emit  # Funzione (evento, dati, stanza) che invia davvero
+        self.interval = interval
+        self.pending = {}  # {stanza: {evento: [dati più recenti, giocatori coinvolti]}}
+        self.merged = 0  # Eventi assorbiti da uno successivo
+        self.sent = 0  # Messaggi inviati
+
+    def push(self, room, event, data):
+        """Accoda un evento di avanzamento per la stanza"""
+        events = self.pending.setdefault(room, {})
+        entry = events.get(event)
+        if entry is None:
+            events[event] = [data, [data.get('player_id')]]
+        else:
+            entry[0] = data
+            entry[1].append(data.get('player_id'))
+            self.merged += 1
+
+    def flush(self, room):
+        """Invia subito gli eventi in attesa di una stanza"""
+        events = self.pending.pop(room, None)
+        if not events:
+            return 0
+        for event, (data, player_ids) in events.items():
+            self.emit(event, {**data, 'player_ids': player_ids}, room)
+            self.sent += 1
+        return len(events)
+
+    def flush_all(self):
+        """Invia gli eventi in attesa di tutte le stanze (a ogni intervallo)"""
+        return sum(self.flush(room) for room in list(self.pending))
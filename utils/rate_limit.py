@@ -0,0 +1,133 @@
+"""
+Limitazione dei voti a memoria costante
+Un filtro di Bloom a rotazione ricorda quali client hanno già votato un
+suggerimento e un count-min sketch a finestre temporali conta le richieste
+recenti di ogni client. Entrambi occupano sempre la stessa memoria, qualunque
+sia il numero di client: in cambio ammettono rari falsi positivi (un voto
+respinto per errore), mai falsi negativi.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from array import array
+
+
+def _hashes(key, count, size):
+    """count posizioni in [0, size) derivate da un'unica chiave (double hashing)"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % size for i in range(count)]
+
+
+class RotatingBloomFilter:
+    """
+    Insieme approssimato che dimentica le chiavi dopo un certo tempo
+    Tiene due generazioni: le chiavi restano note tra period e 2*period secondi.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001, period=86400, clock=time.monotonic):
+        # Dimensionamento classico: m = -n ln p / (ln 2)^2, k = m/n ln 2
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.period = period
+        self.clock = clock
+        self._current = bytearray((self.size + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._rotated_at = clock()
+        self._lock = threading.Lock()
+
+    def _rotate(self):
+        """Scarta la generazione più vecchia quando è scaduto il periodo"""
+        now = self.clock()
+        elapsed = now - self._rotated_at
+        if elapsed < self.period:
+            return
+        if elapsed >= 2 * self.period:
+            # Nessuna attività per due periodi: entrambe le generazioni sono scadute
+            self._previous = bytearray(len(self._current))
+        else:
+            self._previous = self._current
+        self._current = bytearray(len(self._previous))
+        self._rotated_at = now
+
+    @staticmethod
+    def _test(bits, positions):
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def add(self, key):
+        """
+        Registra una chiave
+        Restituisce False se era già presente (o è un falso positivo)
+        """
+        positions = _hashes(key, self.hash_count, self.size)
+        with self._lock:
+            self._rotate()
+            if self._test(self._current, positions) or self._test(self._previous, positions):
+                return False
+            for p in positions:
+                self._current[p >> 3] |= 1 << (p & 7)
+            return True
+
+    def __contains__(self, key):
+        positions = _hashes(key, self.hash_count, self.size)
+        with self._lock:
+            self._rotate()
+            return self._test(self._current, positions) or self._test(self._previous, positions)
+
+
+class RateLimiter:
+    """
+    Al massimo limit richieste per client in una finestra di window secondi
+    I conteggi stanno in un count-min sketch per ogni intervallo della
+    finestra: gli intervalli scaduti vengono azzerati e riutilizzati.
+    """
+
+    def __init__(self, limit=30, window=60, buckets=6, width=4096, depth=4, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self.bucket_seconds = window / buckets
+        self.width = width
+        self.depth = depth
+        self.clock = clock
+        self._sketches = [array('I', bytes(4 * width * depth)) for _ in range(buckets)]
+        self._epochs = [None] * buckets  # Intervallo a cui si riferisce ogni sketch
+        self._lock = threading.Lock()
+
+    def _estimate(self, cells, now_epoch):
+        """Richieste stimate nella finestra: minimo tra le righe della somma sugli intervalli"""
+        totals = [0] * self.depth
+        for sketch, epoch in zip(self._sketches, self._epochs):
+            if epoch is not None and now_epoch - epoch < len(self._sketches):
+                for row, cell in enumerate(cells):
+                    totals[row] += sketch[cell]
+        return min(totals)
+
+    def hit(self, key):
+        """
+        Conta una richiesta del client
+        Restituisce (consentita, secondi prima di riprovare)
+        """
+        cells = [row * self.width + col
+                 for row, col in enumerate(_hashes(key, self.depth, self.width))]
+        epoch = int(self.clock() // self.bucket_seconds)
+        with self._lock:
+            if self._estimate(cells, epoch) >= self.limit:
+                # Nel caso peggiore si libera spazio quando scade l'intervallo più vecchio
+                retry_after = max(1, math.ceil(self.bucket_seconds))
+                return False, retry_after
+            slot = epoch % len(self._sketches)
+            if self._epochs[slot] != epoch:
+                self._epochs[slot] = epoch
+                self._sketches[slot] = array('I', bytes(4 * self.width * self.depth))
+            sketch = self._sketches[slot]
+            for cell in cells:
+                sketch[cell] += 1
+            return True, 0
+
+    @property
+    def memory_bytes(self):
+        """Memoria occupata dai contatori"""
+        return sum(s.itemsize * len(s) for s in self._sketches)
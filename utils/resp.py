@@ -0,0 +1,408 @@
+"""
+Client minimo per il protocollo di Redis (RESP2)
+Basta per salvare lo stato delle partite in Redis (o in un server
+compatibile) senza dipendenze esterne. LocalRespServer è un sostituto
+in memoria che implementa solo i comandi usati dal gioco: serve per lo
+sviluppo e i test, non per la produzione.
+
+Avvio del server locale:
+    python -m utils.resp [porta]
+"""
+
+import socket
+import socketserver
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class RespError(Exception):
+    """Errore restituito dal server"""
+
+
+def read_reply(stream):
+    """Legge un valore RESP da uno stream binario"""
+    line = stream.readline()
+    if not line:
+        raise ConnectionError('Connessione chiusa')
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest.decode()
+    if kind == b'-':
+        return RespError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        return stream.read(length + 2)[:-2]
+    if kind == b'*':
+        count = int(rest)
+        if count < 0:
+            return None
+        return [read_reply(stream) for _ in range(count)]
+    raise RespError(f'Risposta non valida: {line!r}')
+
+
+class RespConnection:
+    """Una connessione: i comandi vengono inviati e letti in ordine"""
+
+    def __init__(self, host, port, db=0, password=None, timeout=5):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        if password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+
+    @staticmethod
+    def encode(args):
+        """Comando -> array RESP di bulk string"""
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode('utf-8')
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def read_reply(self):
+        """Legge una risposta; gli errori diventano RespError (restituiti, non sollevati)"""
+        return read_reply(self.reader)
+
+    def pipeline(self, commands):
+        """Invia più comandi in un solo pacchetto e restituisce le risposte"""
+        self.sock.sendall(b''.join(self.encode(c) for c in commands))
+        return [self.read_reply() for _ in commands]
+
+    def execute(self, *args):
+        """Esegue un comando"""
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RespClient:
+    """Pool di connessioni: ogni operazione (o transazione) ne usa una tutta per sé"""
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, max_idle=8):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url):
+        """redis://[:password@]host[:port][/db]"""
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip('/') or 0)
+        return cls(parsed.hostname or 'localhost', parsed.port or 6379, db, parsed.password)
+
+    def connection(self):
+        """Context manager che presta una connessione del pool"""
+        return _Borrowed(self)
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return RespConnection(self.host, self.port, self.db, self.password)
+
+    def _release(self, conn, broken):
+        if broken:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def execute(self, *args):
+        with self.connection() as conn:
+            return conn.execute(*args)
+
+    def pipeline(self, commands):
+        with self.connection() as conn:
+            return conn.pipeline(commands)
+
+
+class _Borrowed:
+    def __init__(self, client):
+        self.client = client
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.client._acquire()
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        # Dopo un errore la connessione può avere risposte non lette o un WATCH attivo
+        self.client._release(self.conn, broken=exc_type is not None)
+        return False
+
+
+# ---- Server locale ----
+
+class _Store:
+    """Dati del server locale, condivisi tra le connessioni"""
+
+    def __init__(self):
+        self.data = {}  # {chiave: valore (bytes, dict o set)}
+        self.expires = {}  # {chiave: scadenza monotonic}
+        self.revisions = {}  # {chiave: contatore di modifiche}, per WATCH
+        self.lock = threading.Lock()
+
+    def alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.delete(key)
+        return key in self.data
+
+    def touch(self, key):
+        self.revisions[key] = self.revisions.get(key, 0) + 1
+
+    def delete(self, key):
+        existed = self.data.pop(key, None) is not None
+        self.expires.pop(key, None)
+        self.touch(key)
+        return existed
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Una connessione al server locale"""
+
+    def handle(self):
+        self.watched = {}
+        self.queued = None  # Comandi in coda dopo MULTI
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            if not isinstance(command, list) or not command:
+                return
+            name = command[0].decode().upper()
+            args = command[1:]
+            if self.queued is not None and name not in ('EXEC', 'DISCARD', 'MULTI', 'WATCH'):
+                self.queued.append((name, args))
+                reply = 'QUEUED'
+            else:
+                with self.server.store.lock:
+                    try:
+                        reply = self.dispatch(name, args)
+                    except RespError as e:
+                        reply = e
+            self.wfile.write(self.encode_reply(reply))
+
+    @staticmethod
+    def encode_reply(reply):
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, RespError):
+            return b'-%s\r\n' % str(reply).encode()
+        if isinstance(reply, bool):
+            reply = int(reply)
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, str):
+            return b'+%s\r\n' % reply.encode()
+        if isinstance(reply, bytes):
+            return b'$%d\r\n%s\r\n' % (len(reply), reply)
+        if isinstance(reply, list):
+            return b'*%d\r\n' % len(reply) + b''.join(_Handler.encode_reply(r) for r in reply)
+        raise TypeError(reply)
+
+    def dispatch(self, name, args):
+        store = self.server.store
+        if name == 'MULTI':
+            self.queued = []
+            return 'OK'
+        if name == 'DISCARD':
+            self.queued = None
+            self.watched = {}
+            return 'OK'
+        if name == 'WATCH':
+            for key in args:
+                store.alive(key)
+                self.watched[key] = store.revisions.get(key, 0)
+            return 'OK'
+        if name == 'UNWATCH':
+            self.watched = {}
+            return 'OK'
+        if name == 'EXEC':
+            queued, self.queued = self.queued or [], None
+            watched, self.watched = self.watched, {}
+            for key, revision in watched.items():
+                store.alive(key)
+                if store.revisions.get(key, 0) != revision:
+                    return None  # Una chiave osservata è cambiata: transazione annullata
+            return [self._run_queued(n, a) for n, a in queued]
+        handler = getattr(self, f'cmd_{name.lower()}', None)
+        if handler is None:
+            raise RespError(f'ERR unknown command {name}')
+        return handler(store, *args)
+
+    def _run_queued(self, name, args):
+        try:
+            return self.dispatch(name, args)
+        except RespError as e:
+            return e
+
+    def cmd_ping(self, store, *args):
+        return 'PONG'
+
+    def cmd_select(self, store, db):
+        return 'OK'
+
+    def cmd_get(self, store, key):
+        return store.data.get(key) if store.alive(key) else None
+
+    def cmd_set(self, store, key, value, *options):
+        options = [option.decode().upper() for option in options]
+        if 'NX' in options and store.alive(key):
+            return None
+        store.data[key] = value
+        store.expires.pop(key, None)
+        if 'EX' in options:
+            store.expires[key] = time.monotonic() + int(options[options.index('EX') + 1])
+        store.touch(key)
+        return 'OK'
+
+    def cmd_del(self, store, *keys):
+        return sum(store.delete(key) for key in keys if store.alive(key))
+
+    def cmd_exists(self, store, *keys):
+        return sum(1 for key in keys if store.alive(key))
+
+    def cmd_expire(self, store, key, seconds):
+        if not store.alive(key):
+            return 0
+        store.expires[key] = time.monotonic() + int(seconds)
+        return 1
+
+    def cmd_hget(self, store, key, field):
+        return store.data.get(key, {}).get(field) if store.alive(key) else None
+
+    def cmd_hmget(self, store, key, *fields):
+        values = store.data.get(key, {}) if store.alive(key) else {}
+        return [values.get(f) for f in fields]
+
+    def cmd_hset(self, store, key, *pairs):
+        store.alive(key)
+        values = store.data.setdefault(key, {})
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in values
+            values[field] = value
+        store.touch(key)
+        return added
+
+    def cmd_sadd(self, store, key, *members):
+        store.alive(key)
+        values = store.data.setdefault(key, set())
+        before = len(values)
+        values.update(members)
+        store.touch(key)
+        return len(values) - before
+
+    def cmd_srem(self, store, key, *members):
+        if not store.alive(key):
+            return 0
+        values = store.data[key]
+        before = len(values)
+        values.difference_update(members)
+        store.touch(key)
+        if not values:
+            store.delete(key)
+        return before - len(values)
+
+    def cmd_smembers(self, store, key):
+        return sorted(store.data.get(key, ())) if store.alive(key) else []
+
+    def cmd_scard(self, store, key):
+        return len(store.data.get(key, ())) if store.alive(key) else 0
+
+    def cmd_zadd(self, store, key, *pairs):
+        store.alive(key)
+        values = store.data.setdefault(key, {})  # {membro: punteggio}
+        added = 0
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            added += member not in values
+            values[member] = float(score)
+        store.touch(key)
+        return added
+
+    def cmd_zrem(self, store, key, *members):
+        if not store.alive(key):
+            return 0
+        values = store.data[key]
+        removed = sum(values.pop(member, None) is not None for member in members)
+        store.touch(key)
+        if not values:
+            store.delete(key)
+        return removed
+
+    @staticmethod
+    def _sorted_members(store, key):
+        values = store.data.get(key, {}) if store.alive(key) else {}
+        return sorted(values.items(), key=lambda item: (item[1], item[0]))
+
+    def cmd_zrange(self, store, key, start, stop):
+        members = [member for member, _ in self._sorted_members(store, key)]
+        start, stop = int(start), int(stop)
+        stop = len(members) + stop if stop < 0 else stop
+        return members[start:stop + 1]
+
+    def cmd_zrangebyscore(self, store, key, low, high, *limit):
+        low, high = float(low), float(high)  # Accetta anche -inf e +inf
+        members = [member for member, score in self._sorted_members(store, key)
+                   if low <= score <= high]
+        if limit:
+            offset, count = int(limit[1]), int(limit[2])
+            members = members[offset:offset + count]
+        return members
+
+
+class LocalRespServer(socketserver.ThreadingTCPServer):
+    """Server RESP in memoria (un thread per connessione)"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.store = _Store()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'redis://{host}:{port}/0'
+
+    def start(self):
+        """Avvia il server in un thread in background"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+if __name__ == '__main__':
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 6379
+    server = LocalRespServer(port=port)
+    print(f"Server RESP locale su {server.url}")
+    server.serve_forever()
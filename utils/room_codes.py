@@ -0,0 +1,112 @@
+"""
+Allocazione dei codici stanza
+Invece di estrarre codici a caso e riprovare finché se ne trova uno
+libero, ogni lunghezza di codice ha un contatore che passa attraverso una
+permutazione pseudo-casuale (rete di Feistel con cycle walking): i codici
+sembrano casuali ma non si ripetono finché il contatore non ha fatto il
+giro. Quando le stanze attive superano una frazione dei codici disponibili
+si passa a codici più lunghi. L'alfabeto esclude le lettere che si
+confondono facilmente (I, L, O, Q).
+"""
+
+import hashlib
+import os
+import random
+
+ALPHABET = 'ABCDEFGHJKMNPRSTUVWXYZ'
+
+
+def encode_code(index, length):
+    """Numero in [0, len(ALPHABET)**length) -> codice di length lettere"""
+    letters = []
+    for _ in range(length):
+        index, digit = divmod(index, len(ALPHABET))
+        letters.append(ALPHABET[digit])
+    return ''.join(reversed(letters))
+
+
+class FeistelPermutation:
+    """Permutazione di [0, size) derivata da una chiave (cifratura che preserva il formato)"""
+
+    def __init__(self, size, key, rounds=4):
+        self.size = size
+        self.key = key
+        self.rounds = rounds
+        bits = max(2, (size - 1).bit_length())
+        bits += bits % 2  # Due metà della stessa ampiezza
+        self.half = bits // 2
+        self.mask = (1 << self.half) - 1
+
+    def _round(self, round_index, value):
+        digest = hashlib.blake2b(value.to_bytes(8, 'big') + bytes([round_index]),
+                                 key=self.key, digest_size=8).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half, value & self.mask
+        for round_index in range(self.rounds):
+            left, right = right, left ^ self._round(round_index, right)
+        return (left << self.half) | right
+
+    def __call__(self, index):
+        # Il dominio della rete è una potenza di 2: si ripete finché il valore rientra in size
+        value = self._encrypt(index)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+
+class RoomCodeAllocator:
+    """
+    Codici stanza unici senza tentativi a vuoto
+    is_free decide se un codice è utilizzabile (non in uso, appartiene a questo worker):
+    con più worker ognuno tiene solo i codici di sua proprietà, quindi non
+    servono coordinamento né una chiave condivisa.
+    """
+
+    def __init__(self, min_length=4, max_length=8, load_factor=0.5, shards=1, key=None):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.load_factor = load_factor  # Oltre questa frazione di codici occupati si allunga
+        self.shards = shards  # Worker tra cui sono divisi i codici
+        self.key = key or os.urandom(16)
+        self._lanes = {}  # {lunghezza: [permutazione, contatore]}
+        self.allocated = 0
+        self.attempts = 0
+
+    @staticmethod
+    def capacity(length):
+        return len(ALPHABET) ** length
+
+    def length_for(self, live_rooms):
+        """Lunghezza dei codici per il numero di stanze attive in questo worker"""
+        length = self.min_length
+        while (length < self.max_length
+               and live_rooms >= self.capacity(length) / self.shards * self.load_factor):
+            length += 1
+        return length
+
+    def _next(self, length):
+        lane = self._lanes.get(length)
+        if lane is None:
+            permutation = FeistelPermutation(self.capacity(length), self.key + bytes([length]))
+            # Partenza casuale: dopo un riavvio non si ricomincia dagli stessi codici
+            lane = self._lanes[length] = [permutation, random.randrange(permutation.size)]
+        permutation, counter = lane
+        lane[1] = (counter + 1) % permutation.size
+        return encode_code(permutation(counter), length)
+
+    def allocate(self, live_rooms, is_free, max_attempts=None):
+        """Nuovo codice stanza; se troppi codici di una lunghezza sono occupati passa alla successiva"""
+        max_attempts = max_attempts or 64 * self.shards
+        length = self.length_for(live_rooms)
+        while True:
+            for _ in range(max_attempts):
+                code = self._next(length)
+                self.attempts += 1
+                if is_free(code):
+                    self.allocated += 1
+                    return code
+            if length >= self.max_length:
+                raise RuntimeError('Nessun codice stanza disponibile')
+            length += 1
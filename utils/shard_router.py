@@ -0,0 +1,100 @@
+"""
+Suddivisione delle stanze tra più processi (shard)
+Ogni stanza appartiene a un solo worker, scelto con un hash "rendezvous"
+del codice: tutti i worker calcolano lo stesso proprietario senza
+parlarsi e la partita resta nella memoria di quel processo.
+Aggiungendo un worker si sposta solo la quota di codici che gli spetta;
+le stanze già aperte restano dove sono grazie ai layout precedenti.
+"""
+
+import hashlib
+import time
+
+
+def _score(shard, room_code):
+    """Peso di uno shard per un codice: vince il più alto"""
+    digest = hashlib.blake2b(f'{shard}|{room_code}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def owner_of(shards, room_code):
+    """Shard proprietario di un codice stanza"""
+    return max(shards, key=lambda shard: _score(shard, room_code))
+
+
+class ShardRouter:
+    """Layout degli shard visto da un worker"""
+
+    def __init__(self, shards, self_shard, previous=(), retention=6 * 3600):
+        if self_shard not in shards:
+            raise ValueError(f'Shard {self_shard} non presente in {shards}')
+        self.shards = list(shards)  # URL pubblici dei worker
+        self.self_shard = self_shard
+        self.retention = retention  # Secondi minimi per cui si ricorda un layout sostituito
+        # Layout sostituiti, dal più recente, con le stanze di questo worker rimaste per quel layout
+        now = time.time()
+        self.previous = [{'shards': list(layout), 'retired_at': now, 'pinned': set()}
+                         for layout in previous]
+
+    @classmethod
+    def from_config(cls, shard_urls, shard_id):
+        """Router da variabili d'ambiente: elenco di URL separati da virgola e indice di questo worker"""
+        shards = [url.strip().rstrip('/') for url in (shard_urls or '').split(',') if url.strip()]
+        if not shards:
+            return None
+        return cls(shards, shards[int(shard_id or 0)])
+
+    def owner(self, room_code):
+        """Shard che deve ospitare la stanza secondo il layout corrente"""
+        return owner_of(self.shards, room_code)
+
+    def is_local(self, room_code):
+        return self.owner(room_code) == self.self_shard
+
+    def locate(self, room_code, exists_locally):
+        """
+        Dove si trova una stanza esistente
+        Una stanza aperta prima di un ribilanciamento resta sul proprietario di allora:
+        se non è qui si passa al proprietario del layout precedente a quello in cui
+        questo worker compare per ultimo, così ogni rinvio va verso layout più vecchi
+        """
+        if exists_locally:
+            return self.self_shard
+        chain = [self.shards] + [layout['shards'] for layout in self.previous]
+        owners = [owner_of(shards, room_code) for shards in chain]
+        if self.self_shard not in owners:
+            return owners[0]
+        last = len(owners) - 1 - owners[::-1].index(self.self_shard)
+        return owners[last + 1] if last + 1 < len(owners) else self.self_shard
+
+    def rebalance(self, shards, local_rooms=()):
+        """
+        Nuovo elenco di shard (es. un worker aggiunto)
+        Restituisce le stanze locali che con il nuovo layout spetterebbero ad altri:
+        restano qui finché non finiscono
+        """
+        shards = [url.rstrip('/') for url in shards]
+        if self.self_shard not in shards:
+            raise ValueError(f'Shard {self.self_shard} non presente in {shards}')
+        pinned = [code for code in local_rooms if owner_of(shards, code) != self.self_shard]
+        self.previous.insert(0, {'shards': self.shards, 'retired_at': time.time(),
+                                 'pinned': set(pinned)})
+        self.shards = shards
+        return pinned
+
+    def pinned_rooms(self):
+        """Stanze di questo worker che restano qui per un layout precedente"""
+        return set().union(*(layout['pinned'] for layout in self.previous))
+
+    def prune(self, live_rooms, now=None):
+        """
+        Dimentica i layout sostituiti quando le stanze rimaste qui sono tutte chiuse
+        e sono passati almeno retention secondi (altri worker potrebbero averne ancora)
+        """
+        now = time.time() if now is None else now
+        live_rooms = set(live_rooms)
+        for layout in self.previous:
+            layout['pinned'] &= live_rooms
+        self.previous = [layout for layout in self.previous
+                         if layout['pinned'] or now - layout['retired_at'] < self.retention]
+        return len(self.previous)
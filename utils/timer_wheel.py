@@ -0,0 +1,117 @@
+"""
+Timer wheel gerarchica
+Tutte le scadenze delle stanze stanno in un'unica struttura fatta di più
+livelli di "ruote": inserire o annullare un timer costa O(1) e un solo task
+che chiama advance() a ogni tick basta per migliaia di stanze, invece di
+un greenlet in attesa per ognuna.
+"""
+
+import math
+import time
+
+
+class TimerHandle:
+    """Timer programmato; cancel() lo annulla senza toccare la ruota"""
+
+    __slots__ = ('expires', 'callback', 'args', 'cancelled')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires  # Tick di scadenza
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Ruote concentriche di slots caselle: il livello 0 ha un tick per casella,
+    il livello n slots**n tick. I timer lontani scendono di livello
+    ("cascata") man mano che la loro scadenza si avvicina.
+    """
+
+    def __init__(self, tick=0.1, slots=64, levels=4, clock=time.monotonic):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.current = 0  # Ultimo tick elaborato
+        self._origin = clock()
+        self._pending = 0  # Timer nella ruota (compresi gli annullati non ancora rimossi)
+
+    def _now_tick(self):
+        return int((self.clock() - self._origin) / self.tick)
+
+    def _place(self, handle):
+        """Mette un timer nella casella giusta in base a quanto manca alla scadenza"""
+        delta = max(handle.expires - self.current, 1)
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1) or level == self.levels - 1:
+                break
+        if delta >= self.slots ** self.levels:
+            # Oltre l'orizzonte della ruota: resta nell'ultima casella e viene ricollocato
+            slot = (self.current // self.slots ** level - 1) % self.slots
+        else:
+            slot = (handle.expires // self.slots ** level) % self.slots
+        self.wheels[level][slot].append(handle)
+
+    def schedule(self, delay, callback, *args):
+        """Chiama callback(*args) tra delay secondi"""
+        # La ruota può essere rimasta indietro: si conta dal tick reale
+        expires = max(self._now_tick(), self.current) + max(1, math.ceil(delay / self.tick))
+        handle = TimerHandle(expires, callback, args)
+        self._place(handle)
+        self._pending += 1
+        return handle
+
+    def _cascade(self, level):
+        """Ridistribuisce sui livelli inferiori la casella del livello dato appena raggiunta"""
+        slot = (self.current // self.slots ** level) % self.slots
+        bucket = self.wheels[level][slot]
+        self.wheels[level][slot] = []
+        for handle in bucket:
+            if handle.cancelled:
+                self._pending -= 1
+            else:
+                self._place(handle)
+
+    def advance(self):
+        """
+        Elabora tutti i tick trascorsi ed esegue i timer scaduti
+        Restituisce il numero di callback eseguite
+        """
+        target = self._now_tick()
+        if self._pending == 0:
+            self.current = max(self.current, target)
+            return 0
+        fired = 0
+        while self.current < target:
+            self.current += 1
+            # Quando il livello 0 completa un giro, scendono i timer dei livelli superiori
+            for level in range(1, self.levels):
+                if self.current % self.slots ** level:
+                    break
+                self._cascade(level)
+            slot = self.current % self.slots
+            bucket = self.wheels[0][slot]
+            self.wheels[0][slot] = []
+            for handle in bucket:
+                if handle.expires > self.current:
+                    # Timer oltre l'orizzonte arrivato qui in anticipo
+                    self._place(handle)
+                    continue
+                self._pending -= 1
+                if handle.cancelled:
+                    continue
+                fired += 1
+                try:
+                    handle.callback(*handle.args)
+                except Exception as e:
+                    print(f"Errore in un timer: {e}")
+        return fired
+
+    def __len__(self):
+        return self._pending
@@ -0,0 +1,156 @@
+"""
+Lettura in streaming degli upload di immagini
+Legge il corpo multipart a blocchi, applica i limiti di dimensione
+man mano che arrivano i byte e riconosce il formato dai primi byte
+del file invece che dall'estensione.
+"""
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Firme iniziali dei formati accettati -> estensione da usare
+MAGIC_NUMBERS = [
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+]
+
+# Byte necessari per riconoscere il formato
+SNIFF_BYTES = 12
+
+
+class UploadRejected(Exception):
+    """Upload rifiutato: il messaggio è mostrato all'utente"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def sniff_image_extension(head):
+    """Estensione corrispondente ai primi byte del file, o None se non è un'immagine"""
+    for magic, ext in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    return None
+
+
+def iter_multipart(stream, content_type, max_request_size, chunk_size=CHUNK_SIZE):
+    """
+    Genera gli eventi multipart (Field, File, Data) leggendo il corpo a blocchi
+    Solleva UploadRejected appena i byte letti superano max_request_size
+    """
+    mimetype, options = parse_options_header(content_type or '')
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise UploadRejected('Richiesta non valida')
+
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    total = 0
+    finished = False
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError:
+            # Il decoder rifiuta un corpo troncato o malformato
+            raise UploadRejected('Upload incompleto' if finished else 'Richiesta non valida')
+        if isinstance(event, NeedData):
+            if finished:
+                raise UploadRejected('Upload incompleto')
+            chunk = stream.read(chunk_size)
+            total += len(chunk)
+            if total > max_request_size:
+                raise UploadRejected('Upload troppo grande', 413)
+            if chunk:
+                decoder.receive_data(chunk)
+            else:
+                finished = True
+                decoder.receive_data(None)
+        elif isinstance(event, Epilogue):
+            return
+        else:
+            yield event
+
+
+def read_image_upload(stream, content_type, store, max_file_size, max_request_size):
+    """
+    Legge un form di upload salvando ogni immagine in un file temporaneo dello store
+    Restituisce (campi, file, errori): file è una lista di (nome, estensione, writer)
+    """
+    fields = {}
+    files = []
+    errors = []
+    current = None  # Parte in lettura: dict con tipo e stato
+
+    try:
+        for event in iter_multipart(stream, content_type, max_request_size):
+            if isinstance(event, Field):
+                current = {'kind': 'field', 'name': event.name, 'value': bytearray()}
+            elif isinstance(event, File):
+                current = {'kind': 'file', 'filename': event.filename, 'head': b'',
+                           'ext': None, 'writer': None, 'skip': not event.filename}
+            elif isinstance(event, Data):
+                if current['kind'] == 'field':
+                    current['value'] += event.data
+                    if len(current['value']) > 1024:
+                        raise UploadRejected('Campo troppo lungo')
+                    if not event.more_data:
+                        fields[current['name']] = current['value'].decode('utf-8', 'replace')
+                    continue
+
+                _feed_file(current, event.data, store, max_file_size, errors)
+                if not event.more_data and not current['skip']:
+                    if current['writer'] is None:
+                        # File più corto della firma: verifica quello che c'è
+                        _start_file(current, store, errors)
+                    if current['writer'] is not None:
+                        files.append((current['filename'], current['ext'], current['writer']))
+    except BaseException:
+        # Errore a metà: elimina tutti i temporanei
+        for _, _, writer in files:
+            writer.abort()
+        if current and current.get('writer') is not None:
+            current['writer'].abort()
+        raise
+
+    return fields, files, errors
+
+
+def _start_file(current, store, errors):
+    """Controlla la firma del file e apre il temporaneo"""
+    ext = sniff_image_extension(current['head'])
+    if ext is None:
+        errors.append(f"{current['filename']}: formato non supportato")
+        current['skip'] = True
+        return
+    current['ext'] = ext
+    current['writer'] = store.new_upload()
+    current['writer'].write(current['head'])
+
+
+def _feed_file(current, data, store, max_file_size, errors):
+    """Passa un blocco di dati al file in lettura, scartandolo se rifiutato"""
+    if current['skip']:
+        return
+    if current['writer'] is None:
+        current['head'] += data
+        if len(current['head']) < SNIFF_BYTES:
+            return
+        _start_file(current, store, errors)
+        if current['writer'] is None:
+            return
+    else:
+        current['writer'].write(data)
+
+    if current['writer'].size > max_file_size:
+        current['writer'].abort()
+        current['writer'] = None
+        current['skip'] = True
+        errors.append(f"{current['filename']}: file troppo grande")
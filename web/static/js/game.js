@@ -3,8 +3,100 @@
  * Client-side game logic
  */
 
+// ===================================
+// Wire Codec
+// ===================================
+
+// Decoder MessagePack minimo (solo i tipi usati dal server: niente estensioni)
+function msgpackDecode(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    const utf8 = new TextDecoder();
+    let pos = 0;
+    
+    const str = (length) => utf8.decode(bytes.subarray(pos, pos += length));
+    const array = (length) => {
+        const out = new Array(length);
+        for (let i = 0; i < length; i++) out[i] = read();
+        return out;
+    };
+    const map = (length) => {
+        const out = {};
+        for (let i = 0; i < length; i++) {
+            const key = read();
+            out[key] = read();
+        }
+        return out;
+    };
+    const uint = (size) => {
+        let value;
+        if (size === 1) value = view.getUint8(pos);
+        else if (size === 2) value = view.getUint16(pos);
+        else if (size === 4) value = view.getUint32(pos);
+        else value = Number(view.getBigUint64(pos));
+        pos += size;
+        return value;
+    };
+    const int = (size) => {
+        let value;
+        if (size === 1) value = view.getInt8(pos);
+        else if (size === 2) value = view.getInt16(pos);
+        else if (size === 4) value = view.getInt32(pos);
+        else value = Number(view.getBigInt64(pos));
+        pos += size;
+        return value;
+    };
+    
+    function read() {
+        const type = bytes[pos++];
+        if (type < 0x80) return type;
+        if (type < 0x90) return map(type & 0x0f);
+        if (type < 0xa0) return array(type & 0x0f);
+        if (type < 0xc0) return str(type & 0x1f);
+        if (type >= 0xe0) return type - 0x100;
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: case 0xc5: case 0xc6: {
+                const length = uint(1 << (type - 0xc4));
+                return bytes.slice(pos, pos += length);
+            }
+            case 0xca: { const value = view.getFloat32(pos); pos += 4; return value; }
+            case 0xcb: { const value = view.getFloat64(pos); pos += 8; return value; }
+            case 0xcc: return uint(1);
+            case 0xcd: return uint(2);
+            case 0xce: return uint(4);
+            case 0xcf: return uint(8);
+            case 0xd0: return int(1);
+            case 0xd1: return int(2);
+            case 0xd2: return int(4);
+            case 0xd3: return int(8);
+            case 0xd9: return str(uint(1));
+            case 0xda: return str(uint(2));
+            case 0xdb: return str(uint(4));
+            case 0xdc: return array(uint(2));
+            case 0xdd: return array(uint(4));
+            case 0xde: return map(uint(2));
+            case 0xdf: return map(uint(4));
+        }
+        throw new Error(`Tipo MessagePack non supportato: 0x${type.toString(16)}`);
+    }
+    
+    return read();
+}
+
+// Formato degli eventi per questa connessione: JSON, o MessagePack su richiesta (?codec=msgpack)
+const WIRE_CODEC = (new URLSearchParams(window.location.search).get('codec') === 'msgpack'
+    && window.TextDecoder) ? 'msgpack' : 'json';
+
 // Socket connection
-const socket = io();
+const socket = io({ query: { codec: WIRE_CODEC } });
+
+// Gli eventi in MessagePack arrivano come ArrayBuffer: si decodificano prima dei gestori
+const socketOn = socket.on.bind(socket);
+socket.on = (event, handler) => socketOn(event, (data, ...rest) =>
+    handler(data instanceof ArrayBuffer ? msgpackDecode(data) : data, ...rest));
 
 // Game state
 let gameState = {
@@ -15,9 +107,43 @@ let gameState = {
     numRounds: 5,
     timerDuration: 60,
     currentRound: 0,
-    players: []
+    players: [],
+    rosterVersion: 0
 };
 
+// AVIF support (checked once at startup, WebP is the fallback)
+let supportsAvif = false;
+(() => {
+    const probe = new Image();
+    probe.onload = () => { supportsAvif = probe.width > 0; };
+    probe.src = 'data:image/avif;base64,AAAAIGZ0eXBhdmlmAAAAAGF2aWZtaWYxbWlhZk1BMUIAAADybWV0YQAAAAAAAAAoaGRscgAAAAAAAAAAcGljdAAAAAAAAAAAAAAAAGxpYmF2aWYAAAAADnBpdG0AAAAAAAEAAAAeaWxvYwAAAABEAAABAAEAAAABAAABGgAAAB0AAAAoaWluZgAAAAAAAQAAABppbmZlAgAAAAABAABhdjAxQ29sb3IAAAAAamlwcnAAAABLaXBjbwAAABRpc3BlAAAAAAAAAAIAAAACAAAAEHBpeGkAAAAAAwgICAAAAAxhdjFDgQ0MAAAAABNjb2xybmNseAACAAIAAYAAAAAXaXBtYQAAAAAAAAABAAEEAQKDBAAAACVtZGF0EgAKCBgANogQEAwgMg8f8D///8WfhwB8+ErK42A=';
+})();
+
+// Best image URL for a template: resized variant if available, original otherwise
+function templateImageUrl(template, size = 'game') {
+    const variants = template.variants && template.variants[size];
+    if (variants) {
+        const path = (supportsAvif && variants.avif) || variants.webp;
+        if (path) return `/static/images/memes/${path}`;
+    }
+    return `/static/images/memes/${template.image}`;
+}
+
+// Paint the placeholder (dominant colour + aspect ratio) while the image downloads
+function applyPlaceholder(img, template) {
+    const placeholder = template && template.placeholder;
+    img.style.backgroundColor = (placeholder && placeholder.color) || '';
+    img.style.aspectRatio = (placeholder && placeholder.aspect_ratio) ? String(placeholder.aspect_ratio) : '';
+}
+
+// Inline style for <img> tags built as HTML strings
+function placeholderStyle(template) {
+    const placeholder = template && template.placeholder;
+    if (!placeholder) return '';
+    const color = placeholder.color ? `background-color:${placeholder.color};` : '';
+    return `style="${color}aspect-ratio:${placeholder.aspect_ratio}"`;
+}
+
 // Session storage keys
 const SESSION_KEYS = {
     roomCode: 'mim_room_code',
@@ -183,17 +309,18 @@ function updateMemeChangesCounter() {
 // Timer Functions
 // ===================================
 
-function startTimer(duration) {
+function startTimer(seconds, duration = seconds) {
     // Ferma eventuali timer precedenti
     stopTimer();
     
-    timerSeconds = duration;
+    // seconds: tempo rimasto secondo il server; duration: durata totale della fase
+    timerSeconds = seconds;
     
     const progressBar = document.getElementById('progress-bar');
     
-    // Inizializza la progress bar al 100%
+    // Inizializza la progress bar al tempo rimasto
     if (progressBar) {
-        progressBar.style.width = '100%';
+        progressBar.style.width = `${(seconds / duration) * 100}%`;
         progressBar.classList.remove('progress-warning', 'progress-critical');
     }
     
@@ -224,6 +351,44 @@ function startTimer(duration) {
     }, 1000);
 }
 
+// Conto alla rovescia del meme in votazione: allo scadere il server passa al successivo
+let votingTimerInterval = null;
+
+function startVotingTimer(seconds) {
+    stopVotingTimer();
+    const timer = document.getElementById('voting-timer');
+    const display = document.getElementById('voting-time-left');
+    if (!timer || !display || seconds === null || seconds === undefined) return;
+    
+    let left = seconds;
+    const render = () => {
+        display.textContent = Math.max(0, left);
+        timer.classList.toggle('voting-timer-critical', left <= 5);
+    };
+    render();
+    timer.style.display = 'block';
+    
+    votingTimerInterval = setInterval(() => {
+        left--;
+        render();
+        if (left <= 0) {
+            clearInterval(votingTimerInterval);
+            votingTimerInterval = null;
+        }
+    }, 1000);
+}
+
+function stopVotingTimer() {
+    if (votingTimerInterval) {
+        clearInterval(votingTimerInterval);
+        votingTimerInterval = null;
+    }
+    const timer = document.getElementById('voting-timer');
+    if (timer) {
+        timer.style.display = 'none';
+    }
+}
+
 function stopTimer() {
     if (timerInterval) {
         clearInterval(timerInterval);
@@ -270,6 +435,28 @@ function autoSubmitMeme() {
 // Players List
 // ===================================
 
+// Elenco completo ricevuto dal server (ingresso, rejoin, resync)
+function setRoster(players, version) {
+    gameState.rosterVersion = version || 0;
+    updatePlayersList(players);
+}
+
+// Applica solo i giocatori cambiati; se manca un aggiornamento chiede l'elenco completo
+function applyRosterDelta(delta) {
+    if (!delta || delta.version === gameState.rosterVersion) return;
+    if (delta.base !== gameState.rosterVersion) {
+        socket.emit('roster_resync', { room_code: gameState.roomCode });
+        return;
+    }
+    const changed = new Set(delta.changes.map(c => c.player_id));
+    const players = gameState.players.filter(p => !changed.has(p.player_id));
+    delta.changes
+        .filter(c => !c.removed)
+        .forEach(({ position, ...entry }) => players.splice(position, 0, entry));
+    gameState.rosterVersion = delta.version;
+    updatePlayersList(players);
+}
+
 function updatePlayersList(players) {
     gameState.players = players;
     const list = document.getElementById('players-list');
@@ -343,7 +530,8 @@ function joinGame() {
         return;
     }
     
-    if (!roomCode || roomCode.length !== 4) {
+    // 4 lettere di solito, fino a 8 quando il server ha moltissime stanze
+    if (!/^[A-Z]{4,8}$/.test(roomCode)) {
         showToast('Inserisci un codice stanza valido!', 'error');
         return;
     }
@@ -460,9 +648,26 @@ socket.on('connect', () => {
     // Check if there's a pending room code to join
     const pendingCode = sessionStorage.getItem('pendingRoomCode');
     if (pendingCode) {
+        const pendingName = sessionStorage.getItem('pendingPlayerName');
+        const pendingRejoinId = sessionStorage.getItem('pendingRejoinId');
         sessionStorage.removeItem('pendingRoomCode');
+        sessionStorage.removeItem('pendingPlayerName');
+        sessionStorage.removeItem('pendingRejoinId');
         document.getElementById('room-code').value = pendingCode;
         showScreen('join-screen');
+        if (pendingName) {
+            // Rinviati qui da un altro server (wrong_shard): si riprende l'ingresso
+            document.getElementById('join-name').value = pendingName;
+            if (pendingRejoinId !== null) {
+                socket.emit('rejoin_game', {
+                    room_code: pendingCode,
+                    player_name: pendingName,
+                    old_player_id: pendingRejoinId
+                });
+            } else {
+                joinGame();
+            }
+        }
         return;
     }
     
@@ -544,6 +749,24 @@ socket.on('error', (data) => {
     showToast(data.message, 'error');
 });
 
+socket.on('room_closed', (data) => {
+    stopVotingTimer();
+    // Stanza chiusa dal server per inattività: si torna alla home
+    clearSession();
+    showScreen('home-screen');
+    showToast(data.message, 'error');
+});
+
+socket.on('wrong_shard', (data) => {
+    // La stanza è ospitata da un altro server: si prosegue lì (l'URL porta nome e id
+    // per il rientro, perché il localStorage di questa origine là non si vede)
+    let url = data.url;
+    if (WIRE_CODEC === 'msgpack') {
+        url += (url.includes('?') ? '&' : '?') + 'codec=msgpack';
+    }
+    window.location.href = url;
+});
+
 socket.on('game_created', (data) => {
     gameState.roomCode = data.room_code;
     gameState.playerId = data.player_id;
@@ -557,7 +780,7 @@ socket.on('game_created', (data) => {
     document.getElementById('rounds-badge').textContent = `${data.num_rounds} Round`;
     document.getElementById('timer-badge').textContent = `⏱️ ${gameState.timerDuration}s`;
     
-    updatePlayersList(data.players);
+    setRoster(data.players, data.roster_version);
     showScreen('lobby-screen');
     showToast('Stanza creata!', 'success');
     
@@ -580,7 +803,7 @@ socket.on('game_joined', (data) => {
     document.getElementById('rounds-badge').textContent = `${data.num_rounds} Round`;
     document.getElementById('timer-badge').textContent = `⏱️ ${gameState.timerDuration}s`;
     
-    updatePlayersList(data.players);
+    setRoster(data.players, data.roster_version);
     showScreen('lobby-screen');
     showToast('Ti sei unito alla stanza!', 'success');
     
@@ -590,18 +813,22 @@ socket.on('game_joined', (data) => {
     dismissRejoinBanner();
 });
 
+socket.on('roster', (data) => {
+    setRoster(data.players, data.version);
+});
+
 socket.on('player_joined', (data) => {
-    updatePlayersList(data.players);
+    applyRosterDelta(data.roster);
     showToast(`${data.player_name} si è unito!`, 'info');
 });
 
 socket.on('player_left', (data) => {
-    updatePlayersList(data.players);
+    applyRosterDelta(data.roster);
     showToast(`${data.player_name} ha lasciato la partita`, 'info');
 });
 
 socket.on('player_disconnected', (data) => {
-    updatePlayersList(data.players);
+    applyRosterDelta(data.roster);
     showToast(`${data.player_name} si è disconnesso`, 'warning');
     
     // Se sono l'host, mostro il pulsante per forzare l'avanzamento
@@ -615,7 +842,7 @@ socket.on('new_host', (data) => {
     if (gameState.isHost) {
         showToast('Sei diventato l\'host!', 'success');
     }
-    updatePlayersList(gameState.players);
+    applyRosterDelta(data.roster);
 });
 
 // Rejoin success - restore game state
@@ -636,7 +863,7 @@ socket.on('rejoin_success', (data) => {
     document.getElementById('rounds-badge').textContent = `${data.num_rounds} Round`;
     document.getElementById('timer-badge').textContent = `⏱️ ${gameState.timerDuration}s`;
     
-    updatePlayersList(data.players);
+    setRoster(data.players, data.roster_version);
     dismissRejoinBanner();
     
     // Ripristina lo stato in base alla fase corrente
@@ -689,7 +916,7 @@ socket.on('rejoin_failed', (data) => {
 
 // Player reconnected notification
 socket.on('player_reconnected', (data) => {
-    updatePlayersList(data.players);
+    applyRosterDelta(data.roster);
     showToast(`${data.player_name} si è riconnesso!`, 'success');
     hideForceAdvanceButton();
 });
@@ -708,7 +935,8 @@ function restoreCreatingPhase(data) {
         const imagePlaceholder = document.getElementById('image-placeholder');
         
         if (data.template.image) {
-            templateImage.src = `/static/images/memes/${data.template.image}`;
+            applyPlaceholder(templateImage, data.template);
+            templateImage.src = templateImageUrl(data.template);
             templateImage.style.display = 'block';
             templateImage.classList.remove('no-image');
             if (imagePlaceholder) imagePlaceholder.style.display = 'none';
@@ -748,8 +976,8 @@ function restoreCreatingPhase(data) {
         if (submitBtn) submitBtn.style.display = 'flex';
         document.getElementById('waiting-others').style.display = 'none';
         
-        // Riavvia il timer (approssimativo - il giocatore avrà meno tempo)
-        startTimer(30); // Dà 30 secondi al giocatore riconnesso
+        // Riprende il timer dal tempo rimasto secondo il server
+        startTimer(data.time_left ?? 30, gameState.timerDuration || 60);
     }
     
     showScreen('game-screen');
@@ -762,6 +990,7 @@ function restoreVotingPhase(data) {
         currentVotingMeme = data.current_meme;
         displayMemeToVote(data.current_meme);
     }
+    startVotingTimer(data.time_left);
     
     // Check if already voted for current meme
     if (data.has_voted) {
@@ -798,7 +1027,8 @@ socket.on('round_start', (data) => {
     const imagePlaceholder = document.getElementById('image-placeholder');
     
     if (data.template.image) {
-        templateImage.src = `/static/images/memes/${data.template.image}`;
+        applyPlaceholder(templateImage, data.template);
+        templateImage.src = templateImageUrl(data.template);
         templateImage.style.display = 'block';
         templateImage.classList.remove('no-image');
         if (imagePlaceholder) imagePlaceholder.style.display = 'none';
@@ -841,7 +1071,7 @@ socket.on('round_start', (data) => {
     // Start timer
     const timerDuration = data.timer_duration || gameState.timerDuration || 60;
     gameState.timerDuration = timerDuration;
-    startTimer(timerDuration);
+    startTimer(data.time_left ?? timerDuration, timerDuration);
 });
 
 socket.on('player_ready', (data) => {
@@ -856,7 +1086,8 @@ socket.on('new_meme', (data) => {
     const imagePlaceholder = document.getElementById('image-placeholder');
     
     if (data.template.image) {
-        templateImage.src = `/static/images/memes/${data.template.image}`;
+        applyPlaceholder(templateImage, data.template);
+        templateImage.src = templateImageUrl(data.template);
         templateImage.style.display = 'block';
         templateImage.classList.remove('no-image');
         if (imagePlaceholder) imagePlaceholder.style.display = 'none';
@@ -886,12 +1117,14 @@ socket.on('voting_start', (data) => {
     
     currentVotingMeme = data.current_meme;
     displayMemeToVote(data.current_meme);
+    startVotingTimer(data.time_left);
     showGamePhase('voting-phase');
 });
 
 socket.on('next_meme_to_vote', (data) => {
     currentVotingMeme = data.current_meme;
     displayMemeToVote(data.current_meme);
+    startVotingTimer(data.time_left);
 });
 
 function displayMemeToVote(meme) {
@@ -910,7 +1143,8 @@ function displayMemeToVote(meme) {
     // Update image
     const memeImage = document.getElementById('voting-meme-image');
     if (meme.template && meme.template.image) {
-        memeImage.src = `/static/images/memes/${meme.template.image}`;
+        applyPlaceholder(memeImage, meme.template);
+        memeImage.src = templateImageUrl(meme.template);
         memeImage.style.display = 'block';
     } else {
         memeImage.src = '';
@@ -1001,6 +1235,7 @@ socket.on('player_voted', (data) => {
 });
 
 socket.on('round_results', (data) => {
+    stopVotingTimer();
     if (data.is_final) {
         // Show final results
         showFinalResults(data);
@@ -1011,7 +1246,7 @@ socket.on('round_results', (data) => {
 });
 
 socket.on('back_to_lobby', (data) => {
-    updatePlayersList(data.players);
+    applyRosterDelta(data.roster);
     showScreen('lobby-screen');
     showToast('Torna alla lobby per una nuova partita!', 'info');
     
@@ -1043,7 +1278,7 @@ function showRoundResults(data) {
                 <div class="result-meme-text-top">${result.text1 || result.caption || ''}</div>
                 <div class="result-meme-image-wrapper">
                     ${result.template && result.template.image 
-                        ? `<img src="/static/images/memes/${result.template.image}" alt="Meme" class="result-meme-image">`
+                        ? `<img src="${templateImageUrl(result.template, 'thumb')}" alt="Meme" class="result-meme-image" ${placeholderStyle(result.template)}>`
                         : `<div class="result-meme-placeholder">🖼️</div>`
                     }
                     ${result.text2 ? `<div class="result-meme-text-overlay">${result.text2}</div>` : ''}
@@ -5,29 +5,158 @@ Un gioco multiplayer web dove i giocatori creano meme divertenti!
 """
 
 import os
+import hmac
+import time
+import atexit
 import random
-import string
-import json
-import uuid
-from datetime import datetime
-from flask import Flask, render_template, session, request, redirect, url_for, jsonify
-from flask_socketio import SocketIO, emit, join_room, leave_room
+import functools
+from urllib.parse import urlencode
+try:
+    import msgpack
+except ImportError:  # Senza msgpack tutti i client ricevono JSON
+    msgpack = None
+from flask import Flask, render_template, session, request, redirect, url_for, jsonify, g, has_app_context, has_request_context
+from flask_socketio import SocketIO, join_room, leave_room
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 from data.templates_db import TemplatesDB
+from data.template_dealer import TemplateDealer
+from data.suggestions_store import SuggestionsStore
+from data.image_variants import VariantPipeline
+from data.game_store import open_game_store, StaleGameError
+from data.game_snapshots import SnapshotStore
+from utils.upload_stream import read_image_upload, UploadRejected
+from utils.rate_limit import RotatingBloomFilter, RateLimiter
+from utils.timer_wheel import TimerWheel
+from utils.shard_router import ShardRouter
+from utils.coalescer import EventCoalescer
+from utils.room_codes import RoomCodeAllocator
 
 # Configurazione upload
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB per immagine
+MAX_REQUEST_SIZE = 50 * 1024 * 1024  # 50MB per richiesta
+
+# Più worker: stato delle partite in Redis (es. redis://localhost:6379/0) e
+# coda di messaggi di Socket.IO (richiede il pacchetto redis)
+GAME_STORE_URL = os.environ.get('GAME_STORE_URL')
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+
+# Più processi senza Redis: ogni worker tiene in memoria solo le stanze il cui codice
+# gli appartiene. SHARD_URLS elenca gli indirizzi pubblici dei worker
+# (es. http://host:5001,http://host:5002) e SHARD_ID è l'indice di questo worker
+SHARD_URLS = os.environ.get('SHARD_URLS')
+SHARD_ID = os.environ.get('SHARD_ID', '0')
+# Segreto per cambiare il layout (header X-Admin-Token); se manca il ribilanciamento è disattivato
+SHARD_ADMIN_TOKEN = os.environ.get('SHARD_ADMIN_TOKEN')
+shard_router = ShardRouter.from_config(SHARD_URLS, SHARD_ID)
+shard_metrics = {'redirected_http': 0, 'redirected_socket': 0, 'pinned_rooms': 0}
+
+# Codici stanza da un contatore permutato: unici senza estrazioni ripetute, più lunghi quando
+# le stanze di questo worker superano metà dei codici disponibili
+room_codes = RoomCodeAllocator(shards=len(shard_router.shards) if shard_router else 1)
 
 app = Flask(__name__, template_folder='web/templates', static_folder='web/static')
 app.secret_key = 'makeitmeme_secret_key_2024'
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Proxy davanti al server (es. nginx): remote_addr viene da X-Forwarded-For. Solo se
+# impostato, altrimenti chiunque potrebbe scegliersi l'indirizzo con quell'header
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', '0'))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS, x_host=PROXY_HOPS)
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)
 
 # Database dei template
 templates_db = TemplatesDB()
 
-# Gestione delle partite attive
-games = {}
+# Generazione delle varianti ridimensionate (miniatura, gioco) dopo gli upload
+variant_pipeline = VariantPipeline(templates_db.IMAGES_BASE_PATH, templates_db.manifest)
+
+# Gestione delle partite attive: dizionario in memoria o archivio condiviso tra worker
+# (la sessione di ogni operazione vive in flask.g)
+games = open_game_store(GAME_STORE_URL, lambda state: Game.from_state(state), local=g,
+                        expires_at=lambda game: game.expires_at())
+ROOM_OP_RETRIES = 3  # Tentativi quando un altro worker modifica la stessa stanza
+
+# Istantanee delle partite su disco, per riprenderle dopo un riavvio (SNAPSHOT_DIR vuoto le
+# disattiva; con l'archivio condiviso non servono). Le stanze modificate vengono salvate ogni
+# SNAPSHOT_INTERVAL secondi, quelle che cambiano fase entro SNAPSHOT_TICK
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(
+    os.path.dirname(__file__), 'data', 'snapshots', f'shard{SHARD_ID}' if shard_router else ''))
+SNAPSHOT_INTERVAL = 5
+SNAPSHOT_TICK = 0.5
+SNAPSHOT_BUDGET_MS = 20  # Tempo massimo per passaggio: il resto aspetta il prossimo
+RESTORE_GRACE = 30  # Secondi minimi per rientrare in una fase a tempo dopo il riavvio
+snapshots = SnapshotStore(SNAPSHOT_DIR) if SNAPSHOT_DIR and not games.shared else None
+snapshot_phases = {}  # {codice: fase dell'ultima istantanea}
+snapshot_metrics = {
+    'restored_rooms': 0,
+    'rooms_written': 0,
+    'bytes_written': 0,
+    'unchanged': 0,
+    'last_flush_ms': 0.0,
+    'max_flush_ms': 0.0
+}
+
+# Scadenze delle fasi di tutte le stanze, gestite da un unico task in background
+VOTING_DURATION = 20  # Secondi per votare ogni meme
+DEADLINE_GRACE = 2  # Margine per gli invii automatici dei client allo scadere del tempo
+timer_wheel = TimerWheel(tick=0.25)
+
+# Indice inverso sid -> codici stanza, per trovare le partite di un giocatore in O(1)
+player_rooms = {}
+
+# Client che hanno chiesto gli eventi in MessagePack invece che in JSON (?codec=msgpack).
+# Il formato di ogni sid lo conosce solo il processo a cui è connesso: con la coda di
+# messaggi una stanza può avere membri su altri worker, quindi si resta su JSON per tutti.
+# Con gli shard va bene: i socket di una stanza stanno tutti sul worker che la ospita
+WIRE_CODEC_NEGOTIATION = msgpack is not None and not SOCKETIO_MESSAGE_QUEUE
+msgpack_sids = set()
+
+# player_ready e player_voted arrivati insieme diventano un solo messaggio alla stanza
+PROGRESS_INTERVAL = 0.05
+
+
+def index_player(player_id, room_code):
+    """Registra che un giocatore è nella stanza"""
+    player_rooms.setdefault(player_id, set()).add(room_code)
+
+
+def unindex_player(player_id, room_code):
+    """Toglie un giocatore dall'indice di una stanza"""
+    rooms = player_rooms.get(player_id)
+    if rooms is not None:
+        rooms.discard(room_code)
+        if not rooms:
+            del player_rooms[player_id]
+
+
+def delete_game(room_code):
+    """Elimina una partita e le voci dei suoi giocatori dall'indice"""
+    game = games.pop(room_code, None)
+    if game is not None:
+        game.clear_deadline()
+        for player_id in game.players:
+            unindex_player(player_id, room_code)
+    return game
+
+
+# Pulizia delle stanze: secondi di inattività dopo cui una stanza viene chiusa, per fase
+ROOM_TTLS = {
+    'lobby': 30 * 60,
+    'creating': 20 * 60,
+    'voting': 20 * 60,
+    'results': 20 * 60,
+    'final': 10 * 60  # Risultati dell'ultimo round: la partita è finita
+}
+ROOM_ABANDONED_TTL = 5 * 60  # Tutti i giocatori disconnessi
+ROOM_GC_INTERVAL = 30  # Secondi tra due passaggi del sweeper
+MAX_ROOMS = 5000  # Stanze attive al massimo: oltre si chiude la più vicina alla scadenza
+ROOM_SWEEP_BATCH = 500  # Stanze chiuse al massimo in un passaggio
+
+room_metrics = {
+    'evicted_total': 0,
+    'evicted': {'idle': 0, 'abandoned': 0, 'finished': 0, 'capacity': 0},
+    'last_sweep_ms': 0.0
+}
 
 # Temi disponibili per la modalità temi
 THEMES = [
@@ -44,12 +173,24 @@ THEMES = [
 ]
 
 
+def room_code_is_free(code):
+    """Codice non in uso e, con più worker, di proprietà di questo"""
+    if shard_router is not None and remote_shard(code) is not None:
+        return False
+    return code not in games
+
+
 def generate_room_code():
-    """Genera un codice stanza univoco di 4 caratteri"""
-    while True:
-        code = ''.join(random.choices(string.ascii_uppercase, k=4))
-        if code not in games:
-            return code
+    """Genera un codice stanza univoco (4 lettere, di più quando le stanze sono tante)"""
+    return room_codes.allocate(len(games), room_code_is_free)
+
+
+def remote_shard(room_code):
+    """URL del worker che ospita la stanza, o None se è (o sarebbe) qui"""
+    if shard_router is None:
+        return None
+    owner = shard_router.locate(room_code, room_code in games)
+    return None if owner == shard_router.self_shard else owner
 
 
 class Game:
@@ -69,16 +210,76 @@ class Game:
         self.memes = {}  # {player_id: {caption, text1, text2}}
         self.votes = {}  # {meme_creator_id: {voter_id: vote_value}}
         self.round_scores = {}  # {player_id: total_score}
+        self.round_votes = {}  # {player_id: voti ricevuti nel round}
         self.meme_order = []  # Ordine dei meme da votare
         self.current_meme_index = 0  # Indice del meme corrente in votazione
         self.votes_for_current = {}  # {voter_id: True} - chi ha votato il meme corrente
+        self.active_submitted = 0  # Giocatori attivi che hanno consegnato il meme
+        self.active_voted = 0  # Giocatori attivi che hanno votato il meme corrente
         self.templates = {}  # {player_id: template}
         self.current_theme = None
         self.meme_changes = {}  # {player_id: changes_left}
         self.disconnected_players = set()  # Giocatori disconnessi durante la partita
         self.player_sids = {host_id: host_id}  # Mapping player_id -> session_id per riconnessione
         self.super_votes_used = set()  # Giocatori che hanno usato il super voto in questa partita
+        self.dealer = TemplateDealer(templates_db, image_type)  # Mazzo di immagini senza ripetizioni
+        self.last_activity = time.time()  # Ultima azione di un giocatore, per la pulizia
+        self.deadline = None  # Scadenza della fase corrente (timestamp Unix), decisa dal server
+        self._deadline_timer = None
+        self.roster_version = 0  # Versione dell'elenco giocatori inviato ai client
+        self.roster_dirty = set()  # Giocatori cambiati dall'ultimo aggiornamento inviato
+        index_player(host_id, room_code)
         
+    # Attributi salvati nell'archivio condiviso, in quest'ordine (gli insiemi come liste)
+    STATE_FIELDS = (
+        'room_code', 'host_id', 'mode', 'num_rounds', 'image_type', 'timer_duration',
+        'current_round', 'phase', 'players', 'player_order', 'memes', 'votes', 'round_scores',
+        'round_votes', 'meme_order', 'current_meme_index', 'votes_for_current', 'templates',
+        'current_theme', 'meme_changes', 'disconnected_players', 'player_sids',
+        'super_votes_used', 'last_activity', 'deadline', 'roster_version', 'roster_dirty'
+    )
+    SET_FIELDS = ('disconnected_players', 'super_votes_used', 'roster_dirty')
+    
+    def to_state(self):
+        """Stato compatto della partita: una lista di valori nell'ordine di STATE_FIELDS"""
+        values = []
+        for field in self.STATE_FIELDS:
+            value = getattr(self, field, None)
+            values.append(sorted(value) if field in self.SET_FIELDS else value)
+        return [values, self.dealer.get_state()]
+    
+    @classmethod
+    def from_state(cls, state):
+        """Ricostruisce una partita salvata (senza registrarla negli indici locali)"""
+        values, dealer_state = state
+        game = cls.__new__(cls)
+        # Valori predefiniti per gli stati salvati prima dell'aggiunta di un campo
+        game.roster_version = 0
+        game.roster_dirty = set()
+        for field, value in zip(cls.STATE_FIELDS, values):
+            setattr(game, field, set(value) if field in cls.SET_FIELDS else value)
+        game.dealer = TemplateDealer(templates_db, game.image_type)
+        game.dealer.set_state(dealer_state)
+        game.recount_readiness()
+        # Il timer della scadenza resta nel processo che l'ha programmato
+        game._deadline_timer = None
+        return game
+    
+    def recount_readiness(self):
+        """Ricalcola da zero i contatori di consegne e voti (dopo il caricamento di uno stato)"""
+        self.active_submitted = 0
+        self.active_voted = 0
+        for pid in self.players:
+            if pid not in self.disconnected_players:
+                self._count_active(pid, 1)
+    
+    def _count_active(self, player_id, delta):
+        """Aggiunge (o toglie) un giocatore attivo ai contatori delle fasi"""
+        if player_id in self.memes:
+            self.active_submitted += delta
+        if player_id in self.votes_for_current:
+            self.active_voted += delta
+    
     def add_player(self, player_id, player_name):
         """Aggiunge un giocatore alla partita"""
         if len(self.players) >= 8:
@@ -86,25 +287,185 @@ class Game:
         self.players[player_id] = {'name': player_name, 'score': 0, 'ready': False}
         self.player_order.append(player_id)
         self.player_sids[player_id] = player_id
+        index_player(player_id, self.room_code)
+        self.mark_roster(player_id)
         return True
     
     def remove_player(self, player_id):
         """Rimuove un giocatore dalla partita"""
         if player_id in self.players:
+            if player_id in self.disconnected_players:
+                self.disconnected_players.discard(player_id)
+            else:
+                self._count_active(player_id, -1)
             del self.players[player_id]
             self.player_order.remove(player_id)
-            self.disconnected_players.discard(player_id)
             if player_id in self.player_sids:
                 del self.player_sids[player_id]
+            unindex_player(player_id, self.room_code)
+            self.mark_roster(player_id)
+    
+    def set_host(self, player_id):
+        """Passa il ruolo di host a un altro giocatore"""
+        self.mark_roster(self.host_id, player_id)
+        self.host_id = player_id
+    
+    def mark_roster(self, *player_ids):
+        """Segna i giocatori da includere nel prossimo aggiornamento dell'elenco"""
+        self.roster_dirty.update(player_ids)
+    
+    def roster_entry(self, player_id):
+        """Voce dell'elenco giocatori inviata ai client"""
+        player = self.players[player_id]
+        return {
+            'player_id': player_id,
+            'name': player['name'],
+            'score': player['score'],
+            'is_host': player_id == self.host_id,
+            'disconnected': player_id in self.disconnected_players
+        }
+    
+    def roster_delta(self):
+        """
+        Modifiche all'elenco giocatori dall'ultimo aggiornamento
+        Il client le applica solo se ha la versione base, altrimenti chiede l'elenco completo
+        """
+        base = self.roster_version
+        if not self.roster_dirty:
+            return {'base': base, 'version': base, 'changes': []}
+        positions = {pid: i for i, pid in enumerate(self.player_order)}
+        changes = []
+        # Prima le rimozioni, poi gli inserimenti in ordine di posizione
+        for pid in sorted(self.roster_dirty, key=lambda pid: positions.get(pid, -1)):
+            if pid in self.players and pid in positions:
+                changes.append({**self.roster_entry(pid), 'position': positions[pid]})
+            else:
+                changes.append({'player_id': pid, 'removed': True})
+        self.roster_dirty.clear()
+        self.roster_version += 1
+        return {'base': base, 'version': self.roster_version, 'changes': changes}
+    
+    def set_deadline(self, seconds):
+        """Programma l'avanzamento automatico della fase corrente"""
+        self.clear_deadline()
+        self.deadline = time.time() + seconds
+        # Il token evita che un timer di una fase precedente faccia avanzare quella nuova
+        token = self.deadline_token()
+        self._deadline_timer = timer_wheel.schedule(seconds + DEADLINE_GRACE, on_phase_deadline,
+                                                    self.room_code, token)
+    
+    def clear_deadline(self):
+        """Annulla la scadenza della fase corrente"""
+        if self._deadline_timer is not None:
+            self._deadline_timer.cancel()
+            self._deadline_timer = None
+        self.deadline = None
+    
+    def deadline_token(self):
+        """Identifica la fase corrente, per riconoscere i timer scaduti"""
+        return (self.phase, self.current_round, self.current_meme_index)
+    
+    def time_left(self):
+        """Secondi rimasti prima della scadenza, o None"""
+        if self.deadline is None:
+            return None
+        return max(0, round(self.deadline - time.time()))
+    
+    def touch(self):
+        """Registra un'attività nella stanza"""
+        self.last_activity = time.time()
+    
+    def lifecycle_phase(self):
+        """Fase per la pulizia: i risultati dell'ultimo round contano come 'final'"""
+        if self.phase == 'results' and self.is_game_over():
+            return 'final'
+        return self.phase
+    
+    def expires_at(self):
+        """Istante in cui la stanza scade se nessuno fa più nulla"""
+        ttl = ROOM_TTLS.get(self.lifecycle_phase(), ROOM_TTLS['lobby'])
+        if self.players and len(self.disconnected_players) >= len(self.players):
+            ttl = min(ttl, ROOM_ABANDONED_TTL)
+        return self.last_activity + ttl
+    
+    def expiry_reason(self, now):
+        """Motivo per cui la stanza va chiusa, o None se è ancora viva"""
+        idle = now - self.last_activity
+        if self.players and len(self.disconnected_players) >= len(self.players):
+            if idle >= ROOM_ABANDONED_TTL:
+                return 'abandoned'
+        phase = self.lifecycle_phase()
+        if idle >= ROOM_TTLS.get(phase, ROOM_TTLS['lobby']):
+            return 'finished' if phase == 'final' else 'idle'
+        return None
+    
+    def reconnect_player(self, old_sid, new_sid):
+        """Un giocatore disconnesso rientra con un nuovo sid: gli passa tutti i suoi dati"""
+        player_data = self.players.pop(old_sid)
+        self.players[new_sid] = player_data
+        
+        # Aggiorna player_order
+        if old_sid in self.player_order:
+            idx = self.player_order.index(old_sid)
+            self.player_order[idx] = new_sid
+        
+        # Aggiorna player_sids e l'indice inverso
+        if old_sid in self.player_sids:
+            del self.player_sids[old_sid]
+        self.player_sids[new_sid] = new_sid
+        unindex_player(old_sid, self.room_code)
+        index_player(new_sid, self.room_code)
+        
+        # Trasferisci meme e voti se esistono
+        if old_sid in self.memes:
+            self.memes[new_sid] = self.memes.pop(old_sid)
+        if old_sid in self.templates:
+            self.templates[new_sid] = self.templates.pop(old_sid)
+        if old_sid in self.meme_changes:
+            self.meme_changes[new_sid] = self.meme_changes.pop(old_sid)
+        if old_sid in self.round_scores:
+            self.round_scores[new_sid] = self.round_scores.pop(old_sid)
+        if old_sid in self.round_votes:
+            self.round_votes[new_sid] = self.round_votes.pop(old_sid)
+        if old_sid in self.votes_for_current:
+            self.votes_for_current[new_sid] = self.votes_for_current.pop(old_sid)
+        
+        # Aggiorna meme_order se presente
+        if old_sid in self.meme_order:
+            idx = self.meme_order.index(old_sid)
+            self.meme_order[idx] = new_sid
+        
+        # Aggiorna votes
+        if old_sid in self.votes:
+            self.votes[new_sid] = self.votes.pop(old_sid)
+        for creator_id in self.votes:
+            if old_sid in self.votes[creator_id]:
+                self.votes[creator_id][new_sid] = self.votes[creator_id].pop(old_sid)
+        
+        # Il vecchio sid era disconnesso: il nuovo è attivo e torna nei conteggi
+        if old_sid in self.disconnected_players:
+            self.disconnected_players.discard(old_sid)
+            self._count_active(new_sid, 1)
+        self.mark_roster(old_sid, new_sid)
+        
+        # Aggiorna host se necessario
+        if self.host_id == old_sid:
+            self.set_host(new_sid)
     
     def mark_disconnected(self, player_id):
         """Marca un giocatore come disconnesso senza rimuoverlo"""
-        if player_id in self.players:
+        if player_id in self.players and player_id not in self.disconnected_players:
             self.disconnected_players.add(player_id)
+            self._count_active(player_id, -1)
+            self.mark_roster(player_id)
     
     def mark_connected(self, player_id):
         """Marca un giocatore come riconnesso"""
-        self.disconnected_players.discard(player_id)
+        if player_id in self.disconnected_players:
+            self.disconnected_players.discard(player_id)
+            if player_id in self.players:
+                self._count_active(player_id, 1)
+        self.mark_roster(player_id)
     
     def get_active_players(self):
         """Restituisce solo i giocatori attivi (non disconnessi)"""
@@ -123,6 +484,7 @@ class Game:
         self.current_round += 1
         self.phase = 'creating'
         self.memes = {}
+        self.active_submitted = 0
         self.votes = {}
         self.round_votes = {pid: 0 for pid in self.players}
         
@@ -133,19 +495,23 @@ class Game:
         
         # Scegli i template in base alla modalità e al tipo di immagine
         if self.mode == 'same_meme':
-            template = templates_db.get_random_template(self.image_type)
+            template = self.dealer.deal_one()
             self.templates = {pid: template for pid in self.players}
         else:
-            self.templates = {pid: templates_db.get_random_template(self.image_type) for pid in self.players}
+            self.templates = dict(zip(self.players, self.dealer.deal(len(self.players))))
         
         # Scegli un tema se in modalità temi
         if self.mode == 'themes':
             self.current_theme = random.choice(THEMES)
         else:
             self.current_theme = None
+        
+        self.set_deadline(self.timer_duration)
     
     def submit_meme(self, player_id, caption, text1='', text2=''):
         """Sottometti un meme"""
+        if player_id not in self.memes and player_id not in self.disconnected_players:
+            self.active_submitted += 1
         self.memes[player_id] = {
             'caption': caption,
             'text1': text1,
@@ -154,15 +520,22 @@ class Game:
         self.players[player_id]['ready'] = True
         
         # Controlla se tutti i giocatori attivi hanno sottomesso
-        active_players = self.get_active_players()
-        active_submitted = sum(1 for pid in active_players if pid in self.memes)
-        return active_submitted == len(active_players)
+        return self.check_all_memes_submitted()
+    
+    def fill_missing_memes(self):
+        """Meme vuoti per i giocatori attivi che non hanno consegnato (avanzamento forzato)"""
+        for pid in self.players:
+            if pid not in self.memes and pid not in self.disconnected_players:
+                self.memes[pid] = {
+                    'caption': '...',
+                    'text1': '...',
+                    'text2': ''
+                }
+                self.active_submitted += 1
     
     def check_all_memes_submitted(self):
         """Verifica se tutti i giocatori attivi hanno sottomesso il meme"""
-        active_players = self.get_active_players()
-        active_submitted = sum(1 for pid in active_players if pid in self.memes)
-        return active_submitted == len(active_players)
+        return self.active_submitted == self.get_active_player_count()
     
     def start_voting(self):
         """Inizia la fase di votazione"""
@@ -175,8 +548,10 @@ class Game:
         random.shuffle(self.meme_order)
         self.current_meme_index = 0
         self.votes_for_current = {}
+        self.active_voted = 0
         self.votes = {pid: {} for pid in self.meme_order}
         self.round_scores = {pid: 0 for pid in self.players}
+        self.set_deadline(VOTING_DURATION)
     
     def get_current_meme(self):
         """Ottiene il meme corrente da votare"""
@@ -220,6 +595,9 @@ class Game:
                 self.round_scores[creator_id] += 3
                 self.super_votes_used.add(voter_id)
         
+        if (voter_id not in self.votes_for_current and voter_id in self.players
+                and voter_id not in self.disconnected_players):
+            self.active_voted += 1
         self.votes_for_current[voter_id] = True
         
         # Controlla se tutti i giocatori attivi hanno votato
@@ -229,17 +607,27 @@ class Game:
     
     def check_all_voted_current(self):
         """Verifica se tutti i giocatori attivi hanno votato per il meme corrente"""
-        active_players = self.get_active_players()
-        voted_count = sum(1 for pid in active_players if pid in self.votes_for_current)
-        return voted_count == len(active_players)
+        return self.active_voted == self.get_active_player_count()
+    
+    def mark_all_voted(self):
+        """Considera come votati tutti i giocatori attivi (avanzamento forzato)"""
+        for pid in self.players:
+            if pid not in self.votes_for_current and pid not in self.disconnected_players:
+                self.votes_for_current[pid] = True
+                self.active_voted += 1
     
     def next_meme(self):
         """Passa al prossimo meme"""
         self.current_meme_index += 1
         self.votes_for_current = {}
+        self.active_voted = 0
         
         # Controlla se abbiamo finito tutti i meme
-        return self.current_meme_index >= len(self.meme_order)
+        if self.current_meme_index >= len(self.meme_order):
+            self.clear_deadline()
+            return True
+        self.set_deadline(VOTING_DURATION)
+        return False
     
     def submit_vote(self, voter_id, voted_id):
         """Sottometti un voto"""
@@ -258,10 +646,12 @@ class Game:
         """Calcola i punteggi del round"""
         for player_id, vote_count in self.round_votes.items():
             self.players[player_id]['score'] += vote_count
+            self.mark_roster(player_id)
     
     def show_results(self):
         """Mostra i risultati del round"""
         self.phase = 'results'
+        self.clear_deadline()
         self.calculate_scores()
     
     def get_sorted_results(self):
@@ -291,6 +681,12 @@ def index():
 @app.route('/game/<room_code>')
 def game_room(room_code):
     """Pagina della partita"""
+    owner = remote_shard(room_code.upper())
+    if owner is not None:
+        # La stanza vive in un altro worker: il browser prosegue lì
+        shard_metrics['redirected_http'] += 1
+        query = f'?{request.query_string.decode()}' if request.query_string else ''
+        return redirect(f'{owner}/game/{room_code.upper()}{query}', code=307)
     if room_code not in games:
         return render_template('index.html', error="Stanza non trovata!")
     return render_template('game.html', room_code=room_code)
@@ -300,67 +696,68 @@ def game_room(room_code):
 # Image Upload Routes
 # ===================================
 
-def allowed_file(filename):
-    """Verifica se l'estensione del file è consentita"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-
 @app.route('/api/images/upload', methods=['POST'])
 def upload_images():
-    """Carica una o più immagini"""
-    if 'images' not in request.files:
+    """Carica una o più immagini, leggendo il corpo della richiesta in streaming"""
+    # Rifiuta subito le richieste dichiaratamente troppo grandi, senza leggerle
+    if request.content_length is not None and request.content_length > MAX_REQUEST_SIZE:
+        return jsonify({'success': False, 'message': 'Upload troppo grande'}), 413
+    
+    try:
+        fields, files, errors = read_image_upload(
+            request.stream, request.content_type, templates_db.store,
+            MAX_FILE_SIZE, MAX_REQUEST_SIZE
+        )
+    except UploadRejected as e:
+        return jsonify({'success': False, 'message': e.message}), e.status
+    
+    if not files and not errors:
         return jsonify({'success': False, 'message': 'Nessun file selezionato'}), 400
     
-    files = request.files.getlist('images')
-    image_type = request.form.get('image_type', 'custom')
+    image_type = fields.get('image_type', 'custom')
     
     # Determina la cartella di destinazione
-    if image_type == 'classic':
-        upload_folder = templates_db.CLASSIC_PATH
-    else:
-        upload_folder = templates_db.CUSTOM_PATH
-    
-    # Crea la cartella se non esiste
-    os.makedirs(upload_folder, exist_ok=True)
+    folder_type = 'classic' if image_type == 'classic' else 'custom'
     
     uploaded = []
-    errors = []
     
-    for file in files:
-        if file.filename == '':
-            continue
-        
-        if not allowed_file(file.filename):
-            errors.append(f'{file.filename}: formato non supportato')
-            continue
-        
-        # Genera un nome file sicuro
-        filename = secure_filename(file.filename)
-        
-        # Se il file esiste già, aggiungi un suffisso
-        base, ext = os.path.splitext(filename)
-        counter = 1
-        while os.path.exists(os.path.join(upload_folder, filename)):
-            filename = f"{base}_{counter}{ext}"
-            counter += 1
-        
-        filepath = os.path.join(upload_folder, filename)
+    for original_name, ext, writer in files:
+        # Genera un nome file sicuro (usato come alias del file salvato)
+        filename = secure_filename(original_name) or f'immagine{ext}'
         
         try:
-            file.save(filepath)
+            # Il nome sul disco deriva dall'hash: i doppioni non occupano spazio
+            stored_name, duplicate = templates_db.store.commit(folder_type, writer, filename, ext)
+            # Segnala le foto quasi identiche già presenti (es. riesportazioni)
+            near_duplicates = [] if duplicate else templates_db.similarity.add(
+                folder_type, templates_db.catalogs[folder_type].folder, stored_name)
             uploaded.append({
-                'name': filename,
-                'type': image_type,
-                'url': f'/static/images/memes/{image_type}/{filename}'
+                'name': stored_name,
+                'original_name': filename,
+                'duplicate': duplicate,
+                'near_duplicates': near_duplicates,
+                'type': folder_type,
+                'url': f'/static/images/memes/{folder_type}/{stored_name}'
             })
         except Exception as e:
-            errors.append(f'{file.filename}: errore durante il salvataggio')
-    
+            writer.abort()
+            errors.append(f'{original_name}: errore durante il salvataggio')
+
+    # Aggiorna subito il catalogo in memoria senza attendere il polling
+    if uploaded:
+        templates_db.refresh_images(folder_type)
+        for item in uploaded:
+            if not item['duplicate']:
+                variant_pipeline.submit(folder_type, item['name'])
+    duplicates = sum(1 for item in uploaded if item['duplicate'])
+
     return jsonify({
         'success': len(uploaded) > 0,
         'uploaded': uploaded,
         'errors': errors,
-        'message': f'{len(uploaded)} immagini caricate' + (f', {len(errors)} errori' if errors else '')
+        'message': f'{len(uploaded)} immagini caricate'
+                   + (f', {duplicates} già presenti' if duplicates else '')
+                   + (f', {len(errors)} errori' if errors else '')
     })
 
 
@@ -368,33 +765,79 @@ def upload_images():
 # Suggestions Routes
 # ===================================
 
+# suggestions.json contiene i suggerimenti iniziali e non viene mai riscritto:
+# le compattazioni vanno nello snapshot, che lo sostituisce dopo la prima
 SUGGESTIONS_FILE = os.path.join(os.path.dirname(__file__), 'data', 'suggestions.json')
+SUGGESTIONS_SNAPSHOT_FILE = os.path.join(os.path.dirname(__file__), 'data', 'suggestions.snapshot.json')
+SUGGESTIONS_LOG_FILE = os.path.join(os.path.dirname(__file__), 'data', 'suggestions.log')
+SUGGESTIONS_FLUSH_INTERVAL = 2  # Secondi tra due scritture dei voti accumulati
+
+# Suggerimenti in memoria, con log append-only su disco
+suggestions_store = SuggestionsStore(SUGGESTIONS_SNAPSHOT_FILE, SUGGESTIONS_LOG_FILE,
+                                     seed_file=SUGGESTIONS_FILE)
+atexit.register(suggestions_store.flush)
+
+# Limiti sui voti, a memoria costante qualunque sia il numero di client
+# Il client è riconosciuto dall'indirizzo (con PROXY_HOPS quello reale dietro il proxy):
+# un id nel cookie si rigenera cancellando i cookie e aggirerebbe sia limite sia deduplica
+VOTE_RATE_LIMIT = 20  # Voti per client al minuto
+VOTE_DEDUP_PERIOD = 24 * 3600  # Per quanto si ricorda che un client ha già votato
+vote_rate_limiter = RateLimiter(limit=VOTE_RATE_LIMIT, window=60)
+voted_filter = RotatingBloomFilter(capacity=200000, period=VOTE_DEDUP_PERIOD)
+
+
+def suggestions_flush_loop():
+    """Scrive periodicamente su disco i voti accumulati"""
+    while True:
+        socketio.sleep(SUGGESTIONS_FLUSH_INTERVAL)
+        try:
+            suggestions_store.flush()
+        except OSError as e:
+            print(f"Errore nel salvataggio dei suggerimenti: {e}")
 
 
-def load_suggestions():
-    """Carica i suggerimenti dal file JSON"""
-    try:
-        with open(SUGGESTIONS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+SUGGESTIONS_PAGE_SIZE = 20
+SUGGESTIONS_MAX_PAGE_SIZE = 100
 
 
-def save_suggestions(suggestions):
-    """Salva i suggerimenti nel file JSON"""
-    with open(SUGGESTIONS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(suggestions, f, ensure_ascii=False, indent=2)
+def _page_args():
+    """Legge cursore e dimensione pagina dalla query string"""
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', SUGGESTIONS_PAGE_SIZE, type=int)
+    return cursor, max(1, min(limit, SUGGESTIONS_MAX_PAGE_SIZE))
 
 
 @app.route('/suggestions')
 def suggestions_page():
     """Pagina dei suggerimenti"""
-    suggestions = load_suggestions()
-    # Ordina per voti positivi (più votati prima)
-    suggestions.sort(key=lambda x: x.get('votes_up', x.get('votes', 0)), reverse=True)
-    # Calcola totale voti (su + giù)
-    total_votes = sum(s.get('votes_up', s.get('votes', 0)) + s.get('votes_down', 0) for s in suggestions)
-    return render_template('suggestions.html', suggestions=suggestions, total_votes=total_votes)
+    cursor, limit = _page_args()
+    # Classifica già ordinata per voti positivi (più votati prima)
+    suggestions, next_cursor = suggestions_store.top(limit, cursor)
+    return render_template('suggestions.html', suggestions=suggestions,
+                           total_votes=suggestions_store.total_votes,
+                           total_suggestions=len(suggestions_store),
+                           next_cursor=next_cursor, page_size=limit)
+
+
+@app.route('/api/suggestions')
+def api_suggestions():
+    """Classifica dei suggerimenti in formato JSON, paginata con cursore"""
+    cursor, limit = _page_args()
+    suggestions, next_cursor = suggestions_store.top(limit, cursor)
+    return jsonify({
+        'suggestions': suggestions,
+        'next_cursor': next_cursor,
+        'total_suggestions': len(suggestions_store),
+        'total_votes': suggestions_store.total_votes
+    })
+
+
+@app.route('/api/suggestions/search')
+def search_suggestions():
+    """Cerca nei suggerimenti (testo, autore e categoria) tramite l'indice invertito"""
+    query = request.args.get('q', '').strip()[:200]
+    _, limit = _page_args()
+    return jsonify({'query': query, 'suggestions': suggestions_store.search(query, limit)})
 
 
 @app.route('/suggestions/submit', methods=['POST'])
@@ -413,19 +856,17 @@ def submit_suggestion():
             return jsonify({'success': False, 'message': 'Contenuto richiesto'}), 400
         return redirect(url_for('suggestions_page'))
     
-    suggestions = load_suggestions()
-    
-    new_suggestion = {
-        'id': str(uuid.uuid4())[:8],
-        'author': author[:30] if author else 'Anonimo',
-        'category': category,
-        'content': content[:500],
-        'votes': 0,
-        'date': datetime.now().strftime('%d/%m/%Y %H:%M')
-    }
+    # Segnala i suggerimenti simili già presenti: si pubblica solo dopo conferma
+    if is_ajax and not request.form.get('confirm'):
+        similar = suggestions_store.similar(content)
+        if similar:
+            return jsonify({
+                'success': False,
+                'similar': similar,
+                'message': 'Esistono già suggerimenti simili'
+            }), 409
     
-    suggestions.insert(0, new_suggestion)  # Aggiungi in cima
-    save_suggestions(suggestions)
+    new_suggestion = suggestions_store.add(author, category, content)
     
     if is_ajax:
         return jsonify({'success': True, 'message': 'Suggerimento inviato!', 'suggestion': new_suggestion})
@@ -436,42 +877,421 @@ def submit_suggestion():
 @app.route('/suggestions/vote/<suggestion_id>', methods=['POST'])
 def vote_suggestion(suggestion_id):
     """Vota un suggerimento (pollice su o giù)"""
-    suggestions = load_suggestions()
-    
     # Ottieni il tipo di voto dal body JSON
     data = request.get_json() or {}
     vote_type = data.get('vote_type', 'up')
     
-    for suggestion in suggestions:
-        if suggestion.get('id') == suggestion_id:
-            # Inizializza i contatori se non esistono
-            if 'votes_up' not in suggestion:
-                suggestion['votes_up'] = suggestion.get('votes', 0)
-            if 'votes_down' not in suggestion:
-                suggestion['votes_down'] = 0
-            
-            # Incrementa il contatore appropriato
-            if vote_type == 'up':
-                suggestion['votes_up'] = suggestion.get('votes_up', 0) + 1
-            else:
-                suggestion['votes_down'] = suggestion.get('votes_down', 0) + 1
-            
-            # Aggiorna anche il campo votes totale per retrocompatibilità
-            suggestion['votes'] = suggestion.get('votes_up', 0)
-            
-            save_suggestions(suggestions)
-            
-            # Calcola il totale dei voti
-            total_votes = sum(s.get('votes_up', s.get('votes', 0)) + s.get('votes_down', 0) for s in suggestions)
-            
-            return jsonify({
-                'success': True, 
-                'votes_up': suggestion['votes_up'],
-                'votes_down': suggestion['votes_down'],
-                'total_votes': total_votes
-            })
+    # Limiti controllati prima di toccare l'archivio
+    client = request.remote_addr or 'unknown'
+    allowed, retry_after = vote_rate_limiter.hit(client)
+    if not allowed:
+        response = jsonify({'success': False, 'message': 'Troppi voti, riprova tra poco'})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+    if suggestions_store.get(suggestion_id) is None:
+        return jsonify({'success': False}), 404
+    if not voted_filter.add(f'{client}|{suggestion_id}'):
+        return jsonify({'success': False, 'message': 'Hai già votato questo suggerimento'}), 409
+    
+    # Aggiornamento in memoria: il salvataggio avviene a blocchi in background
+    suggestion = suggestions_store.vote(suggestion_id, vote_type)
+    if suggestion is None:
+        return jsonify({'success': False}), 404
     
-    return jsonify({'success': False}), 404
+    return jsonify({
+        'success': True, 
+        'votes_up': suggestion['votes_up'],
+        'votes_down': suggestion['votes_down'],
+        'total_votes': suggestions_store.total_votes
+    })
+
+
+# ===================================
+# Operazioni sulle stanze
+# ===================================
+
+def send(event, data, room=None, skip_sid=None):
+    """
+    Invia un evento Socket.IO (al client corrente se room non è indicata)
+    Con l'archivio condiviso gli eventi partono solo dopo il salvataggio della partita
+    """
+    if room is None:
+        room = request.sid
+    after_commit(functools.partial(emit_encoded, event, data, room, skip_sid))
+
+
+def send_progress(event, data, room):
+    """Evento di avanzamento (consegne, voti): accorpato con quelli vicini nel tempo"""
+    after_commit(functools.partial(progress_events.push, room, event, data))
+
+
+def emit_encoded(event, data, room, skip_sid=None):
+    """Invia un evento nel formato scelto da ogni destinatario (JSON o MessagePack)"""
+    if room in progress_events.pending:
+        # Gli avanzamenti in attesa precedono l'evento (es. l'inizio della votazione)
+        progress_events.flush(room)
+    if not msgpack_sids:
+        socketio.emit(event, data, to=room, skip_sid=skip_sid)
+        return
+    if room in msgpack_sids:
+        socketio.emit(event, msgpack.packb(data, use_bin_type=True), to=room)
+        return
+    recipients = [sid for sid, _ in socketio.server.manager.get_participants('/', room)
+                  if sid != skip_sid]
+    binary_sids = [sid for sid in recipients if sid in msgpack_sids]
+    if not binary_sids:
+        socketio.emit(event, data, to=room, skip_sid=skip_sid)
+        return
+    blob = msgpack.packb(data, use_bin_type=True)
+    if len(binary_sids) == len(recipients):
+        # Tutti in MessagePack: un solo invio alla stanza
+        socketio.emit(event, blob, to=room, skip_sid=skip_sid)
+        return
+    # Stanza mista: JSON per tutti tranne chi usa MessagePack, codificato una volta sola
+    socketio.emit(event, data, to=room, skip_sid=binary_sids + ([skip_sid] if skip_sid else []))
+    for sid in binary_sids:
+        socketio.emit(event, blob, to=sid)
+
+
+progress_events = EventCoalescer(emit_encoded, PROGRESS_INTERVAL)
+
+
+def after_commit(action):
+    """Esegue un'azione subito, o dopo il salvataggio se un'operazione condivisa è in corso"""
+    outbox = g.get('outbox') if has_app_context() else None
+    if outbox is not None:
+        outbox.append(action)
+    else:
+        action()
+
+
+def run_room_op(operation, *args):
+    """
+    Esegue un'operazione sulle stanze e salva le partite modificate
+    Se un altro worker ha cambiato la stessa stanza, l'operazione viene ripetuta
+    """
+    for attempt in range(ROOM_OP_RETRIES):
+        g.outbox = [] if games.shared else None
+        try:
+            result = operation(*args)
+            games.commit()
+        except StaleGameError:
+            games.rollback()
+            continue
+        except BaseException:
+            games.rollback()
+            raise
+        finally:
+            outbox = g.pop('outbox', None)
+        for action in outbox or ():
+            action()
+        return result
+    if has_request_context():
+        socketio.emit('error', {'message': 'Stanza occupata, riprova!'}, to=request.sid)
+    return None
+
+
+def room_op(handler):
+    """Decoratore per gli eventi Socket.IO che leggono o modificano le stanze"""
+    @functools.wraps(handler)
+    def wrapper(*args):
+        return run_room_op(handler, *args)
+    return wrapper
+
+
+# ===================================
+# Background Tasks
+# ===================================
+
+_background_tasks_started = False
+
+
+def evict_game(room_code, reason):
+    """Chiude una stanza avvisando i giocatori ancora collegati"""
+    game = delete_game(room_code)
+    if game is None:
+        return
+    room_metrics['evicted_total'] += 1
+    room_metrics['evicted'][reason] += 1
+    send('room_closed', {
+        'room_code': room_code,
+        'reason': reason,
+        'message': 'Stanza chiusa per inattività'
+    }, room=room_code)
+    after_commit(functools.partial(socketio.close_room, room_code))
+
+
+def sweep_rooms():
+    """Chiude le stanze scadute e riporta il numero sotto MAX_ROOMS"""
+    started = time.perf_counter()
+    now = time.time()
+    expired = []
+    # Solo le stanze scadute secondo l'indice delle scadenze, non tutte
+    for code in games.expiring(now, ROOM_SWEEP_BATCH):
+        game = games.get(code)
+        if game is None:
+            games.pop(code, None)  # Già sparita: si pulisce l'indice
+            continue
+        reason = game.expiry_reason(now)
+        if reason:
+            expired.append((code, reason))
+    for code, reason in expired:
+        evict_game(code, reason)
+    room_metrics['last_sweep_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    return len(expired)
+
+
+def make_room_for_new_game():
+    """Se il limite di stanze è raggiunto, chiude quelle inattive da più tempo"""
+    live = len(games)
+    if live < MAX_ROOMS:
+        return
+    swept = sweep_rooms()
+    excess = live - swept - MAX_ROOMS + 1
+    if excess <= 0:
+        return
+    # Con l'archivio condiviso le stanze appena chiuse sono ancora nell'indice fino al commit
+    candidates = [code for code in games.soonest(excess + swept) if code in games]
+    for code in candidates[:excess]:
+        evict_game(code, 'capacity')
+
+
+def on_phase_deadline(room_code, token):
+    """Tempo scaduto: avanza la fase come farebbe l'host"""
+    with app.app_context():
+        run_room_op(advance_on_deadline, room_code, token)
+
+
+def advance_on_deadline(room_code, token):
+    game = games.get(room_code)
+    if game is None or game.deadline_token() != token:
+        return
+    game._deadline_timer = None
+    force_advance_game(game, room_code)
+
+
+def progress_loop():
+    """Invia gli eventi di avanzamento accorpati"""
+    while True:
+        socketio.sleep(PROGRESS_INTERVAL)
+        try:
+            progress_events.flush_all()
+        except Exception as e:
+            print(f"Errore nell'invio degli avanzamenti: {e}")
+
+
+def timer_loop():
+    """Unico task che fa avanzare la timer wheel di tutte le stanze"""
+    while True:
+        socketio.sleep(timer_wheel.tick)
+        timer_wheel.advance()
+
+
+def room_gc_loop():
+    """Pulizia periodica delle stanze abbandonate o finite"""
+    while True:
+        socketio.sleep(ROOM_GC_INTERVAL)
+        try:
+            # Con più worker la pulizia la fa uno solo per volta
+            if not games.try_lock('room_gc', ROOM_GC_INTERVAL):
+                continue
+            with app.app_context():
+                run_room_op(sweep_rooms)
+            if shard_router is not None:
+                # I layout sostituiti servono finché le loro stanze sono aperte
+                shard_router.prune(games.keys())
+                shard_metrics['pinned_rooms'] = len(shard_router.pinned_rooms())
+        except Exception as e:
+            print(f"Errore nella pulizia delle stanze: {e}")
+
+
+def run_blocking(func, *args):
+    """Esegue I/O bloccante (es. fsync) in un thread vero, senza fermare il loop di eventlet"""
+    if socketio.async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args)
+    return func(*args)
+
+
+def flush_snapshots(phase_changes_only=False, budget_ms=SNAPSHOT_BUDGET_MS, offload=True):
+    """
+    Scrive su disco le stanze modificate (o solo quelle che hanno cambiato fase)
+    Sul loop si prepara solo il contenuto, entro budget_ms millisecondi (le stanze
+    rimaste aspettano il prossimo passaggio); scrittura e fsync avvengono in un thread
+    """
+    started = time.perf_counter()
+    dirty = games.dirty
+    batch = []
+    for room_code in list(dirty):
+        if budget_ms is not None and (time.perf_counter() - started) * 1000 >= budget_ms:
+            break
+        game = games.peek(room_code)
+        if game is None:
+            dirty.discard(room_code)
+            snapshot_phases.pop(room_code, None)
+            snapshots.delete(room_code)
+            continue
+        if phase_changes_only and snapshot_phases.get(room_code) == game.phase:
+            continue
+        dirty.discard(room_code)
+        encoded = snapshots.encode(room_code, game.to_state())
+        snapshot_phases[room_code] = game.phase
+        if encoded is not None:
+            batch.append(encoded)
+        else:
+            snapshot_metrics['unchanged'] += 1
+    written = len(batch)
+    if batch:
+        size = run_blocking(snapshots.write_many, batch) if offload else snapshots.write_many(batch)
+        snapshot_metrics['bytes_written'] += size
+        snapshot_metrics['rooms_written'] += written
+    elapsed = round((time.perf_counter() - started) * 1000, 3)
+    snapshot_metrics['last_flush_ms'] = elapsed
+    snapshot_metrics['max_flush_ms'] = max(snapshot_metrics['max_flush_ms'], elapsed)
+    return written
+
+
+def restore_snapshots():
+    """Ricarica le stanze salvate: i giocatori risultano disconnessi finché non rientrano"""
+    now = time.time()
+    for room_code, state in snapshots.load_all().items():
+        try:
+            game = Game.from_state(state)
+        except Exception as e:
+            print(f"Stanza {room_code} non ripristinata: {e}")
+            continue
+        if room_code in games:
+            continue
+        for pid in list(game.players):
+            game.mark_disconnected(pid)
+        game.roster_dirty.clear()
+        game.touch()
+        if game.deadline is not None:
+            game.set_deadline(max(game.deadline - now, RESTORE_GRACE))
+        games[room_code] = game
+        snapshot_phases[room_code] = game.phase
+        snapshot_metrics['restored_rooms'] += 1
+    if snapshot_metrics['restored_rooms']:
+        print(f"Ripristinate {snapshot_metrics['restored_rooms']} stanze dalle istantanee")
+
+
+def snapshot_loop():
+    """Salvataggio periodico delle stanze modificate"""
+    last_full = time.monotonic()
+    while True:
+        socketio.sleep(SNAPSHOT_TICK)
+        try:
+            full = time.monotonic() - last_full >= SNAPSHOT_INTERVAL
+            flush_snapshots(phase_changes_only=not full)
+            if full:
+                last_full = time.monotonic()
+        except Exception as e:
+            print(f"Errore nel salvataggio delle istantanee: {e}")
+
+
+def start_background_tasks():
+    """Avvia una sola volta i task periodici sul loop di Socket.IO"""
+    global _background_tasks_started
+    if _background_tasks_started:
+        return
+    _background_tasks_started = True
+    if snapshots is not None:
+        restore_snapshots()
+        socketio.start_background_task(snapshot_loop)
+        # All'arresto si salva tutto, senza limiti di tempo
+        atexit.register(flush_snapshots, budget_ms=None, offload=False)
+    socketio.start_background_task(suggestions_flush_loop)
+    socketio.start_background_task(room_gc_loop)
+    socketio.start_background_task(timer_loop)
+    socketio.start_background_task(progress_loop)
+
+
+@app.route('/api/metrics/rooms')
+def room_metrics_endpoint():
+    """Stanze attive e chiusure automatiche"""
+    return jsonify({
+        'live_rooms': len(games),
+        'max_rooms': MAX_ROOMS,
+        'live_players': len(player_rooms),
+        'rooms_by_phase': {phase: sum(1 for game in games.values() if game.lifecycle_phase() == phase)
+                           for phase in ROOM_TTLS},
+        **room_metrics,
+        'progress_events': {'sent': progress_events.sent, 'merged': progress_events.merged},
+        'room_codes': {
+            'length': room_codes.length_for(len(games)),
+            'allocated': room_codes.allocated,
+            'attempts': room_codes.attempts
+        },
+        'snapshots': {
+            'enabled': snapshots is not None,
+            'pending_rooms': len(games.dirty) if snapshots is not None else 0,
+            'budget_ms': SNAPSHOT_BUDGET_MS,
+            **snapshot_metrics
+        }
+    })
+
+
+@app.route('/api/route/<room_code>')
+def route_room(room_code):
+    """Worker che ospita una stanza (per il client e per un eventuale proxy davanti ai worker)"""
+    room_code = room_code.upper()
+    if shard_router is None:
+        return jsonify({'room_code': room_code, 'shard': None, 'url': None, 'local': True})
+    owner = remote_shard(room_code) or shard_router.self_shard
+    return jsonify({
+        'room_code': room_code,
+        'shard': shard_router.shards.index(owner) if owner in shard_router.shards else None,
+        'url': owner,
+        'local': owner == shard_router.self_shard
+    })
+
+
+@app.route('/api/shards')
+def shard_stats():
+    """Layout degli shard e carico di questo worker"""
+    rooms = list(games.values())
+    stats = {
+        'sharded': shard_router is not None,
+        'rooms': len(rooms),
+        'players': sum(len(game.players) for game in rooms),
+        'connected_players': sum(len(game.players) - len(game.disconnected_players) for game in rooms),
+        **shard_metrics
+    }
+    if shard_router is not None:
+        stats.update({
+            'shard': shard_router.shards.index(shard_router.self_shard),
+            'url': shard_router.self_shard,
+            'shards': shard_router.shards,
+            'previous_shards': [layout['shards'] for layout in shard_router.previous]
+        })
+    return jsonify(stats)
+
+
+@app.route('/api/shards/rebalance', methods=['POST'])
+def rebalance_shards():
+    """
+    Nuovo elenco di worker (da chiamare su ogni worker, con l'header X-Admin-Token)
+    Le stanze già aperte restano dove sono; i nuovi codici seguono il nuovo layout
+    """
+    if shard_router is None:
+        return jsonify({'error': 'Sharding non attivo'}), 400
+    token = request.headers.get('X-Admin-Token', '')
+    if not SHARD_ADMIN_TOKEN or not hmac.compare_digest(token, SHARD_ADMIN_TOKEN):
+        return jsonify({'error': 'Token di amministrazione mancante o non valido'}), 403
+    shards = (request.get_json(silent=True) or {}).get('shards') or []
+    try:
+        pinned = shard_router.rebalance(shards, list(games.keys()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    shard_metrics['pinned_rooms'] = len(shard_router.pinned_rooms())
+    room_codes.shards = len(shard_router.shards)
+    return jsonify({'shards': shard_router.shards, 'pinned_rooms': pinned})
+
+
+@app.before_request
+def ensure_background_tasks():
+    """I task partono alla prima richiesta (funziona anche sotto gunicorn)"""
+    start_background_tasks()
 
 
 # Socket.IO Events
@@ -479,18 +1299,25 @@ def vote_suggestion(suggestion_id):
 @socketio.on('connect')
 def on_connect():
     """Gestisce la connessione di un client"""
+    start_background_tasks()
+    if WIRE_CODEC_NEGOTIATION and request.args.get('codec') == 'msgpack':
+        msgpack_sids.add(request.sid)
     print(f"Client connesso: {request.sid}")
 
 
 @socketio.on('disconnect')
+@room_op
 def on_disconnect():
     """Gestisce la disconnessione di un client"""
     sid = request.sid
     print(f"Client disconnesso: {sid}")
+    msgpack_sids.discard(sid)
     
-    # Gestisce la disconnessione per ogni partita
-    for room_code, game in list(games.items()):
-        if sid in game.players:
+    # Gestisce la disconnessione solo per le partite del giocatore (indice inverso)
+    for room_code in list(player_rooms.get(sid, ())):
+        game = games.get(room_code)
+        if game is not None and sid in game.players:
+            game.touch()
             player_name = game.players[sid]['name']
             
             # Se siamo in lobby, rimuovi il giocatore completamente
@@ -499,30 +1326,31 @@ def on_disconnect():
                 leave_room(room_code)
                 
                 # Notifica gli altri giocatori
-                emit('player_left', {
+                send('player_left', {
                     'player_id': sid,
                     'player_name': player_name,
-                    'players': get_players_info(game),
+                    'roster': game.roster_delta(),
                     'disconnected_count': len(game.disconnected_players)
                 }, room=room_code)
                 
                 # Se non ci sono più giocatori, elimina la partita
                 if len(game.players) == 0:
-                    del games[room_code]
+                    delete_game(room_code)
                 # Se l'host se ne va, assegna un nuovo host
                 elif sid == game.host_id and game.player_order:
-                    game.host_id = game.player_order[0]
-                    emit('new_host', {'host_id': game.host_id}, room=room_code)
+                    game.set_host(game.player_order[0])
+                    send('new_host', {'host_id': game.host_id, 'roster': game.roster_delta()},
+                         room=room_code)
             else:
                 # Durante la partita, marca come disconnesso invece di rimuovere
                 game.mark_disconnected(sid)
                 leave_room(room_code)
                 
                 # Notifica gli altri giocatori della disconnessione
-                emit('player_disconnected', {
+                send('player_disconnected', {
                     'player_id': sid,
                     'player_name': player_name,
-                    'players': get_players_info(game),
+                    'roster': game.roster_delta(),
                     'disconnected_count': len(game.disconnected_players),
                     'active_count': game.get_active_player_count()
                 }, room=room_code)
@@ -531,14 +1359,41 @@ def on_disconnect():
                 if sid == game.host_id:
                     active_players = [pid for pid in game.player_order if pid not in game.disconnected_players]
                     if active_players:
-                        game.host_id = active_players[0]
-                        emit('new_host', {'host_id': game.host_id}, room=room_code)
+                        game.set_host(active_players[0])
+                        send('new_host', {'host_id': game.host_id, 'roster': game.roster_delta()},
+                             room=room_code)
                 
                 # Controlla se dobbiamo avanzare automaticamente
                 check_and_advance_game(game, room_code)
 
 
+def redirect_to_shard(room_code, **params):
+    """
+    Se la stanza è in un altro worker, dice al client dove andare
+    params (nome, id per il rientro) finiscono nell'URL: l'altro server ha un'altra
+    origine e non vede il localStorage di questa pagina
+    """
+    owner = remote_shard(room_code)
+    if owner is None:
+        return False
+    shard_metrics['redirected_socket'] += 1
+    query = f'?{urlencode(params)}' if params else ''
+    send('wrong_shard', {'room_code': room_code, 'url': f'{owner}/game/{room_code}{query}'})
+    return True
+
+
+@socketio.on('roster_resync')
+@room_op
+def on_roster_resync(data):
+    """Il client ha perso un aggiornamento dell'elenco giocatori: riceve quello completo"""
+    game = games.get(data.get('room_code', '').upper())
+    if game is None or request.sid not in game.players:
+        return
+    send('roster', {'version': game.roster_version, 'players': get_players_info(game)})
+
+
 @socketio.on('create_game')
+@room_op
 def on_create_game(data):
     """Crea una nuova partita"""
     player_name = data.get('player_name', 'Giocatore')
@@ -551,13 +1406,14 @@ def on_create_game(data):
     if timer_duration not in [60, 90]:
         timer_duration = 60
     
+    make_room_for_new_game()
     room_code = generate_room_code()
     game = Game(room_code, request.sid, player_name, mode, num_rounds, image_type, timer_duration)
     games[room_code] = game
     
     join_room(room_code)
     
-    emit('game_created', {
+    send('game_created', {
         'room_code': room_code,
         'player_id': request.sid,
         'is_host': True,
@@ -565,38 +1421,45 @@ def on_create_game(data):
         'image_type': image_type,
         'num_rounds': num_rounds,
         'timer_duration': timer_duration,
-        'players': get_players_info(game)
+        'players': get_players_info(game),
+        'roster_version': game.roster_version
     })
 
 
 @socketio.on('join_game')
+@room_op
 def on_join_game(data):
     """Unisciti a una partita esistente"""
     room_code = data.get('room_code', '').upper()
     player_name = data.get('player_name', 'Giocatore')
     
+    if redirect_to_shard(room_code, name=player_name):
+        return
+    
     if room_code not in games:
-        emit('error', {'message': 'Stanza non trovata!'})
+        send('error', {'message': 'Stanza non trovata!'})
         return
     
     game = games[room_code]
+    game.touch()
     
     if game.phase != 'lobby':
-        emit('error', {'message': 'Partita già iniziata!'})
+        send('error', {'message': 'Partita già iniziata!'})
         return
     
     if len(game.players) >= 8:
-        emit('error', {'message': 'Stanza piena!'})
+        send('error', {'message': 'Stanza piena!'})
         return
     
     if not game.add_player(request.sid, player_name):
-        emit('error', {'message': 'Impossibile unirsi alla partita!'})
+        send('error', {'message': 'Impossibile unirsi alla partita!'})
         return
     
     join_room(room_code)
+    roster_delta = game.roster_delta()
     
     # Notifica il nuovo giocatore
-    emit('game_joined', {
+    send('game_joined', {
         'room_code': room_code,
         'player_id': request.sid,
         'is_host': False,
@@ -604,29 +1467,35 @@ def on_join_game(data):
         'image_type': game.image_type,
         'num_rounds': game.num_rounds,
         'timer_duration': game.timer_duration,
-        'players': get_players_info(game)
+        'players': get_players_info(game),
+        'roster_version': game.roster_version
     })
     
-    # Notifica gli altri giocatori
-    emit('player_joined', {
+    # Notifica gli altri giocatori (solo il giocatore aggiunto)
+    send('player_joined', {
         'player_id': request.sid,
         'player_name': player_name,
-        'players': get_players_info(game)
-    }, room=room_code, include_self=False)
+        'roster': roster_delta
+    }, room=room_code, skip_sid=request.sid)
 
 
 @socketio.on('rejoin_game')
+@room_op
 def on_rejoin_game(data):
     """Rientra in una partita in corso dopo disconnessione"""
     room_code = data.get('room_code', '').upper()
     player_name = data.get('player_name', 'Giocatore')
     old_player_id = data.get('old_player_id', '')
     
+    if redirect_to_shard(room_code, name=player_name, rejoin=old_player_id):
+        return
+    
     if room_code not in games:
-        emit('rejoin_failed', {'message': 'Stanza non trovata!', 'reason': 'room_not_found'})
+        send('rejoin_failed', {'message': 'Stanza non trovata!', 'reason': 'room_not_found'})
         return
     
     game = games[room_code]
+    game.touch()
     
     # Cerca il giocatore disconnesso con lo stesso nome
     found_player_id = None
@@ -642,9 +1511,9 @@ def on_rejoin_game(data):
     if not found_player_id:
         # Se siamo in lobby, permetti di unirsi normalmente
         if game.phase == 'lobby':
-            emit('rejoin_failed', {'message': 'Puoi unirti normalmente dalla lobby', 'reason': 'use_normal_join'})
+            send('rejoin_failed', {'message': 'Puoi unirti normalmente dalla lobby', 'reason': 'use_normal_join'})
         else:
-            emit('rejoin_failed', {'message': 'Non sei stato trovato nella partita', 'reason': 'player_not_found'})
+            send('rejoin_failed', {'message': 'Non sei stato trovato nella partita', 'reason': 'player_not_found'})
         return
     
     # Riconnetti il giocatore con il nuovo sid
@@ -652,53 +1521,11 @@ def on_rejoin_game(data):
     old_sid = found_player_id
     
     # Trasferisci i dati del giocatore dal vecchio sid al nuovo
-    player_data = game.players[old_sid].copy()
-    del game.players[old_sid]
-    game.players[new_sid] = player_data
-    
-    # Aggiorna player_order
-    if old_sid in game.player_order:
-        idx = game.player_order.index(old_sid)
-        game.player_order[idx] = new_sid
-    
-    # Aggiorna player_sids
-    if old_sid in game.player_sids:
-        del game.player_sids[old_sid]
-    game.player_sids[new_sid] = new_sid
-    
-    # Trasferisci meme e voti se esistono
-    if old_sid in game.memes:
-        game.memes[new_sid] = game.memes.pop(old_sid)
-    if old_sid in game.templates:
-        game.templates[new_sid] = game.templates.pop(old_sid)
-    if old_sid in game.meme_changes:
-        game.meme_changes[new_sid] = game.meme_changes.pop(old_sid)
-    if old_sid in game.round_scores:
-        game.round_scores[new_sid] = game.round_scores.pop(old_sid)
-    if old_sid in game.votes_for_current:
-        game.votes_for_current[new_sid] = game.votes_for_current.pop(old_sid)
-    
-    # Aggiorna meme_order se presente
-    if old_sid in game.meme_order:
-        idx = game.meme_order.index(old_sid)
-        game.meme_order[idx] = new_sid
-    
-    # Aggiorna votes
-    if old_sid in game.votes:
-        game.votes[new_sid] = game.votes.pop(old_sid)
-    for creator_id in game.votes:
-        if old_sid in game.votes[creator_id]:
-            game.votes[creator_id][new_sid] = game.votes[creator_id].pop(old_sid)
-    
-    # Rimuovi dalla lista disconnessi
-    game.mark_connected(old_sid)
-    game.disconnected_players.discard(new_sid)
-    
-    # Aggiorna host se necessario
-    if game.host_id == old_sid:
-        game.host_id = new_sid
+    game.reconnect_player(old_sid, new_sid)
+    player_data = game.players[new_sid]
     
     join_room(room_code)
+    roster_delta = game.roster_delta()
     
     # Prepara lo stato corrente del gioco per il giocatore riconnesso
     game_state = {
@@ -710,9 +1537,12 @@ def on_rejoin_game(data):
         'num_rounds': game.num_rounds,
         'timer_duration': game.timer_duration,
         'players': get_players_info(game),
+        'roster_version': game.roster_version,
         'phase': game.phase,
         'current_round': game.current_round,
-        'total_rounds': game.num_rounds
+        'total_rounds': game.num_rounds,
+        'deadline': game.deadline,
+        'time_left': game.time_left()
     }
     
     # Aggiungi dati specifici in base alla fase
@@ -726,34 +1556,36 @@ def on_rejoin_game(data):
         game_state['current_meme'] = current_meme
         game_state['has_voted'] = new_sid in game.votes_for_current
     
-    emit('rejoin_success', game_state)
+    send('rejoin_success', game_state)
     
     # Notifica gli altri giocatori della riconnessione
-    emit('player_reconnected', {
+    send('player_reconnected', {
         'player_id': new_sid,
         'player_name': player_data['name'],
-        'players': get_players_info(game),
+        'roster': roster_delta,
         'disconnected_count': len(game.disconnected_players)
-    }, room=room_code, include_self=False)
+    }, room=room_code, skip_sid=request.sid)
 
 
 @socketio.on('start_game')
+@room_op
 def on_start_game(data):
     """Inizia la partita"""
     room_code = data.get('room_code')
     
     if room_code not in games:
-        emit('error', {'message': 'Stanza non trovata!'})
+        send('error', {'message': 'Stanza non trovata!'})
         return
     
     game = games[room_code]
+    game.touch()
     
     if request.sid != game.host_id:
-        emit('error', {'message': 'Solo l\'host può avviare la partita!'})
+        send('error', {'message': 'Solo l\'host può avviare la partita!'})
         return
     
     if len(game.players) < 2:
-        emit('error', {'message': 'Servono almeno 2 giocatori!'})
+        send('error', {'message': 'Servono almeno 2 giocatori!'})
         return
     
     # Inizia il primo round
@@ -762,49 +1594,54 @@ def on_start_game(data):
     # Invia i template a ogni giocatore attivo
     for pid in game.players:
         if pid not in game.disconnected_players:
-            emit('round_start', {
+            send('round_start', {
                 'round': game.current_round,
                 'total_rounds': game.num_rounds,
                 'template': game.templates[pid],
                 'theme': game.current_theme,
                 'mode': game.mode,
-                'timer_duration': game.timer_duration
+                'timer_duration': game.timer_duration,
+                'deadline': game.deadline,
+                'time_left': game.time_left()
             }, room=pid)
 
 
 @socketio.on('request_new_meme')
+@room_op
 def on_request_new_meme(data):
     """Richiede un nuovo meme (cambio template)"""
     room_code = data.get('room_code')
     
     if room_code not in games:
-        emit('error', {'message': 'Stanza non trovata!'})
+        send('error', {'message': 'Stanza non trovata!'})
         return
     
     game = games[room_code]
+    game.touch()
     player_id = request.sid
     
     # Controlla se il giocatore ha cambi disponibili
     changes_left = game.meme_changes.get(player_id, 0)
     if changes_left <= 0:
-        emit('error', {'message': 'Hai esaurito i cambi meme!'})
+        send('error', {'message': 'Hai esaurito i cambi meme!'})
         return
     
     # Decrementa il contatore
     game.meme_changes[player_id] = changes_left - 1
     
     # Genera un nuovo template
-    new_template = templates_db.get_random_template(game.image_type)
+    new_template = game.dealer.deal_one()
     game.templates[player_id] = new_template
     
     # Invia il nuovo template al giocatore
-    emit('new_meme', {
+    send('new_meme', {
         'template': new_template,
         'changes_left': game.meme_changes[player_id]
     })
 
 
 @socketio.on('submit_meme')
+@room_op
 def on_submit_meme(data):
     """Sottometti un meme"""
     room_code = data.get('room_code')
@@ -813,25 +1650,26 @@ def on_submit_meme(data):
     text2 = data.get('text2', '').strip()
     
     if room_code not in games:
-        emit('error', {'message': 'Stanza non trovata!'})
+        send('error', {'message': 'Stanza non trovata!'})
         return
     
     if not text1 and not text2:
-        emit('error', {'message': 'Scrivi almeno un testo!'})
+        send('error', {'message': 'Scrivi almeno un testo!'})
         return
     
     game = games[room_code]
+    game.touch()
     all_submitted = game.submit_meme(request.sid, caption, text1, text2)
     
     # Conta solo i meme dei giocatori attivi
-    active_memes = sum(1 for pid in game.get_active_players() if pid in game.memes)
+    active_memes = game.active_submitted
     
     # Notifica che il giocatore ha finito
-    emit('player_ready', {
+    send_progress('player_ready', {
         'player_id': request.sid,
         'ready_count': active_memes,
         'total_players': game.get_active_player_count()
-    }, room=room_code)
+    }, room_code)
     
     # Se tutti i giocatori attivi hanno sottomesso, inizia la votazione
     if all_submitted:
@@ -840,12 +1678,15 @@ def on_submit_meme(data):
         # Invia il primo meme a tutti
         current_meme = game.get_current_meme()
         
-        emit('voting_start', {
-            'current_meme': current_meme
+        send('voting_start', {
+            'current_meme': current_meme,
+            'deadline': game.deadline,
+            'time_left': game.time_left()
         }, room=room_code)
 
 
 @socketio.on('submit_vote')
+@room_op
 def on_submit_vote(data):
     """Sottometti un voto per il meme corrente"""
     room_code = data.get('room_code')
@@ -853,25 +1694,26 @@ def on_submit_vote(data):
     super_vote = data.get('super_vote', False)  # +3 punti extra
     
     if room_code not in games:
-        emit('error', {'message': 'Stanza non trovata!'})
+        send('error', {'message': 'Stanza non trovata!'})
         return
     
     game = games[room_code]
+    game.touch()
     valid, all_voted = game.submit_vote_for_meme(request.sid, vote_value, super_vote)
     
     if not valid:
-        emit('error', {'message': 'Errore nel voto!'})
+        send('error', {'message': 'Errore nel voto!'})
         return
     
     # Conta solo i voti dei giocatori attivi
-    active_votes = sum(1 for pid in game.get_active_players() if pid in game.votes_for_current)
+    active_votes = game.active_voted
     
     # Notifica che il giocatore ha votato
-    emit('player_voted', {
+    send_progress('player_voted', {
         'player_id': request.sid,
         'vote_count': active_votes,
         'total_players': game.get_active_player_count()
-    }, room=room_code)
+    }, room_code)
     
     # Se tutti i giocatori attivi hanno votato per questo meme, passa al prossimo
     if all_voted:
@@ -882,30 +1724,35 @@ def on_submit_vote(data):
         else:
             # Invia il prossimo meme a tutti
             current_meme = game.get_current_meme()
-            emit('next_meme_to_vote', {
-                'current_meme': current_meme
+            send('next_meme_to_vote', {
+                'current_meme': current_meme,
+                'deadline': game.deadline,
+                'time_left': game.time_left()
             }, room=room_code)
 
 
 @socketio.on('next_round')
+@room_op
 def on_next_round(data):
     """Passa al prossimo round"""
     room_code = data.get('room_code')
     
     if room_code not in games:
-        emit('error', {'message': 'Stanza non trovata!'})
+        send('error', {'message': 'Stanza non trovata!'})
         return
     
     game = games[room_code]
+    game.touch()
     
     if request.sid != game.host_id:
-        emit('error', {'message': 'Solo l\'host può continuare!'})
+        send('error', {'message': 'Solo l\'host può continuare!'})
         return
     
     if game.is_game_over():
         # Torna alla lobby
         game.phase = 'lobby'
         game.current_round = 0
+        game.clear_deadline()
         # Rimuovi i giocatori disconnessi quando si torna in lobby
         for pid in list(game.disconnected_players):
             game.remove_player(pid)
@@ -915,9 +1762,10 @@ def on_next_round(data):
         for pid in game.players:
             game.players[pid]['score'] = 0
             game.players[pid]['ready'] = False
+        game.mark_roster(*game.players)
         
-        emit('back_to_lobby', {
-            'players': get_players_info(game)
+        send('back_to_lobby', {
+            'roster': game.roster_delta()
         }, room=room_code)
     else:
         # Prossimo round
@@ -926,48 +1774,58 @@ def on_next_round(data):
         # Invia solo ai giocatori attivi (non disconnessi)
         for pid in game.players:
             if pid not in game.disconnected_players:
-                emit('round_start', {
+                send('round_start', {
                     'round': game.current_round,
                     'total_rounds': game.num_rounds,
                     'template': game.templates[pid],
                     'theme': game.current_theme,
                     'mode': game.mode,
-                    'timer_duration': game.timer_duration
+                    'timer_duration': game.timer_duration,
+                    'deadline': game.deadline,
+                    'time_left': game.time_left()
                 }, room=pid)
 
 
 @socketio.on('force_advance')
+@room_op
 def on_force_advance(data):
     """Forza l'avanzamento del gioco (solo admin)"""
     room_code = data.get('room_code')
     
     if room_code not in games:
-        emit('error', {'message': 'Stanza non trovata!'})
+        send('error', {'message': 'Stanza non trovata!'})
         return
     
     game = games[room_code]
+    game.touch()
     
     if request.sid != game.host_id:
-        emit('error', {'message': 'Solo l\'host può forzare l\'avanzamento!'})
+        send('error', {'message': 'Solo l\'host può forzare l\'avanzamento!'})
         return
     
+    force_advance_game(game, room_code)
+
+
+def get_players_info(game):
+    """Elenco completo dei giocatori (alla creazione, all'ingresso e su richiesta)"""
+    return [game.roster_entry(pid) for pid in game.player_order if pid in game.players]
+
+
+def force_advance_game(game, room_code):
+    """Chiude la fase corrente anche se qualcuno non ha finito (host o scadenza del tempo)"""
     # Fase creazione: passa alla votazione
     if game.phase == 'creating':
         # Crea meme vuoti per chi non ha sottomesso
-        for pid in game.get_active_players():
-            if pid not in game.memes:
-                game.memes[pid] = {
-                    'caption': '...',
-                    'text1': '...',
-                    'text2': ''
-                }
+        game.fill_missing_memes()
         
         game.start_voting()
         current_meme = game.get_current_meme()
         
         if current_meme:
-            emit('voting_start', {
-                'current_meme': current_meme
+            send('voting_start', {
+                'current_meme': current_meme,
+                'deadline': game.deadline,
+                'time_left': game.time_left()
             }, room=room_code)
         else:
             advance_to_results(game, room_code)
@@ -975,9 +1833,7 @@ def on_force_advance(data):
     # Fase votazione: passa al prossimo meme o ai risultati
     elif game.phase == 'voting':
         # Considera come votati tutti i giocatori attivi che non hanno ancora votato
-        for pid in game.get_active_players():
-            if pid not in game.votes_for_current:
-                game.votes_for_current[pid] = True
+        game.mark_all_voted()
         
         voting_complete = game.next_meme()
         
@@ -985,25 +1841,13 @@ def on_force_advance(data):
             advance_to_results(game, room_code)
         else:
             current_meme = game.get_current_meme()
-            emit('next_meme_to_vote', {
-                'current_meme': current_meme
+            send('next_meme_to_vote', {
+                'current_meme': current_meme,
+                'deadline': game.deadline,
+                'time_left': game.time_left()
             }, room=room_code)
 
 
-def get_players_info(game):
-    """Ottiene le informazioni sui giocatori"""
-    return [
-        {
-            'player_id': pid,
-            'name': game.players[pid]['name'],
-            'score': game.players[pid]['score'],
-            'is_host': pid == game.host_id,
-            'disconnected': pid in game.disconnected_players
-        }
-        for pid in game.player_order if pid in game.players
-    ]
-
-
 def check_and_advance_game(game, room_code):
     """Controlla se il gioco può avanzare automaticamente dopo una disconnessione"""
     
@@ -1019,8 +1863,10 @@ def check_and_advance_game(game, room_code):
             current_meme = game.get_current_meme()
             
             if current_meme:
-                emit('voting_start', {
-                    'current_meme': current_meme
+                send('voting_start', {
+                    'current_meme': current_meme,
+                    'deadline': game.deadline,
+                    'time_left': game.time_left()
                 }, room=room_code)
             else:
                 # Nessun meme da votare, vai ai risultati
@@ -1035,8 +1881,10 @@ def check_and_advance_game(game, room_code):
                 advance_to_results(game, room_code)
             else:
                 current_meme = game.get_current_meme()
-                emit('next_meme_to_vote', {
-                    'current_meme': current_meme
+                send('next_meme_to_vote', {
+                    'current_meme': current_meme,
+                    'deadline': game.deadline,
+                    'time_left': game.time_left()
                 }, room=room_code)
 
 
@@ -1048,6 +1896,7 @@ def advance_to_results(game, room_code):
     for pid, score in game.round_scores.items():
         if pid in game.players:
             game.players[pid]['score'] += score
+            game.mark_roster(pid)
     
     # Prepara i risultati del round
     round_results = []
@@ -1071,7 +1920,7 @@ def advance_to_results(game, room_code):
     is_final = game.is_game_over()
     winner = game.get_winner() if is_final else None
     
-    emit('round_results', {
+    send('round_results', {
         'results': round_results,
         'is_final': is_final,
         'winner': {'player_id': winner[0], 'name': winner[1], 'score': winner[2]} if winner else None,
@@ -1086,10 +1935,12 @@ if __name__ == '__main__':
     os.makedirs('web/static/css', exist_ok=True)
     os.makedirs('web/static/js', exist_ok=True)
     
+    port = int(os.environ.get('PORT', 5001))
+    
     print("\n🎮 Make it Meme - Web Edition")
     print("=" * 40)
-    print("Avvia il browser su: http://localhost:5001")
+    print(f"Avvia il browser su: http://localhost:{port}")
     print("=" * 40 + "\n")
     
-    socketio.run(app, host='0.0.0.0', port=5001, debug=True)
+    socketio.run(app, host='0.0.0.0', port=port, debug=True)
 